@@ -6,30 +6,54 @@ Flask backend for the web interface
 
 import json
 import logging
+import mimetypes
 import os
 import random
 import re
-import sqlite3
 import subprocess
 import sys
-from contextlib import contextmanager
+import threading
+import time
+import uuid
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime
 from pathlib import Path
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, abort, g, jsonify, request, send_file, send_from_directory
+from werkzeug.security import safe_join
+
+import assets
+from catalog import TaskCatalog
+from db import (LAB_STATS_QUERIES, STATS_QUERIES, Database, decode_cursor, encode_cursor,
+                insert_result_details, load_result_details, rebuild_rollups, result_details_error,
+                update_rollups)
+from discovery import discover
+from fingerprint import ResultCache
+from grader import GradingEngine, GradingError, summarize, summarize_task
+from jobs import JobManager
+from labs import DEFAULT_LAB, LAB_COLUMNS, LAB_ID_RE, LabStore
+import metrics
+from monitor import NodeMonitor
+from reboot import REBOOT_STATES, RebootManager
+from scheduler import GradingScheduler, task_result
+from session import GradingSession, SessionManager
+from settings import ConfigStore, LabConfig
+from sshpool import SSH_CONTROL_DIR, SSHPool
 
 # Environment configuration
 DEBUG = os.environ.get('FLASK_DEBUG', 'false').lower() in ('true', '1', 'yes')
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG' if DEBUG else 'INFO').upper()
 
 # Subprocess timeouts (seconds)
-TIMEOUT_LIST_TASKS = 30
 TIMEOUT_GRADER = 300  # 5 minutes for full grading
 TIMEOUT_SINGLE_TASK = 60  # 1 minute per task
-TIMEOUT_SSH_CHECK = 10
 
-# Configure logging
-LOG_FILE = Path(__file__).parent.parent / 'api.log'
+# Grading concurrency: worker pool size and concurrent sessions per node
+GRADER_WORKERS = 8
+GRADER_NODE_CONCURRENCY = 4
+
+# Configure logging; RHCSA_LOG writes the log file elsewhere
+LOG_FILE = Path(os.environ.get('RHCSA_LOG', Path(__file__).parent.parent / 'api.log'))
 logging.basicConfig(
     level=getattr(logging, LOG_LEVEL, logging.INFO),
     format='%(asctime)s [%(levelname)s] %(message)s',
@@ -43,73 +67,139 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__, static_folder='../static', static_url_path='')
 
 BASE_DIR = Path(__file__).parent.parent
-GRADER_SCRIPT = BASE_DIR / 'exam-grader.sh'
-CONFIG_FILE = BASE_DIR / 'config'
+# RHCSA_CONFIG points the API (and exam-grader.sh) at another config file
+CONFIG_FILE = Path(os.environ.get('RHCSA_CONFIG', BASE_DIR / 'config'))
 CONFIG_EXAMPLE = BASE_DIR / 'config.example'
-DB_FILE = BASE_DIR / 'results.db'
-
-
-def init_db():
-    """Initialize SQLite database for storing results."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS results (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            mode TEXT NOT NULL,
-            score INTEGER NOT NULL,
-            total INTEGER NOT NULL,
-            passed INTEGER NOT NULL,
-            duration_seconds INTEGER,
-            categories TEXT NOT NULL,
-            checks TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-
-def get_db():
-    """Get database connection."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
-@contextmanager
-def db_connection():
-    """Context manager for database connections."""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
+# RHCSA_DB keeps results (and the state workers share) in another database file
+DB_FILE = Path(os.environ.get('RHCSA_DB', BASE_DIR / 'results.db'))
+STATIC_DIR = BASE_DIR / 'static'
 
+# Built assets (make assets) have content-hashed names: cached for good
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+HASHED_ASSET_RE = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+if not DEBUG and assets.built_page(STATIC_DIR) is None:
+    logger.warning("Static assets are not built or out of date (make assets): serving the source files")
+
+# Shared multiplexed SSH connections to the nodes
+ssh_pool = SSHPool()
+
+# Results database (pooled WAL connections); created or migrated on startup.
+# It also holds what the worker processes of a multi-process deployment
+# share: grading jobs, sessions, reboots, node status and task results
+results_db = Database(DB_FILE)
+results_db.init()
+
+# Task definitions, parsed once and re-read only when a check script changes
+task_catalog = TaskCatalog(BASE_DIR / 'checks')
+
+# In-process grader; node slots are lock files so the per-node cap holds across workers
+grading_engine = GradingEngine(task_catalog, ssh_pool, base_dir=BASE_DIR,
+                               results=ResultCache(db=results_db))
+grading_scheduler = GradingScheduler(grading_engine, max_workers=GRADER_WORKERS,
+                                     per_node=GRADER_NODE_CONCURRENCY,
+                                     slot_dir=SSH_CONTROL_DIR / 'slots')
+grading_jobs = JobManager(grading_scheduler, db=results_db)
+# Grading sessions clients reuse across per-task requests
+grading_sessions = SessionManager(db=results_db)
+
+# Node reboots, followed in the background
+node_reboots = RebootManager(ssh_pool, db=results_db)
+
+
+# Parsed config, re-read only when the file changes; all writes go through it
+config_store = ConfigStore(CONFIG_FILE)
+
+# Lab environments besides the config file's (fleet mode), stored in the database
+lab_store = LabStore(results_db)
+
+# Node reachability per lab (None is the config file's), kept current in the
+# background once first asked for
+node_monitors = {None: NodeMonitor(ssh_pool, config_store.load, db=results_db, lab=DEFAULT_LAB)}
+node_monitors_lock = threading.Lock()
+
+
+def lab_monitor(lab_id):
+    """NodeMonitor of a lab, created on first use."""
+    with node_monitors_lock:
+        if lab_id not in node_monitors:
+            node_monitors[lab_id] = NodeMonitor(ssh_pool, lambda: lab_store.get(lab_id) or LabConfig(),
+                                                db=results_db, lab=lab_id)
+        return node_monitors[lab_id]
+
+
+def request_lab():
+    """Lab named by ?lab= or "lab" in the body; the config file's lab by default.
+
+    Returns (lab id or None for the config file, LabConfig, error response or None).
+    """
+    data = request.get_json(silent=True) or {}
+    lab_id = request.args.get('lab') or data.get('lab')
+    if not lab_id or lab_id == DEFAULT_LAB:
+        return None, config_store.load(), None
+    config = lab_store.get(lab_id)
+    if config is None:
+        return lab_id, None, (jsonify({'error': 'Lab not found', 'message': f'Unknown lab {lab_id}'}), 404)
+    return lab_id, config, None
+
+
+# Grading work waiting for a worker, per lab
+metrics.Gauge('rhcsa_grading_queued', 'Grading units waiting for a worker.', ('lab',),
+              collect=lambda: {(lab or DEFAULT_LAB,): n for lab, n in grading_scheduler.pending().items()})
+
+
+@app.before_request
+def start_timer():
+    g.started = time.monotonic()
+
+
+@app.after_request
+def record_request(response):
+    """Request count and latency per endpoint (the route pattern, not the URL)."""
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+    if 'started' in g:
+        metrics.HTTP_LATENCY.observe(time.monotonic() - g.started, method=request.method, endpoint=endpoint)
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Counters and histograms in the Prometheus text format."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-def parse_grader_json(output):
-    """Parse JSON output from grader script, handling formatting quirks."""
-    try:
-        return json.loads(output)
-    except json.JSONDecodeError:
-        # Try cleaning up common formatting issues
-        cleaned = output.replace('\n,', ',').replace(',]', ']').replace(',}', '}')
-        return json.loads(cleaned)
 
+def send_static(path, cache_control='no-cache'):
+    """Send a static file, precompressed (.br/.gz) if the client accepts it.
 
-# Initialize DB on startup
-init_db()
+    no-cache still lets clients keep the file; they revalidate it by ETag.
+    """
+    found, coding = assets.negotiate(path, lambda coding: request.accept_encodings[coding] > 0)
+    if found is None:
+        abort(404)
+    response = send_file(found, mimetype=mimetypes.guess_type(path.name)[0], conditional=True)
+    if coding:
+        response.headers['Content-Encoding'] = coding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    return response
 
 
 @app.route('/')
 def index():
-    """Serve the main page."""
-    return send_from_directory(app.static_folder, 'index.html')
+    """Serve the main page: the built one (bundled assets) unless it is missing or stale."""
+    page = None if DEBUG else assets.built_page(STATIC_DIR)
+    if page is None:
+        return send_from_directory(app.static_folder, 'index.html')
+    return send_static(page)
+
+
+@app.route(f'/{assets.ASSETS_DIR}/<path:filename>')
+def built_asset(filename):
+    """Serve a built asset; content-hashed ones are immutable."""
+    path = safe_join(str(STATIC_DIR / assets.ASSETS_DIR), filename)
+    if path is None:
+        abort(404)
+    return send_static(Path(path), IMMUTABLE_CACHE if HASHED_ASSET_RE.search(filename) else 'no-cache')
 
 
 @app.route('/favicon.svg')
@@ -120,67 +210,19 @@ def favicon():
 
 @app.route('/api/tasks', methods=['GET'])
 def list_tasks():
-    """List all available tasks."""
-    logger.debug("list_tasks called")
-    try:
-        result = subprocess.run(
-            [str(GRADER_SCRIPT), '--list-tasks', '--json'],
-            capture_output=True,
-            text=True,
-            cwd=str(BASE_DIR),
-            timeout=TIMEOUT_LIST_TASKS
-        )
-    except subprocess.TimeoutExpired:
-        logger.error("list_tasks timed out")
-        return jsonify({'error': 'Request timed out'}), 504
-
-    if result.returncode != 0:
-        logger.error(f"list_tasks failed: {result.stderr}")
-        return jsonify({'error': result.stderr}), 500
-
-    try:
-        tasks = parse_grader_json(result.stdout)
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse task list: {e}")
-        return jsonify({'error': 'Failed to parse task list'}), 500
-
-    logger.debug(f"Returning {len(tasks)} tasks")
-    return jsonify(tasks)
+    """List all available tasks, optionally filtered by ?category= and ?target=."""
+    category = request.args.get('category')
+    target = request.args.get('target')
+    logger.debug(f"list_tasks called: category={category}, target={target}")
+    if category is None and target is None:
+        return Response(task_catalog.json(), mimetype='application/json')
+    return jsonify(task_catalog.entries(category=category, target=target))
 
 
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """Get current configuration."""
-    config = {
-        'node1': 'rhcsa1',
-        'node1_ip': '',
-        'node2': 'rhcsa2',
-        'node2_ip': '',
-        'has_password': False
-    }
-
-    if CONFIG_FILE.exists():
-        with open(CONFIG_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('#') or '=' not in line:
-                    continue
-                key, value = line.split('=', 1)
-                key = key.strip().lower()
-                value = value.strip().strip('"\'')
-                if key == 'node1':
-                    config['node1'] = value
-                elif key == 'node1_ip':
-                    config['node1_ip'] = value
-                elif key == 'node2':
-                    config['node2'] = value
-                elif key == 'node2_ip':
-                    config['node2_ip'] = value
-                elif key == 'root_password':
-                    # Don't expose password, just indicate if set
-                    config['has_password'] = bool(value)
-
-    return jsonify(config)
+    return jsonify(config_store.load().public())
 
 
 def sanitize_config_value(value):
@@ -215,90 +257,134 @@ def validate_hostname(name):
     return bool(re.match(pattern, name))
 
 
+# Node settings a new config or lab starts from
+NODE_DEFAULTS = {'node1': 'rhcsa1', 'node1_ip': '', 'node2': 'rhcsa2', 'node2_ip': '', 'root_password': ''}
+
+
+def node_settings_from(data, defaults=NODE_DEFAULTS):
+    """Sanitized and validated node settings (LAB_COLUMNS keys) from a request body.
+
+    Keys missing from data take their value from defaults, or are left out
+    if defaults has none. Returns (values, error message or None).
+    """
+    values = {key: sanitize_config_value(data.get(key, defaults.get(key)))
+              for key in LAB_COLUMNS if key in data or key in defaults}
+    for node in ('node1', 'node2'):
+        if node in values and not validate_hostname(values[node]):
+            return None, f'Invalid {node} hostname'
+        if values.get(f'{node}_ip') and not validate_ip(values[f'{node}_ip']):
+            return None, f'Invalid {node} IP address'
+    return values, None
+
+
 @app.route('/api/config', methods=['POST'])
 def save_config():
     """Save configuration."""
-    data = request.json or {}
-
-    # Validate and sanitize inputs
-    node1 = sanitize_config_value(data.get('node1', 'rhcsa1'))
-    node2 = sanitize_config_value(data.get('node2', 'rhcsa2'))
-    node1_ip = sanitize_config_value(data.get('node1_ip', ''))
-    node2_ip = sanitize_config_value(data.get('node2_ip', ''))
-    root_password = sanitize_config_value(data.get('root_password', ''))
-
-    # Validate hostnames
-    if not validate_hostname(node1):
-        return jsonify({'error': 'Invalid node1 hostname'}), 400
-    if not validate_hostname(node2):
-        return jsonify({'error': 'Invalid node2 hostname'}), 400
-
-    # Validate IPs if provided
-    if node1_ip and not validate_ip(node1_ip):
-        return jsonify({'error': 'Invalid node1 IP address'}), 400
-    if node2_ip and not validate_ip(node2_ip):
-        return jsonify({'error': 'Invalid node2 IP address'}), 400
+    values, error = node_settings_from(request.json or {})
+    if error:
+        return jsonify({'error': error}), 400
 
     # If password not provided, preserve existing
-    if not root_password and CONFIG_FILE.exists():
-        with open(CONFIG_FILE) as f:
-            for line in f:
-                if line.strip().startswith('ROOT_PASSWORD='):
-                    root_password = line.split('=', 1)[1].strip().strip('"\'')
-                    break
-
-    config_content = f'''# RHCSA Practice Labs Configuration
-NODE1="{node1}"
-NODE1_IP="{node1_ip}"
-NODE2="{node2}"
-NODE2_IP="{node2_ip}"
-ROOT_PASSWORD="{root_password}"
-'''
-
-    with open(CONFIG_FILE, 'w') as f:
-        f.write(config_content)
+    if not values['root_password'] and config_store.load().exists:
+        del values['root_password']
+    config_store.update({LAB_COLUMNS[key]: value for key, value in values.items()})
 
     return jsonify({'status': 'ok'})
 
 
-@app.route('/api/test-connection', methods=['POST'])
-def test_connection():
-    """Test SSH connectivity to nodes."""
-    data = request.json or {}
-    target = data.get('target') # node1, node2, or None (both)
-    
-    cmd = [str(GRADER_SCRIPT), '--check-ssh']
-    if target in ('node1', 'node2'):
-        cmd.append(f"--target={target}")
+@app.route('/api/labs', methods=['GET'])
+def list_labs():
+    """Every lab, the config file's ('default') first, with its queued grading work."""
+    queued = grading_scheduler.pending()
+    labs = [{'id': DEFAULT_LAB, 'name': 'Config file', **config_store.load().public()}, *lab_store.list()]
+    for lab in labs:
+        lab['queued'] = queued.get(None if lab['id'] == DEFAULT_LAB else lab['id'], 0)
+    return jsonify({'labs': labs})
 
-    try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            cwd=str(BASE_DIR),
-            timeout=TIMEOUT_SSH_CHECK
-        )
-    except subprocess.TimeoutExpired:
-        return jsonify({
-            'node1': False,
-            'node2': False,
-            'ok': False,
-            'error': 'SSH check timed out'
-        }), 504
 
-    try:
-        ssh_results = json.loads(result.stdout)
-    except json.JSONDecodeError:
-        return jsonify({
-            'node1': False,
-            'node2': False,
-            'ok': False,
-            'error': 'Failed to parse SSH check output'
-        }), 500
+@app.route('/api/labs', methods=['POST'])
+def create_lab():
+    """Add a lab: a node pair with its own addresses and root password.
 
-    node1_ok = next((n.get('ok', False) for n in ssh_results if n['node'] == 'node1'), False)
-    node2_ok = next((n.get('ok', False) for n in ssh_results if n['node'] == 'node2'), False)
+    Body: id (generated if left out), name, node1, node1_ip, node2,
+    node2_ip, root_password. Pass the id as ?lab= (or "lab") to grade,
+    reboot or test the connection of this lab.
+    """
+    data = request.json or {}
+    lab_id = str(data.get('id') or uuid.uuid4().hex[:12])
+    if lab_id == DEFAULT_LAB or not LAB_ID_RE.match(lab_id):
+        return jsonify({'error': 'Invalid lab id',
+                        'message': 'Use up to 63 lowercase letters, digits, "-" and "_"'}), 400
+    values, error = node_settings_from(data)
+    if error:
+        return jsonify({'error': error}), 400
+    if not lab_store.create(lab_id, sanitize_config_value(data.get('name')), values):
+        return jsonify({'error': 'Lab exists', 'message': f'Lab {lab_id} already exists'}), 409
+    return jsonify(lab_store.describe(lab_id)), 201
+
+
+@app.route('/api/labs/<lab_id>', methods=['GET'])
+def get_lab(lab_id):
+    """One lab (never with its password)."""
+    if lab_id == DEFAULT_LAB:
+        return jsonify({'id': DEFAULT_LAB, 'name': 'Config file', **config_store.load().public()})
+    lab = lab_store.describe(lab_id)
+    if not lab:
+        return jsonify({'error': 'Lab not found'}), 404
+    return jsonify(lab)
+
+
+@app.route('/api/labs/<lab_id>', methods=['PUT'])
+def update_lab(lab_id):
+    """Change some settings of a lab; an empty root_password keeps the current one."""
+    if lab_id == DEFAULT_LAB:
+        return jsonify({'error': 'Use /api/config to change the default lab'}), 400
+    data = request.json or {}
+    values, error = node_settings_from(data, defaults={})
+    if error:
+        return jsonify({'error': error}), 400
+    if not values.get('root_password'):
+        values.pop('root_password', None)
+    if lab_store.update(lab_id, values, name=sanitize_config_value(data.get('name'))) is None:
+        return jsonify({'error': 'Lab not found'}), 404
+    return jsonify(lab_store.describe(lab_id))
+
+
+@app.route('/api/labs/<lab_id>', methods=['DELETE'])
+def delete_lab(lab_id):
+    """Remove a lab; its stored results are kept."""
+    if lab_id == DEFAULT_LAB or not lab_store.delete(lab_id):
+        return jsonify({'error': 'Lab not found'}), 404
+    with node_monitors_lock:
+        monitor = node_monitors.pop(lab_id, None)
+    if monitor:
+        monitor.stop()
+    return jsonify({'status': 'deleted', 'id': lab_id})
+
+
+@app.route('/api/test-connection', methods=['POST'])
+def test_connection():
+    """SSH connectivity of the nodes, from the monitor's cache (?fresh=1 probes now)."""
+    data = request.get_json(silent=True) or {}
+    target = data.get('target') # node1, node2, or None (both)
+    fresh = request.args.get('fresh') in ('1', 'true') or bool(data.get('fresh'))
+
+    lab_id, config, error = request_lab()
+    if error:
+        return error
+    status = lab_monitor(lab_id).status(fresh=fresh)
+    ssh_results = []
+    for node in ('node1', 'node2'):
+        if target in ('node1', 'node2') and target != node:
+            ssh_results.append({'node': node, 'ok': False, 'skipped': True})
+            continue
+        state = status[node]
+        ssh_results.append({'node': node, 'ok': state['ok'],
+                            'target': state['target'] or config.settings.get(node.upper()) or config.node_ip(node),
+                            'checked_at': state['checked_at'], 'age': state['age']})
+
+    node1_ok = ssh_results[0]['ok']
+    node2_ok = ssh_results[1]['ok']
 
     return jsonify({
         'node1': node1_ok,
@@ -310,105 +396,177 @@ def test_connection():
 
 @app.route('/api/reboot-vm', methods=['POST'])
 def reboot_vm():
-    """Reboot a specific VM and wait for it to come back online."""
-    import time
+    """Start rebooting a VM; returns a reboot id whose progress can be followed.
 
+    The reboot runs in the background and goes through the states sent,
+    down, booting, sshd-up and ready (or failed). Subscribe to
+    /api/reboots/<id>/events, or poll /api/reboots/<id>. Pass "wait": true
+    to block until the node is back instead.
+    """
     data = request.get_json() or {}
     target = data.get('node', 'node1')  # Default to node1
 
     if target not in ('node1', 'node2'):
         return jsonify({'error': 'Invalid node. Use "node1" or "node2"'}), 400
 
-    logger.info(f"Rebooting {target}")
-
-    # Load config
-    if not CONFIG_FILE.exists():
+    lab_id, config, error = request_lab()
+    if error:
+        return error
+    if not config.exists:
         return jsonify({'error': 'Config file not found'}), 400
 
-    config = {}
-    with open(CONFIG_FILE) as f:
-        for line in f:
-            line = line.strip()
-            if line.startswith('#') or '=' not in line:
-                continue
-            key, value = line.split('=', 1)
-            config[key.strip()] = value.strip().strip('"\'')
-
-    node_ip = config.get(f'{target.upper()}_IP', '')
-    password = config.get('ROOT_PASSWORD', '')
+    node_ip = config.node_ip(target)
+    password = config.root_password
 
     if not node_ip:
         return jsonify({'error': f'{target} IP not configured'}), 400
     if not password:
         return jsonify({'error': 'Root password not configured'}), 400
 
-    result = {'node': target, 'rebooted': False, 'online': False}
+    reboot, created = node_reboots.start(target, node_ip, password, options=['StrictHostKeyChecking=no'],
+                                         lab=lab_id)
+    if created:
+        logger.info(f"Rebooting {target} ({node_ip}): reboot {reboot.id}")
 
-    # Send reboot command
-    try:
-        reboot_cmd = ['sshpass', '-p', password, 'ssh', '-o', 'ConnectTimeout=10',
-                      '-o', 'StrictHostKeyChecking=no', f'root@{node_ip}',
-                      'nohup reboot &>/dev/null &']
-        subprocess.run(reboot_cmd, timeout=15, capture_output=True)
-        result['rebooted'] = True
-        logger.info(f"Reboot command sent to {target} ({node_ip})")
-    except Exception as e:
-        logger.error(f"Failed to reboot {target}: {e}")
-        return jsonify({'error': f'Failed to send reboot command: {e}', **result}), 500
-
-    # Wait for node to go down
-    time.sleep(5)
-
-    # Wait for node to come back (up to 90 seconds)
-    max_wait = 90
-    start_time = time.time()
-
-    while time.time() - start_time < max_wait:
-        try:
-            check_cmd = ['sshpass', '-p', password, 'ssh', '-o', 'ConnectTimeout=5',
-                         '-o', 'StrictHostKeyChecking=no', f'root@{node_ip}', 'echo ok']
-            check_result = subprocess.run(check_cmd, timeout=10, capture_output=True, text=True)
-            if check_result.returncode == 0 and 'ok' in check_result.stdout:
-                result['online'] = True
-                logger.info(f"{target} is back online")
-                break
-        except Exception:
+    if data.get('wait'):
+        for _ in reboot.subscribe():
             pass
-        time.sleep(5)
-
-    logger.info(f"Reboot complete: {target} online={result['online']}")
+        result = reboot.to_dict()
+        return jsonify({
+            **result,
+            'rebooted': any(e['state'] == 'sent' for e in result['events']),
+            'online': result['ok'],
+            'message': f'{target} rebooted and online' if result['ok'] else (result['error'] or
+                                                                           f'{target} failed to come back online')
+        })
 
     return jsonify({
-        'ok': result['online'],
-        **result,
-        'message': f'{target} rebooted and online' if result['online'] else f'{target} failed to come back online'
-    })
+        'reboot_id': reboot.id,
+        'node': target,
+        'lab': lab_id,
+        'state': reboot.state,
+        'states': REBOOT_STATES,
+        'url': f'/api/reboots/{reboot.id}',
+        'events_url': f'/api/reboots/{reboot.id}/events'
+    }), 202
+
+
+@app.route('/api/reboots/<reboot_id>', methods=['GET'])
+def get_reboot(reboot_id):
+    """State of a reboot and the transitions so far."""
+    reboot = node_reboots.get(reboot_id)
+    if not reboot:
+        return jsonify({'error': 'Reboot not found'}), 404
+    return jsonify(reboot.to_dict())
+
+
+@app.route('/api/reboots/<reboot_id>/events', methods=['GET'])
+def reboot_events(reboot_id):
+    """Stream a reboot's state transitions as they happen, ending at ready or failed.
+
+    Server-Sent Events (one 'state' event per transition, earlier ones
+    replayed first), or NDJSON with ?format=ndjson.
+    """
+    reboot = node_reboots.get(reboot_id)
+    if not reboot:
+        return jsonify({'error': 'Reboot not found'}), 404
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    events = reboot.subscribe(since=request.args.get('since', 0, type=int))
+    if request.args.get('format') == 'ndjson':
+        body = (json.dumps(e) + '\n' for e in events if e)
+        return Response(body, mimetype='application/x-ndjson', headers=headers)
+    body = (f"event: state\ndata: {json.dumps(e)}\n\n" if e else ': keepalive\n\n' for e in events)
+    return Response(body, mimetype='text/event-stream', headers=headers)
 
 
 @app.route('/api/healthcheck', methods=['GET'])
 def healthcheck():
-    """Comprehensive system health check."""
-    try:
-        result = subprocess.run(
-            [str(GRADER_SCRIPT), '--dry-run', '--json'],
-            capture_output=True,
-            text=True,
-            cwd=str(BASE_DIR),
-            timeout=TIMEOUT_LIST_TASKS
-        )
-    except subprocess.TimeoutExpired:
-        return jsonify({'ok': False, 'error': 'Health check timed out'}), 504
+    """Comprehensive system health check (the exam-grader.sh --dry-run --json report).
+
+    Connectivity comes from the node monitor's cache; ?fresh=1 probes now.
+    ?lab= checks a lab other than the config file's.
+    """
+    lab_id, config, error = request_lab()
+    if error:
+        return error
+    ssh = None
+    if not config.exists:
+        config_status = {'ok': False, 'error': 'config_not_found', 'file': str(CONFIG_FILE)}
+    elif not config.node1_ip or not config.node2_ip:
+        missing = [key for key in ('NODE1_IP', 'NODE2_IP') if not config.settings.get(key)]
+        config_status = {'ok': False, 'error': 'missing_values', 'missing': missing}
+    else:
+        config_status = {'ok': True, **{key: value for key, value in config.public().items()
+                                        if key != 'has_password'}}
+        status = lab_monitor(lab_id).status(fresh=request.args.get('fresh') in ('1', 'true'))
+        ssh = [{'node': node, 'ok': state['ok'], 'target': state['target'] or config.node_ip(node),
+                'checked_at': state['checked_at'], 'age': state['age']} for node, state in status.items()]
+
+    tasks = list(task_catalog.tasks)
+    return jsonify({
+        'config': config_status,
+        'ssh': ssh,
+        'tasks': tasks,
+        'task_count': len(tasks),
+        'ready': config_status['ok'] and all(node['ok'] for node in ssh)
+    })
+
+
+def request_session():
+    """GradingSession named by ?session= or "session" in the body.
+
+    Returns (session or None, error response or None).
+    """
+    data = request.get_json(silent=True) or {}
+    session_id = request.args.get('session') or data.get('session')
+    if not session_id:
+        return None, None
+    session = grading_sessions.get(session_id)
+    if not session:
+        return None, (jsonify({'error': 'Session not found', 'message': f'Unknown grading session {session_id}'}), 404)
+    return session, None
+
+
+def request_incremental():
+    """?incremental=1 or "incremental": true in the body: reuse the results of
+    tasks whose node state has not changed since they were last graded."""
+    data = request.get_json(silent=True) or {}
+    return request.args.get('incremental') in ('1', 'true') or data.get('incremental') is True
+
+
+@app.route('/api/sessions', methods=['POST'])
+def create_grading_session():
+    """Start a grading session: pass its id with each task graded separately
+    so violation checks and node address probes run once for all of them."""
+    session = grading_sessions.create()
+    return jsonify(session.to_dict()), 201
 
-    try:
-        health = json.loads(result.stdout)
-    except json.JSONDecodeError:
-        return jsonify({
-            'ok': False,
-            'error': 'Failed to parse healthcheck output',
-            'raw': result.stdout
-        }), 500
 
-    return jsonify(health)
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def get_grading_session(session_id):
+    """Node addresses and violations found in a grading session so far."""
+    session = grading_sessions.get(session_id)
+    if not session:
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify(session.to_dict())
+
+
+def grade_within(timeout, task_ids, config, **kwargs):
+    """Grade through the scheduler, giving up timeout seconds after submitting.
+
+    The deadline covers the wait for a worker and for node slots, not only
+    the grading itself. On expiry the unit is cancelled (dropped if still
+    queued) and subprocess.TimeoutExpired raised.
+    """
+    cancel = threading.Event()
+    future = grading_scheduler.submit(task_ids, config, timeout=timeout, cancel=cancel, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        cancel.set()
+        future.cancel()
+        raise subprocess.TimeoutExpired('grading', timeout) from None
 
 
 @app.route('/api/run', methods=['POST'])
@@ -428,64 +586,41 @@ def run_grader():
             'message': 'Please select at least one task to grade.'
         }), 400
 
-    # Extract task numbers - handles both "task-01" and "01" formats
-    task_nums = []
-    for t in tasks:
-        num = t.replace('task-', '') if isinstance(t, str) and t.startswith('task-') else str(t)
-        task_nums.append(num)
+    session, error = request_session()
+    if error:
+        return error
+    lab_id, lab, error = request_lab()
+    if error:
+        return error
+
+    # Streaming mode: results arrive per check instead of after the whole run
+    if data.get('stream') or request.args.get('stream') == '1':
+        return stream_grading(tasks, session=session, lab_id=lab_id, lab=lab,
+                              incremental=request_incremental())
 
-    # Build command (Flask must be run with sudo for SSH access to VMs)
-    cmd = [str(GRADER_SCRIPT), '--skip-reboot', '--json', f"--tasks={','.join(task_nums)}"]
-    logger.debug(f"Running grader command: {' '.join(cmd)}")
+    logger.debug(f"Grading tasks in-process: {tasks}")
 
     # Run the grader with timeout
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            cwd=str(BASE_DIR),
-            timeout=TIMEOUT_GRADER
-        )
+        grader_result = grade_within(TIMEOUT_GRADER, tasks, lab.settings, session=session, lab=lab_id,
+                                     incremental=request_incremental())
     except subprocess.TimeoutExpired:
+        metrics.GRADING_TIMEOUTS.inc(limit='grader')
         logger.error(f"Grader timed out after {TIMEOUT_GRADER}s")
         return jsonify({
             'error': 'Grading timed out',
             'message': f'Grading took longer than {TIMEOUT_GRADER} seconds. Try fewer tasks.'
         }), 504
-
-    logger.debug(f"Grader returncode: {result.returncode}")
-    if result.stderr:
-        logger.debug(f"Grader stderr: {result.stderr[:500]}")
-
-    if result.returncode != 0:
-        error_msg = result.stderr.strip() if result.stderr else 'Grader process failed'
-        logger.error(f"Grader failed: {error_msg}")
-        logger.error(f"Grader stdout: {result.stdout[:500] if result.stdout else 'empty'}")
-
-        # Check for common errors and provide helpful messages
-        if 'must be run as root' in (result.stdout or ''):
-            error_msg = 'Flask must be run with sudo: sudo python app.py'
-
+    except GradingError as e:
+        logger.error(f"Grader failed: {e}")
         return jsonify({
             'error': 'Grader failed',
-            'message': error_msg,
-            'details': result.stdout[:500] if result.stdout else None
-        }), 500
-
-    try:
-        grader_result = json.loads(result.stdout)
-        logger.info(f"Grader success: score={grader_result.get('score', 'N/A')}/{grader_result.get('total', 'N/A')}")
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parse error: {e}")
-        logger.error(f"Raw output: {result.stdout[:500]}")
-        return jsonify({
-            'error': 'Invalid grader output',
-            'message': f'Failed to parse grader response: {str(e)}',
-            'raw': result.stdout[:1000]
+            'message': str(e),
+            'details': None
         }), 500
 
-    return jsonify(grader_result)
+    logger.info(f"Grader success: score={grader_result['score']}/{grader_result['total']}")
+    return jsonify({**grader_result, 'lab': lab_id or DEFAULT_LAB})
 
 
 @app.route('/api/grade-task/<task_id>', methods=['POST'])
@@ -498,103 +633,195 @@ def grade_single_task(task_id):
 
     logger.info(f"grade_single_task called: task_id={task_id}, target={target}")
 
+    session, error = request_session()
+    if error:
+        return error
+    lab_id, lab, error = request_lab()
+    if error:
+        return error
+
     # Extract task number
     task_num = task_id.replace('task-', '') if task_id.startswith('task-') else task_id
 
-    # Build command for single task
-    cmd = [str(GRADER_SCRIPT), '--skip-reboot', '--json', f"--tasks={task_num}"]
-    if target:
-        cmd.append(f"--target={target}")
-    logger.debug(f"Running single task grader: {' '.join(cmd)}")
-
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            cwd=str(BASE_DIR),
-            timeout=TIMEOUT_SINGLE_TASK
-        )
+        grader_result = grade_within(TIMEOUT_SINGLE_TASK, [task_num], lab.settings, target=target,
+                                     session=session, lab=lab_id, incremental=request_incremental())
     except subprocess.TimeoutExpired:
+        metrics.GRADING_TIMEOUTS.inc(limit='single_task')
         logger.error(f"Single task grader timed out after {TIMEOUT_SINGLE_TASK}s")
         return jsonify({
             'error': 'Grading timed out',
             'message': f'Task grading took longer than {TIMEOUT_SINGLE_TASK} seconds.',
             'task_id': task_id
         }), 504
+    except GradingError as e:
+        logger.error(f"Single task grader failed: {e}")
+        return jsonify({
+            'error': 'Grader failed',
+            'message': str(e),
+            'task_id': task_id
+        }), 500
+
+    # Extract all checks for this task (tasks can have multiple checks)
+    task_checks = [c for c in grader_result.get('checks', [])
+                   if c.get('task') == task_id or c.get('task') == f"task-{task_num}"]
 
-    logger.debug(f"Single task grader returncode: {result.returncode}")
+    if not task_checks:
+        return jsonify({
+            'task_id': task_id,
+            'passed': False,
+            'message': 'Task not found in grader output'
+        })
+
+    summary = {**summarize_task(task_id, task_checks), 'lab': lab_id or DEFAULT_LAB,
+               'session': grader_result['session'], 'violations': grader_result['violations']}
+    logger.info(f"Task {task_id}: {summary['message']}, {summary['points']}/{summary['max_points']} points")
+    return jsonify(summary)
 
-    if result.returncode != 0:
-        error_msg = result.stderr.strip() if result.stderr else 'Grader process failed'
-        logger.error(f"Single task grader failed: {error_msg}")
 
-        # Check for common errors
-        if 'must be run as root' in (result.stdout or ''):
-            error_msg = 'Flask must be run with sudo: sudo python app.py'
+@app.route('/api/grade-tasks', methods=['POST'])
+def grade_tasks():
+    """Grade a set of tasks, streaming results as each check and task completes."""
+    data = request.json or {}
+    tasks = data.get('tasks', [])
+    target = data.get('target')
 
+    if not tasks:
         return jsonify({
-            'error': 'Grader failed',
-            'message': error_msg,
-            'task_id': task_id
-        }), 500
+            'error': 'No tasks selected',
+            'message': 'Please select at least one task to grade.'
+        }), 400
+    if target and target not in ('node1', 'node2', 'both'):
+        return jsonify({'error': 'Invalid target', 'message': 'Target must be node1, node2, or both'}), 400
+
+    session, error = request_session()
+    if error:
+        return error
+    lab_id, lab, error = request_lab()
+    if error:
+        return error
+
+    logger.info(f"grade_tasks called: {len(tasks)} tasks, target={target}, lab={lab_id or DEFAULT_LAB}")
+    return stream_grading(tasks, target, session, lab_id, lab, request_incremental())
 
+
+def stream_grading(tasks, target=None, session=None, lab_id=None, lab=None, incremental=False):
+    """Grade tasks one by one and stream the results as they come in.
+
+    Emits a 'check' record per check, a 'task' record when a task finishes
+    and a final 'summary' record in the /api/run format. The body is NDJSON,
+    or Server-Sent Events when the client asks for text/event-stream (or
+    passes ?format=sse).
+    """
+    config = (lab or config_store.load()).settings
+    session = session or GradingSession()
+    order = {task.id: i for i, task in enumerate(grading_engine.select(tasks))}
     try:
-        grader_result = json.loads(result.stdout)
-
-        # Extract all checks for this task (tasks can have multiple checks)
-        task_checks = [c for c in grader_result.get('checks', [])
-                       if c.get('task') == task_id or c.get('task') == f"task-{task_num}"]
-
-        if task_checks:
-            # Aggregate results
-            total_points = sum(c.get('points', 0) for c in task_checks if c.get('passed'))
-            max_points = sum(c.get('points', 0) for c in task_checks)
-            all_passed = all(c.get('passed', False) for c in task_checks)
-            passed_count = sum(1 for c in task_checks if c.get('passed'))
-            total_count = len(task_checks)
-
-            # Build detailed message
-            check_details = [f"{'✓' if c.get('passed') else '✗'} {c.get('check', 'Check')}"
-                             for c in task_checks]
-
-            logger.info(f"Task {task_id}: {passed_count}/{total_count} checks passed, {total_points}/{max_points} points")
-            return jsonify({
-                'task_id': task_id,
-                'passed': all_passed,
-                'points': total_points,
-                'max_points': max_points,
-                'checks_passed': passed_count,
-                'checks_total': total_count,
-                'details': check_details,
-                'message': f"{passed_count}/{total_count} checks passed"
-            })
-        else:
-            return jsonify({
-                'task_id': task_id,
-                'passed': False,
-                'message': 'Task not found in grader output'
-            })
-
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parse error for single task: {e}")
+        if not order:
+            raise GradingError('No matching tasks found')
+        events = grading_scheduler.stream(tasks, config, target=target, timeout=TIMEOUT_SINGLE_TASK,
+                                          session=session, lab=lab_id, incremental=incremental)
+    except GradingError as e:
+        logger.error(f"Streaming grader failed: {e}")
+        return jsonify({'error': 'Grader failed', 'message': str(e)}), 500
+
+    def generate():
+        all_checks = []
+        for event in events:
+            if event[0] == 'check':
+                yield {'type': 'check', **event[1]}
+                continue
+
+            _, task_id, future = event
+            task_checks, record = task_result(task_id, future, TIMEOUT_SINGLE_TASK)
+            all_checks.extend(task_checks)
+            yield {'type': 'task', **record}
+
+        all_checks.sort(key=lambda c: order.get(c['task'], len(order)))
+        summary = summarize(all_checks)
+        logger.info(f"Streaming grader complete: score={summary['score']}/{summary['total']}")
+        yield {'type': 'summary', **summary, 'lab': lab_id or DEFAULT_LAB, 'session': session.id,
+               'violations': session.known_violations()}
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if request.args.get('format') == 'sse' or request.accept_mimetypes.best == 'text/event-stream':
+        body = (f"event: {r['type']}\ndata: {json.dumps(r)}\n\n" for r in generate())
+        return Response(body, mimetype='text/event-stream', headers=headers)
+    body = (json.dumps(r) + '\n' for r in generate())
+    return Response(body, mimetype='application/x-ndjson', headers=headers)
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_grading_job():
+    """Start grading in the background; returns a job id to poll."""
+    data = request.json or {}
+    tasks = data.get('tasks', [])
+    target = data.get('target')
+
+    if not tasks:
         return jsonify({
-            'error': 'Invalid grader output',
-            'message': str(e),
-            'task_id': task_id
-        }), 500
+            'error': 'No tasks selected',
+            'message': 'Please select at least one task to grade.'
+        }), 400
+    if target and target not in ('node1', 'node2', 'both'):
+        return jsonify({'error': 'Invalid target', 'message': 'Target must be node1, node2, or both'}), 400
+
+    session, error = request_session()
+    if error:
+        return error
+    lab_id, lab, error = request_lab()
+    if error:
+        return error
+
+    try:
+        job = grading_jobs.create(tasks, lab.settings, target=target, timeout=TIMEOUT_SINGLE_TASK,
+                                  session=session, lab=lab_id, incremental=request_incremental())
+    except GradingError as e:
+        logger.error(f"create_grading_job failed: {e}")
+        return jsonify({'error': 'Grader failed', 'message': str(e)}), 500
+
+    return jsonify({'job_id': job.id, 'status': job.status, 'lab': lab_id or DEFAULT_LAB,
+                    'url': f'/api/jobs/{job.id}'}), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_grading_job(job_id):
+    """Job status and partial results (checks from ?since=<offset> on)."""
+    job = grading_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict(since=request.args.get('since', 0, type=int)))
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_grading_job(job_id):
+    """Cancel a grading job, stopping its work on the nodes."""
+    job = grading_jobs.cancel(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
 
 
 @app.route('/api/results', methods=['POST'])
 def save_result():
-    """Save exam/practice result to database."""
-    data = request.json
-
-    with db_connection() as conn:
+    """Save exam/practice result to database, under the lab given as "lab"."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid result', 'message': 'Expected a JSON object'}), 400
+    lab_id = data.get('lab') if data.get('lab') != DEFAULT_LAB else None
+    if lab_id and not LAB_ID_RE.match(str(lab_id)):
+        return jsonify({'error': 'Invalid lab id'}), 400
+    categories = data.get('categories') or {}
+    checks = data.get('checks') or []
+    error = result_details_error(categories, checks)
+    if error:
+        return jsonify({'error': 'Invalid result', 'message': error}), 400
+
+    with results_db.transaction(write=True) as conn:
         c = conn.cursor()
         c.execute('''
-            INSERT INTO results (timestamp, mode, score, total, passed, duration_seconds, categories, checks)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO results (timestamp, mode, score, total, passed, duration_seconds, lab_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (
             data.get('timestamp', datetime.now().isoformat()),
             data.get('mode', 'practice'),
@@ -602,63 +829,123 @@ def save_result():
             data.get('total', 0),
             1 if data.get('passed') else 0,
             data.get('duration_seconds'),
-            json.dumps(data.get('categories', {})),
-            json.dumps(data.get('checks', []))
+            lab_id or None
         ))
         result_id = c.lastrowid
+        insert_result_details(conn, result_id, categories, checks)
+        update_rollups(conn, result_id, 1)
 
     return jsonify({'id': result_id, 'status': 'saved'})
 
 
+RESULT_FIELDS = ('id', 'timestamp', 'mode', 'lab', 'score', 'total', 'passed', 'duration_seconds',
+                 'categories', 'checks')
+
+
 @app.route('/api/results', methods=['GET'])
 def get_results():
-    """Get stored results with optional pagination."""
+    """Get stored results, newest first.
+
+    Pages are keyset-paginated: pass the returned next_cursor as ?cursor=
+    to continue (?offset= still works but gets slower with depth).
+    ?mode= and ?lab= filter by mode and lab, and ?fields= selects the
+    fields returned, e.g. fields=id,timestamp,score,total to skip the checks.
+    """
     # Pagination parameters
     limit = request.args.get('limit', 20, type=int)
     offset = request.args.get('offset', 0, type=int)
     limit = max(1, min(100, limit))  # Clamp between 1-100
     offset = max(0, offset)
-
-    with db_connection() as conn:
+    mode = request.args.get('mode')
+    lab = request.args.get('lab')
+    cursor = request.args.get('cursor')
+
+    fields = RESULT_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(f for f in RESULT_FIELDS if f in request.args['fields'].split(',') or f == 'id')
+
+    conditions, params = [], []
+    if mode:
+        conditions.append('mode = ?')
+        params.append(mode)
+    if lab:
+        conditions.append('lab_id IS ?')
+        params.append(None if lab == DEFAULT_LAB else lab)
+    filters, filter_params = list(conditions), list(params)
+    if cursor:
+        try:
+            position = decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({'error': 'Invalid cursor', 'message': str(e)}), 400
+        conditions.append('(timestamp, id) < (?, ?)')
+        params.extend(position)
+        offset = 0
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    with results_db.transaction() as conn:
         c = conn.cursor()
 
-        # Get total count
-        c.execute('SELECT COUNT(*) as count FROM results')
-        total = c.fetchone()['count']
+        # Total count: the overall rollup, or the mode/lab indexes when filtering
+        if filters:
+            c.execute(f"SELECT COUNT(*) AS count FROM results WHERE {' AND '.join(filters)}", filter_params)
+        else:
+            c.execute('SELECT attempts AS count FROM stats_overall')
+        row = c.fetchone()
+        total = row['count'] if row else 0
 
-        # Get paginated results
-        c.execute('SELECT * FROM results ORDER BY timestamp DESC LIMIT ? OFFSET ?', (limit, offset))
+        # One row past the page tells whether there is a next one
+        c.execute(f'SELECT * FROM results {where} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?',
+                  (*params, limit + 1, offset))
         rows = c.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        details = load_result_details(conn, [row['id'] for row in rows],
+                                      categories='categories' in fields, checks='checks' in fields)
 
-        results = []
-        for row in rows:
-            results.append({
-                'id': row['id'],
-                'timestamp': row['timestamp'],
-                'mode': row['mode'],
-                'score': row['score'],
-                'total': row['total'],
-                'passed': bool(row['passed']),
-                'duration_seconds': row['duration_seconds'],
-                'categories': json.loads(row['categories']),
-                'checks': json.loads(row['checks'])
-            })
+    results = []
+    for row in rows:
+        categories, checks = details[row['id']]
+        result = {
+            'id': row['id'],
+            'timestamp': row['timestamp'],
+            'mode': row['mode'],
+            'lab': row['lab_id'] or DEFAULT_LAB,
+            'score': row['score'],
+            'total': row['total'],
+            'passed': bool(row['passed']),
+            'duration_seconds': row['duration_seconds'],
+            'categories': categories,
+            'checks': checks
+        }
+        results.append({field: result[field] for field in fields})
 
     return jsonify({
         'results': results,
         'total': total,
         'limit': limit,
         'offset': offset,
-        'has_more': offset + len(results) < total
+        'has_more': has_more,
+        'next_cursor': encode_cursor(rows[-1]['timestamp'], rows[-1]['id']) if has_more else None
     })
 
 
+@app.route('/api/results/<int:result_id>/checks', methods=['GET'])
+def get_result_checks(result_id):
+    """Checks of one stored result, for clients that listed results without them."""
+    with results_db.transaction() as conn:
+        if not conn.execute('SELECT 1 FROM results WHERE id = ?', (result_id,)).fetchone():
+            return jsonify({'error': 'Result not found'}), 404
+        _, checks = load_result_details(conn, [result_id], categories=False)[result_id]
+    return jsonify({'id': result_id, 'checks': checks})
+
+
 @app.route('/api/results/<int:result_id>', methods=['DELETE'])
 def delete_result(result_id):
     """Delete a specific result by ID."""
     logger.info(f"Deleting result id={result_id}")
-    with db_connection() as conn:
+    with results_db.transaction(write=True) as conn:
         c = conn.cursor()
+        update_rollups(conn, result_id, -1)
         c.execute('DELETE FROM results WHERE id = ?', (result_id,))
         if c.rowcount == 0:
             return jsonify({'error': 'Result not found'}), 404
@@ -667,52 +954,65 @@ def delete_result(result_id):
 
 @app.route('/api/results', methods=['DELETE'])
 def clear_all_results():
-    """Clear all stored results."""
+    """Clear all stored results, or only those of ?lab=."""
+    lab = request.args.get('lab')
+    if lab:
+        logger.info(f"Clearing results of lab {lab}")
+        with results_db.transaction(write=True) as conn:
+            c = conn.cursor()
+            c.execute('SELECT id FROM results WHERE lab_id IS ?', (None if lab == DEFAULT_LAB else lab,))
+            result_ids = [row['id'] for row in c.fetchall()]
+            for result_id in result_ids:
+                update_rollups(conn, result_id, -1)
+            c.executemany('DELETE FROM results WHERE id = ?', [(result_id,) for result_id in result_ids])
+        return jsonify({'status': 'cleared', 'deleted': len(result_ids), 'lab': lab})
+
     logger.info("Clearing all results")
-    with db_connection() as conn:
+    with results_db.transaction(write=True) as conn:
         c = conn.cursor()
+        # Children first: unfiltered deletes are truncations, cascading row by row is not
+        c.execute('DELETE FROM result_checks')
+        c.execute('DELETE FROM result_categories')
         c.execute('DELETE FROM results')
         deleted_count = c.rowcount
+        rebuild_rollups(conn)
     return jsonify({'status': 'cleared', 'deleted': deleted_count})
 
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    """Get aggregated statistics."""
-    with db_connection() as conn:
+    """Get aggregated statistics.
+
+    ?include=days,tasks adds the daily (last 30 days) and per-task rollups.
+    ?lab= limits them to the results of one lab.
+    """
+    lab = request.args.get('lab')
+    queries = LAB_STATS_QUERIES if lab else STATS_QUERIES
+    scope = {'lab': None if lab == DEFAULT_LAB else lab}
+    with results_db.transaction() as conn:
         c = conn.cursor()
 
-        # Overall stats
-        c.execute('SELECT COUNT(*) as total, SUM(passed) as passed FROM results')
-        overall = c.fetchone()
-
-        # Category performance from results
-        c.execute('SELECT categories FROM results')
-        rows = c.fetchall()
-
-    category_totals = {}
-    for row in rows:
-        cats = json.loads(row['categories'])
-        for cat, stats in cats.items():
-            if cat not in category_totals:
-                category_totals[cat] = {'earned': 0, 'possible': 0}
-            category_totals[cat]['earned'] += stats.get('earned', 0)
-            category_totals[cat]['possible'] += stats.get('possible', 0)
+        # Overall stats, from the rollups kept up to date on every write
+        # (a lab's are aggregated from its results)
+        c.execute(queries['overall'], scope)
+        overall = c.fetchone() or {'total': 0, 'passed': 0}
+
+        c.execute(queries['categories'], scope)
+        category_totals = {row['category']: {'earned': row['earned'], 'possible': row['possible']}
+                           for row in c.fetchall()}
+
+        include = set(request.args.get('include', '').split(','))
+        extra = {}
+        if 'days' in include:
+            c.execute(queries['days'], scope)
+            extra['days'] = [dict(row) for row in c.fetchall()]
+        if 'tasks' in include:
+            c.execute(queries['tasks'], scope)
+            extra['tasks'] = {row['task']: {**dict(row), 'percentage': round(
+                row['earned'] / row['possible'] * 100, 1) if row['possible'] else 0} for row in c.fetchall()}
 
     # Get all available categories from tasks
-    all_categories = set()
-    try:
-        result = subprocess.run(
-            [str(GRADER_SCRIPT), '--list-tasks', '--json'],
-            capture_output=True,
-            text=True,
-            cwd=str(BASE_DIR),
-            timeout=TIMEOUT_LIST_TASKS
-        )
-        tasks = json.loads(result.stdout)
-        all_categories = {t['category'] for t in tasks if t.get('category')}
-    except (subprocess.TimeoutExpired, json.JSONDecodeError, KeyError):
-        pass
+    all_categories = task_catalog.categories()
 
     # Calculate percentages for all categories
     category_stats = {}
@@ -742,13 +1042,11 @@ def get_stats():
         'passed': overall['passed'] or 0,
         'pass_rate': round((overall['passed'] or 0) / (overall['total'] or 1) * 100, 1),
         'categories': category_stats,
-        'weak_areas': [{'category': k, **v} for k, v in weak_areas[:3]]
+        'weak_areas': [{'category': k, **v} for k, v in weak_areas[:3]],
+        **extra
     })
 
 
-
-
-
 @app.route('/api/random-tasks', methods=['GET'])
 def random_tasks():
     """Get random task selection for exam mode."""
@@ -757,30 +1055,7 @@ def random_tasks():
 
     logger.info(f"random_tasks called: count={count}")
 
-    # Get all tasks
-    try:
-        result = subprocess.run(
-            [str(GRADER_SCRIPT), '--list-tasks', '--json'],
-            capture_output=True,
-            text=True,
-            cwd=str(BASE_DIR),
-            timeout=TIMEOUT_LIST_TASKS
-        )
-    except subprocess.TimeoutExpired:
-        logger.error("random_tasks: list-tasks timed out")
-        return jsonify({'error': 'Request timed out'}), 504
-
-    logger.debug(f"list-tasks returncode: {result.returncode}")
-    if result.returncode != 0:
-        logger.error(f"list-tasks failed: {result.stderr}")
-        return jsonify({'error': 'Failed to list tasks', 'message': result.stderr}), 500
-
-    try:
-        tasks = parse_grader_json(result.stdout)
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse task list: {e}")
-        return jsonify({'error': 'Failed to parse tasks', 'message': str(e)}), 500
-
+    tasks = task_catalog.entries()
     logger.debug(f"Found {len(tasks)} tasks")
 
     # Exclude task-ssh (it's a prereq check)
@@ -795,199 +1070,37 @@ def random_tasks():
 
 @app.route('/api/discover-ips', methods=['POST'])
 def discover_ips():
-    """Discover VM IPs using virsh or other methods."""
-    logger.info("discover_ips called")
+    """Discover VM IPs using virsh, the configured IPs and the tasks' EXPECTED_IPs.
 
-    # Load current config to get VM names
-    config = {}
-    if CONFIG_FILE.exists():
-        with open(CONFIG_FILE) as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('#') or '=' not in line:
-                    continue
-                key, value = line.split('=', 1)
-                config[key.strip()] = value.strip().strip('"\'')
+    ?lab= looks for the nodes of a lab (by its node names as libvirt domains)
+    and updates that lab instead of the config file.
+    """
+    logger.info("discover_ips called")
 
-    node1_name = config.get('NODE1', 'rhcsa1')
-    node2_name = config.get('NODE2', 'rhcsa2')
+    lab_id, config, error = request_lab()
+    if error:
+        return error
+    node1_name, node2_name = config.node1, config.node2
 
-    discovered = {'node1': None, 'node2': None, 'method': None}
+    found = discover({'node1': node1_name, 'node2': node2_name},
+                     {'node1': config.node1_ip, 'node2': config.node2_ip},
+                     task_catalog.expected_ips())
 
-    # Try virsh domifaddr first
-    try:
-        for node_key, vm_name in [('node1', node1_name), ('node2', node2_name)]:
-            result = subprocess.run(
-                ['virsh', 'domifaddr', vm_name],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            if result.returncode == 0:
-                # Parse virsh output to find IP
-                for line in result.stdout.split('\n'):
-                    if 'ipv4' in line.lower():
-                        parts = line.split()
-                        for part in parts:
-                            if '/' in part:  # IP with CIDR notation
-                                ip = part.split('/')[0]
-                                if re.match(r'^(\d{1,3}\.){3}\d{1,3}$', ip):
-                                    discovered[node_key] = ip
-                                    discovered['method'] = 'virsh'
-                                    break
-    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
-        logger.debug(f"virsh method failed: {e}")
-
-    # Try arp-scan or nmap as fallback (if virsh didn't work)
-    if not discovered['node1'] and not discovered['node2']:
-        # Try to get IPs from arp cache if we have current IPs configured
-        current_ip1 = config.get('NODE1_IP', '')
-        current_ip2 = config.get('NODE2_IP', '')
-
-        if current_ip1 or current_ip2:
-            # Ping to refresh arp cache then check
-            for ip in [current_ip1, current_ip2]:
-                if ip:
-                    try:
-                        subprocess.run(['ping', '-c', '1', '-W', '1', ip],
-                                      capture_output=True, timeout=2)
-                    except:
-                        pass
-
-            # If ping succeeds, the IP is still valid
-            pass
+    # Only touch the config once every probe is in, and only if an IP changed
+    updates = {f'{node.upper()}_IP': ip for node, (ip, _) in found.items() if ip != config.node_ip(node)}
+    if updates and lab_id:
+        lab_store.update(lab_id, {key.lower(): ip for key, ip in updates.items()})
+    elif updates:
+        config_store.update(updates)
 
-        # Heuristic Scan: Check for EXPECTED_IPs from task files
-        # Dynamic discovery based on available tasks
-        candidates = []
-        # Always check configured IPs first if they are different from what we found
-        if config.get('NODE1_IP'): candidates.append(('node1', config['NODE1_IP']))
-        if config.get('NODE2_IP'): candidates.append(('node2', config['NODE2_IP']))
-
-        try:
-            checks_dir = Path('./checks')
-            if checks_dir.exists():
-                for task_file in checks_dir.glob('task-*.sh'):
-                    try:
-                        content = task_file.read_text()
-                        # Extract EXPECTED_IP and Target
-                        expected_ip_match = re.search(r'# EXPECTED_IP:\s*([\d\.]+)', content)
-                        if expected_ip_match:
-                            ip = expected_ip_match.group(1)
-                            # Determine target node
-                            target_match = re.search(r'# Target:\s*(node\d)', content)
-                            target = target_match.group(1) if target_match else 'node1'
-                            
-                            # Add to candidates
-                            candidates.append((target, ip))
-                    except:
-                        continue
-        except Exception as e:
-            logger.error(f"Failed to scan task files: {e}")
-            
-        # Add basic fallbacks just in case
-        candidates.extend([
-            ('node2', '192.168.122.131'), ('node1', '192.168.122.141')
-        ])
-        
-        # Deduplicate while preserving order
-        seen = set()
-        unique_candidates = []
-        for c in candidates:
-            if c not in seen:
-                unique_candidates.append(c)
-                seen.add(c)
-        
-        for node_key, ip in unique_candidates:
-            if not discovered[node_key]:
-                try:
-                    # Ping check with short timeout
-                    ping_res = subprocess.run(
-                        ['ping', '-c', '1', '-W', '1', ip],
-                        capture_output=True
-                    )
-                    if ping_res.returncode == 0:
-                        discovered[node_key] = ip
-                        if not discovered['method']:
-                             discovered['method'] = 'scan'
-                except:
-                    pass
-
-        # If we found IPs, update the results
-        if discovered['node1'] or discovered['node2']:
-            # We found something
-            pass
-
-            if current_ip1:
-                try:
-                    result = subprocess.run(
-                        ['ping', '-c', '1', '-W', '2', current_ip1],
-                        capture_output=True, timeout=5
-                    )
-                    if result.returncode == 0:
-                        discovered['node1'] = current_ip1
-                        discovered['method'] = 'ping'
-                except:
-                    pass
-
-            if current_ip2:
-                try:
-                    result = subprocess.run(
-                        ['ping', '-c', '1', '-W', '2', current_ip2],
-                        capture_output=True, timeout=5
-                    )
-                    if result.returncode == 0:
-                        discovered['node2'] = current_ip2
-                        discovered['method'] = 'ping'
-                except:
-                    pass
-
-    # Update config object for return
-    if discovered['node1']:
-        config['node1_ip'] = discovered['node1']
-    if discovered['node2']:
-        config['node2_ip'] = discovered['node2']
-
-    # Update the actual config file if we found anything
-    if discovered['node1'] or discovered['node2']:
-        start_key = None
-        new_lines = []
-        if CONFIG_FILE.exists():
-            with open(CONFIG_FILE) as f:
-                new_lines = f.readlines()
-        else:
-             new_lines = ["NODE1=rhcsa1\n", "NODE2=rhcsa2\n"]
-
-        # Simple update or append
-        updated_n1 = False
-        updated_n2 = False
-        final_lines = []
-        
-        for line in new_lines:
-            if line.startswith('NODE1_IP=') and discovered['node1']:
-                final_lines.append(f"NODE1_IP={discovered['node1']}\n")
-                updated_n1 = True
-            elif line.startswith('NODE2_IP=') and discovered['node2']:
-                final_lines.append(f"NODE2_IP={discovered['node2']}\n")
-                updated_n2 = True
-            else:
-                final_lines.append(line)
-        
-        if discovered['node1'] and not updated_n1:
-            final_lines.append(f"NODE1_IP={discovered['node1']}\n")
-        if discovered['node2'] and not updated_n2:
-            final_lines.append(f"NODE2_IP={discovered['node2']}\n")
-            
-        with open(CONFIG_FILE, 'w') as f:
-            f.writelines(final_lines)
-
-    logger.info(f"IP discovery result: {discovered}")
+    methods = [found[node][1] for node in ('node1', 'node2') if node in found]
+    logger.info(f"IP discovery result: {found}")
     return jsonify({
         'node1': node1_name,
-        'node1_ip': config.get('node1_ip', ''),
+        'node1_ip': found['node1'][0] if 'node1' in found else '',
         'node2': node2_name,
-        'node2_ip': config.get('node2_ip', ''),
-        'method': discovered['method'] or 'none'
+        'node2_ip': found['node2'][0] if 'node2' in found else '',
+        'method': 'virsh' if 'virsh' in methods else (methods[0] if methods else 'none')
     })
 
 
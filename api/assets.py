@@ -0,0 +1,317 @@
+"""
+Static assets
+Build step that bundles the page's stylesheet and scripts into minified,
+content-hashed files with precompressed variants, and lookup of the
+variant to serve for a request
+
+Run as a script to build static/assets/ (make assets):
+    python3 api/assets.py [static dir]
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # optional: without it only .gz variants are built
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Built files, under the static directory and at this URL path
+ASSETS_DIR = 'assets'
+MANIFEST = 'manifest.json'
+PAGE = 'index.html'
+
+# Content codings served, best first, with the suffix of their precompressed file
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+STYLE_RE = re.compile(r'[ \t]*<style>(.*?)</style>\n?', re.S)
+SCRIPT_RE = re.compile(r'[ \t]*<script src="([^"]+)"></script>\n?')
+HTML_COMMENT_RE = re.compile(r'<!--(?!\[).*?-->', re.S)
+
+# After these characters (or keywords) a slash starts a regex literal, not a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw'}
+# A space next to one of these is never needed (+, - and / are left out: "a - -b")
+JS_PUNCTUATION = set('{}()[];,:=<>?!&|*%^~')
+# A line break after or before these cannot change where statements end
+JS_OPENERS = set('{[(;,')
+JS_CLOSERS = set('}])')
+
+
+def _template_end(source, i):
+    """Index just past the template literal starting at source[i]."""
+    i += 1
+    while i < len(source):
+        c = source[i]
+        if c == '\\':
+            i += 2
+        elif c == '`':
+            return i + 1
+        elif source.startswith('${', i):
+            i = _expression_end(source, i + 2)
+        else:
+            i += 1
+    raise ValueError('Unterminated template literal')
+
+
+def _expression_end(source, i):
+    """Index just past the "}" closing a template substitution that starts at i."""
+    depth = 0
+    while i < len(source):
+        c = source[i]
+        if c in '\'"`':
+            i = _string_end(source, i)
+            continue
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            if depth == 0:
+                return i + 1
+            depth -= 1
+        i += 1
+    raise ValueError('Unterminated template substitution')
+
+
+def _string_end(source, i):
+    """Index just past the string or template literal starting at source[i]."""
+    quote = source[i]
+    if quote == '`':
+        return _template_end(source, i)
+    i += 1
+    while i < len(source):
+        c = source[i]
+        if c == '\\':
+            i += 2
+        elif c == quote:
+            return i + 1
+        elif c == '\n':
+            break
+        else:
+            i += 1
+    raise ValueError('Unterminated string literal')
+
+
+def _regex_end(source, i):
+    """Index just past the regex literal (flags included) starting at source[i]."""
+    i += 1
+    in_class = False
+    while i < len(source):
+        c = source[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == '\n':
+            break
+        if c == '[':
+            in_class = True
+        elif c == ']':
+            in_class = False
+        elif c == '/' and not in_class:
+            i += 1
+            while i < len(source) and (source[i].isalnum() or source[i] == '_'):
+                i += 1
+            return i
+        i += 1
+    raise ValueError('Unterminated regex literal')
+
+
+def _starts_regex(out):
+    code = ''.join(out[-8:]).rstrip()
+    if not code or code[-1] in REGEX_PRECEDERS:
+        return True
+    word = re.search(r'[\w$]+$', code)
+    return bool(word) and word.group() in REGEX_KEYWORDS
+
+
+def minify_js(source):
+    """Drop comments and indentation from a script.
+
+    Literals are copied as they are. Line breaks are kept wherever
+    automatic semicolon insertion could depend on them.
+    """
+    out = []
+    i, n = 0, len(source)
+    while i < n:
+        c = source[i]
+        if c in '\'"`':
+            end = _string_end(source, i)
+        elif source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            if end < 0:
+                raise ValueError('Unterminated comment')
+            i = end + 2
+            out.append(' ')
+            continue
+        elif c == '/' and _starts_regex(out):
+            end = _regex_end(source, i)
+        elif c.isspace():
+            end = i
+            while end < n and source[end].isspace():
+                end += 1
+            out.append('\n' if '\n' in source[i:end] else ' ')
+            i = end
+            continue
+        else:
+            end = i + 1
+        out.append(source[i:end])
+        i = end
+
+    # Drop the whitespace tokens nothing depends on
+    following = [''] * (len(out) + 1)  # first character of the next code token
+    for k in range(len(out) - 1, -1, -1):
+        following[k] = following[k + 1] if out[k] in (' ', '\n') else out[k][0]
+    kept = []
+    for k, token in enumerate(out):
+        if token in (' ', '\n'):
+            before = kept[-1][-1] if kept else ''
+            after = following[k + 1]
+            if not before or not after or before in ' \n':
+                continue
+            if token == ' ' and (before in JS_PUNCTUATION or after in JS_PUNCTUATION):
+                continue
+            if token == '\n' and (before in JS_OPENERS or after in JS_CLOSERS):
+                continue
+        kept.append(token)
+    return ''.join(kept).strip() + '\n'
+
+
+def minify_css(source):
+    """Drop comments and the whitespace CSS does not need.
+
+    Spaces inside values are kept ("calc(1px + 2px)", "0 auto"); only those
+    next to braces, semicolons, commas and after property colons go.
+    """
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r' ?([{};,>]) ?', r'\1', source)
+    source = re.sub(r'([{;]\s*[-\w]+):\s', r'\1:', source)
+    return source.replace(';}', '}').strip() + '\n'
+
+
+def minify_html(source):
+    """Drop comments and indentation from a page without <pre> or <textarea>."""
+    source = HTML_COMMENT_RE.sub('', source)
+    if re.search(r'<(pre|textarea)\b', source, re.I):
+        return source
+    return '\n'.join(line.strip() for line in source.splitlines() if line.strip()) + '\n'
+
+
+def _hashed(name, suffix, data):
+    return f'{name}.{hashlib.sha256(data).hexdigest()[:12]}{suffix}'
+
+
+def _replace(pattern, tag, page):
+    """page with the first match of pattern replaced by tag and the others removed."""
+    first = pattern.search(page)
+    if first is None:
+        return page
+    return page[:first.start()] + tag + pattern.sub('', page[first.end():])
+
+
+def _write(path, data):
+    """Write path atomically, with the precompressed variants that save space.
+
+    Returns the names written; variants left from an earlier build are removed.
+    """
+    variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    files = []
+    for suffix, content in [('', data), *variants.items()]:
+        target = path.with_name(path.name + suffix)
+        if suffix and len(content) >= len(data):
+            continue
+        tmp = target.with_name(f'.{target.name}.tmp')
+        tmp.write_bytes(content)
+        os.replace(tmp, target)
+        files.append(target.name)
+    for _, suffix in ENCODINGS:
+        if path.name + suffix not in files:
+            path.with_name(path.name + suffix).unlink(missing_ok=True)
+    return files
+
+
+def build(static_dir):
+    """Bundle static_dir/index.html's stylesheet and scripts into static_dir/assets/.
+
+    Writes app.<hash>.css, app.<hash>.js and an index.html that loads them,
+    each with .gz (and .br when brotli is installed) variants. Files of the
+    previous build are kept for pages already loaded with it. Returns the
+    manifest: source files and built files.
+    """
+    static_dir = Path(static_dir)
+    out_dir = static_dir / ASSETS_DIR
+    out_dir.mkdir(exist_ok=True)
+    page = (static_dir / PAGE).read_text()
+
+    styles = STYLE_RE.findall(page)
+    scripts = SCRIPT_RE.findall(page)
+    css = ''.join(minify_css(style) for style in styles).encode()
+    js = ''.join(f'{minify_js((static_dir / src).read_text()).rstrip()};\n' for src in scripts).encode()
+    css_name = _hashed('app', '.css', css)
+    js_name = _hashed('app', '.js', js)
+
+    page = _replace(STYLE_RE, f'<link rel="stylesheet" href="/{ASSETS_DIR}/{css_name}">\n', page)
+    page = _replace(SCRIPT_RE, f'<script src="/{ASSETS_DIR}/{js_name}"></script>\n', page)
+
+    files = _write(out_dir / css_name, css) + _write(out_dir / js_name, js)
+    files += _write(out_dir / PAGE, minify_html(page).encode())
+
+    manifest_path = out_dir / MANIFEST
+    previous = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    keep = set(files) | set(previous.get('files', ())) | {MANIFEST}
+    for path in out_dir.iterdir():
+        if path.name not in keep and not path.name.startswith('.'):
+            path.unlink()
+
+    manifest = {'sources': [PAGE, *scripts], 'files': files}
+    manifest_path.write_text(json.dumps(manifest, indent=2) + '\n')
+    return manifest
+
+
+def built_page(static_dir):
+    """Path of the built index.html, or None if there is none or a source changed since."""
+    static_dir = Path(static_dir)
+    out_dir = static_dir / ASSETS_DIR
+    try:
+        manifest = json.loads((out_dir / MANIFEST).read_text())
+        built = (out_dir / PAGE).stat().st_mtime
+        if any((static_dir / src).stat().st_mtime > built for src in manifest['sources']):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return out_dir / PAGE
+
+
+def negotiate(path, accepts):
+    """Variant of path to send: (file, content coding or None), or (None, None).
+
+    accepts(coding) tells whether the client takes a content coding.
+    """
+    for coding, suffix in ENCODINGS:
+        variant = path.with_name(path.name + suffix)
+        if accepts(coding) and variant.is_file():
+            return variant, coding
+    return (path, None) if path.is_file() else (None, None)
+
+
+if __name__ == '__main__':
+    static_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).parent.parent / 'static'
+    manifest = build(static_dir)
+    for name in manifest['files']:
+        path = static_dir / ASSETS_DIR / name
+        print(f"{path.stat().st_size:>8}  {path}")
+    if brotli is None:
+        print("brotli is not installed: built gzip variants only")
@@ -0,0 +1,173 @@
+"""
+Task catalog
+In-memory index of the task definitions under checks/ (bash scripts and
+declarative JSON tasks), kept in sync with the files by mtime
+
+Run as a script to compile the catalog into tasks.json:
+    python3 api/catalog.py [output]
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from checkdsl import CheckDefinitionError, load_task
+from grader import normalize_task_id, parse_task_file
+
+logger = logging.getLogger(__name__)
+
+# How often (seconds) a lookup may stat checks/ for changes
+CATALOG_RECHECK_INTERVAL = 2.0
+
+
+class CatalogIndex:
+    """Immutable snapshot of the catalog; swapped as a whole on rebuild."""
+
+    def __init__(self, tasks):
+        self.tasks = tasks  # id -> TaskDefinition, in file order
+        self.entries = [task_entry(task) for task in tasks.values()]
+        self.json = json.dumps(self.entries)
+        self.by_category = {}
+        self.by_target = {}
+        for entry in self.entries:
+            self.by_category.setdefault(entry['category'], []).append(entry)
+            self.by_target.setdefault(entry['target'], []).append(entry)
+        # (node, ip) addresses tasks move a node to, for IP discovery
+        self.expected_ips = list(dict.fromkeys(
+            (task.resolved_target if task.resolved_target in ('node1', 'node2') else 'node1', task.expected_ip)
+            for task in tasks.values() if task.expected_ip))
+
+
+def task_entry(task):
+    """Public listing of a task, as served by /api/tasks."""
+    return {
+        'id': task.id,
+        'category': task.category,
+        'description': task.description,
+        'target': task.resolved_target,
+    }
+
+
+class TaskCatalog:
+    """Task definitions indexed by id, category and target.
+
+    Parsed once at startup. Lookups stat checks/ at most once every
+    recheck_interval seconds; only files whose mtime or size changed are
+    re-parsed, and readers always see a complete snapshot.
+    """
+
+    def __init__(self, checks_dir, recheck_interval=CATALOG_RECHECK_INTERVAL):
+        self.checks_dir = Path(checks_dir)
+        self.recheck_interval = recheck_interval
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._checked_at = 0.0
+        self._index = CatalogIndex({})
+        self.refresh(force=True)
+        logger.info(f"Task catalog loaded {len(self._index.tasks)} tasks")
+
+    def _scan(self):
+        """Map of file name -> (mtime, size) for every task definition."""
+        stats = {}
+        with os.scandir(self.checks_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(('.sh', '.json')) and entry.is_file():
+                    st = entry.stat()
+                    stats[entry.name] = (st.st_mtime_ns, st.st_size)
+        return stats
+
+    def refresh(self, force=False):
+        """Rebuild the index if any task file was added, removed or edited.
+
+        A task defined both as JSON and as a bash script is graded from the
+        JSON; the script is its rendering for exam-grader.sh.
+        """
+        if not force and time.monotonic() - self._checked_at < self.recheck_interval:
+            return
+        with self._lock:
+            if not force and time.monotonic() - self._checked_at < self.recheck_interval:
+                return
+            try:
+                stats = self._scan()
+            except OSError as e:
+                logger.error(f"Cannot scan {self.checks_dir}: {e}")
+                return
+            finally:
+                self._checked_at = time.monotonic()
+            if stats == self._stats:
+                return
+
+            previous = {task.path.name: task for task in self._index.tasks.values()}
+            tasks = {}
+            for name in sorted(stats):
+                stem, suffix = os.path.splitext(name)
+                if suffix == '.sh' and stem in tasks:
+                    continue  # task-XX.json sorts first and takes precedence
+                task = previous.get(name)
+                if task is None or self._stats.get(name) != stats[name]:
+                    task = self._load(name)
+                if task is None:
+                    continue
+                tasks[task.id] = task
+            changed = sum(stats.get(n) != self._stats.get(n) for n in stats.keys() | self._stats.keys())
+            self._index = CatalogIndex(tasks)
+            self._stats = stats
+            if previous:
+                logger.info(f"Task catalog rebuilt: {len(tasks)} tasks ({changed} file changes)")
+
+    def _load(self, name):
+        path = self.checks_dir / name
+        if name.endswith('.sh'):
+            return parse_task_file(path)
+        try:
+            return load_task(path)
+        except (OSError, CheckDefinitionError) as e:
+            logger.error(f"Skipping task {name}: {e}")
+            return None
+
+    @property
+    def index(self):
+        self.refresh()
+        return self._index
+
+    @property
+    def tasks(self):
+        """Task definitions keyed by id, in catalog order."""
+        return self.index.tasks
+
+    def get(self, task_id):
+        return self.index.tasks.get(normalize_task_id(task_id))
+
+    def entries(self, category=None, target=None):
+        """Public task listings, optionally filtered by category and/or target."""
+        index = self.index
+        if category is None and target is None:
+            return index.entries
+        if category is not None and target is not None:
+            return [e for e in index.by_category.get(category, []) if e['target'] == target]
+        if category is not None:
+            return index.by_category.get(category, [])
+        return index.by_target.get(target, [])
+
+    def expected_ips(self):
+        """(node, ip) pairs from the EXPECTED_IP headers, in catalog order."""
+        return self.index.expected_ips
+
+    def categories(self):
+        return set(self.index.by_category) - {''}
+
+    def json(self):
+        """Pre-serialized listing of every task."""
+        return self.index.json
+
+
+if __name__ == '__main__':
+    base_dir = Path(__file__).parent.parent
+    output = Path(sys.argv[1]) if len(sys.argv) > 1 else base_dir / 'tasks.json'
+    catalog = TaskCatalog(base_dir / 'checks')
+    output.write_text(catalog.json() + '\n')
+    print(f"Wrote {len(catalog.tasks)} tasks to {output}")
@@ -0,0 +1,542 @@
+"""
+Declarative checks
+Typed checks defined in checks/task-*.json. Each check compiles to one
+remote probe (a command on a node) plus a predicate on its result, so the
+grader can merge identical probes across tasks and run them in bulk.
+
+Usage:
+    python3 api/checkdsl.py render [task.json ...]
+        Regenerate the bash script next to each JSON task, for exam-grader.sh
+    python3 api/checkdsl.py migrate [--write] [--recover-quoting] [task.sh ...]
+        Convert bash task scripts to JSON where every check can be expressed
+"""
+
+import json
+import re
+import shlex
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+from fingerprint import parse_dependency
+from grader import HEADER_RE, TaskDefinition
+
+DEFAULT_POINTS = 10
+
+# Characters with a special meaning in POSIX extended regular expressions
+ERE_SPECIAL = set('.[]()*+?{}|^$\\')
+
+
+class CheckDefinitionError(ValueError):
+    """A JSON task or one of its checks is malformed."""
+
+
+@dataclass
+class CompiledCheck:
+    """One check: a command run on a node and a predicate on its result.
+
+    Without a stdout predicate the check passes when the command exits with
+    rc (default 0). With one, rc is only checked if given explicitly.
+    """
+    node: str
+    command: str
+    message: str
+    fail_message: str = ''
+    points: int = DEFAULT_POINTS
+    rc: int = None
+    contains: str = None
+    regex: str = None
+    equals: str = None
+    ignore_case: bool = False
+    negate: bool = False
+
+    @property
+    def has_predicate(self):
+        return self.contains is not None or self.regex is not None or self.equals is not None
+
+    def passed(self, result):
+        """Evaluate the check against a RemoteResult of its command."""
+        out = result.stdout.decode(errors='replace')
+        ok = True
+        if self.rc is not None or not self.has_predicate:
+            ok = result.returncode == (self.rc or 0)
+        if ok and self.contains is not None:
+            ok = (self.contains.lower() in out.lower()) if self.ignore_case else self.contains in out
+        if ok and self.regex is not None:
+            flags = re.MULTILINE | (re.IGNORECASE if self.ignore_case else 0)
+            ok = re.search(self.regex, out, flags) is not None
+        if ok and self.equals is not None:
+            ok = out.rstrip('\n') == self.equals
+        return ok != self.negate
+
+    def bash(self):
+        """The check as a condition for exam-grader.sh's check()."""
+        remote = f'run_ssh "${self.node.upper()}_IP" {_dquote(self.command)}'
+        flags = 'i' if self.ignore_case else ''
+        if not self.has_predicate:
+            rc = self.rc or 0
+            condition = f'{remote} &>/dev/null' if rc == 0 else f'{{ {remote} &>/dev/null; [[ $? -eq {rc} ]]; }}'
+        elif self.rc is None and sum(p is not None for p in (self.contains, self.regex, self.equals)) == 1:
+            if self.contains is not None:
+                condition = f'{remote} 2>/dev/null | grep -qF{flags} -- {shlex.quote(self.contains)}'
+            elif self.regex is not None:
+                condition = f'{remote} 2>/dev/null | grep -qE{flags} -- {shlex.quote(self.regex)}'
+            else:
+                condition = f'[[ "$({remote} 2>/dev/null)" == {shlex.quote(self.equals)} ]]'
+        else:
+            tests = [] if self.rc is None else [f'[[ $__rc -eq {self.rc} ]]']
+            if self.contains is not None:
+                tests.append(f'grep -qF{flags} -- {shlex.quote(self.contains)} <<<"$__out"')
+            if self.regex is not None:
+                tests.append(f'grep -qE{flags} -- {shlex.quote(self.regex)} <<<"$__out"')
+            if self.equals is not None:
+                tests.append(f'[[ "$__out" == {shlex.quote(self.equals)} ]]')
+            condition = f'{{ __out=$({remote} 2>/dev/null); __rc=$?; {" && ".join(tests)}; }}'
+        return f'! {condition}' if self.negate else condition
+
+
+def ere_escape(text):
+    """Escape text for use as a literal in an ERE (also valid Python re)."""
+    return ''.join(f'\\{c}' if c in ERE_SPECIAL else c for c in str(text))
+
+
+def _dquote(text):
+    """Quote text in double quotes for bash (the form task scripts use)."""
+    return '"' + re.sub(r'(["\\$`])', r'\\\1', text) + '"'
+
+
+def _stat(path):
+    # %f (raw mode, hex) rather than %F: the file type name is localized and
+    # sshd passes the client's LANG on to the node
+    return f'stat -L -c %f:%a:%U:%G {shlex.quote(path)}'
+
+
+def _firewall(check, what):
+    permanent = '--permanent ' if check.get('permanent') else ''
+    return f'firewall-cmd {permanent}--zone={check.get("zone", "public")} --list-{what}'
+
+
+# File type digit of the raw mode stat -c %f prints (S_IFDIR 0o040000, S_IFREG 0o100000)
+S_IFDIR = '4'
+S_IFREG = '8'
+
+
+# type -> (required params, builder returning the probe command and predicate)
+CHECK_TYPES = {
+    'user_exists': (('user',), lambda c: {'command': f'id {shlex.quote(c["user"])}'}),
+    'user_absent': (('user',), lambda c: {'command': f'id {shlex.quote(c["user"])}', 'negate': True}),
+    'user_in_group': (('user', 'group'), lambda c: {
+        'command': f'id {shlex.quote(c["user"])}',
+        'regex': rf'groups=(.*[=,])?[0-9]+\({ere_escape(c["group"])}\)(,|$)'}),
+    'user_uid': (('user', 'uid'), lambda c: {
+        'command': f'getent passwd {shlex.quote(c["user"])}',
+        'regex': rf'^{ere_escape(c["user"])}:[^:]*:{c["uid"]}:'}),
+    'user_shell': (('user', 'shell'), lambda c: {
+        'command': f'getent passwd {shlex.quote(c["user"])}',
+        'regex': rf':{ere_escape(c["shell"])}$'}),
+    'group_exists': (('group',), lambda c: {'command': f'getent group {shlex.quote(c["group"])}'}),
+    'group_gid': (('group', 'gid'), lambda c: {
+        'command': f'getent group {shlex.quote(c["group"])}',
+        'regex': rf'^{ere_escape(c["group"])}:[^:]*:{c["gid"]}:'}),
+    'path_exists': (('path',), lambda c: {'command': _stat(c['path'])}),
+    'directory': (('path',), lambda c: {'command': _stat(c['path']), 'regex': rf'^{S_IFDIR}[0-9a-f]{{3}}:'}),
+    'regular_file': (('path',), lambda c: {'command': _stat(c['path']), 'regex': rf'^{S_IFREG}[0-9a-f]{{3}}:'}),
+    'file_mode': (('path', 'mode'), lambda c: {
+        'command': _stat(c['path']), 'regex': rf':{str(c["mode"]).lstrip("0") or "0"}:[^:]*:[^:]*$'}),
+    'file_owner': (('path', 'owner'), lambda c: {
+        'command': _stat(c['path']), 'regex': rf':{ere_escape(c["owner"])}:[^:]*$'}),
+    'file_group': (('path', 'group'), lambda c: {
+        'command': _stat(c['path']), 'regex': rf':{ere_escape(c["group"])}$'}),
+    'file_contains': (('path', 'text'), lambda c: {
+        'command': (f'grep -qF{"i" if c.get("ignore_case") else ""} -- '
+                    f'{shlex.quote(c["text"])} {shlex.quote(c["path"])}')}),
+    'service_active': (('service',), lambda c: {'command': f'systemctl is-active {shlex.quote(c["service"])}'}),
+    'service_enabled': (('service',), lambda c: {'command': f'systemctl is-enabled {shlex.quote(c["service"])}'}),
+    'package_installed': (('package',), lambda c: {'command': f'rpm -q {shlex.quote(c["package"])}'}),
+    'mounted': (('path',), lambda c: {
+        'command': f'findmnt -n -o FSTYPE --mountpoint {shlex.quote(c["path"])}',
+        **({'equals': c['fstype'], 'rc': 0} if c.get('fstype') else {})}),
+    'fstab_entry': (('path',), lambda c: {
+        'command': 'cat /etc/fstab', 'regex': rf'^[^#]*[ \t]{ere_escape(c["path"])}[ \t]'}),
+    'swap_active': ((), lambda c: {'command': 'swapon --show', 'regex': '.'}),
+    'selinux_mode': (('mode',), lambda c: {'command': 'getenforce', 'equals': c['mode'], 'ignore_case': True}),
+    'selinux_boolean': (('boolean',), lambda c: {
+        'command': f'getsebool {shlex.quote(c["boolean"])}',
+        'regex': rf'--> {"on" if c.get("value", "on") in ("on", True, 1) else "off"}$'}),
+    'port_in_selinux_type': (('port', 'type'), lambda c: {
+        'command': 'semanage port -l',
+        'regex': (rf'^{ere_escape(c["type"])}[ \t]+{c.get("protocol", "tcp")}[ \t]+'
+                  rf'(.*[ ,])?{c["port"]}(,|$)')}),
+    'firewall_port': (('port',), lambda c: {
+        'command': _firewall(c, 'ports'),
+        'regex': rf'(^| ){c["port"]}/{c.get("protocol", "tcp")}( |$)'}),
+    'firewall_service': (('service',), lambda c: {
+        'command': _firewall(c, 'services'), 'regex': rf'(^| ){ere_escape(c["service"])}( |$)'}),
+    'command': (('command',), lambda c: {
+        key: c[key] for key in ('command', 'rc', 'contains', 'regex', 'equals') if key in c}),
+}
+
+COMMON_KEYS = {'type', 'node', 'message', 'fail_message', 'points', 'negate', 'ignore_case'}
+
+
+def compile_check(spec, default_node='node1'):
+    """Compile one JSON check definition into a CompiledCheck."""
+    kind = spec.get('type')
+    if kind not in CHECK_TYPES:
+        raise CheckDefinitionError(f'Unknown check type: {kind!r}')
+    required, build = CHECK_TYPES[kind]
+    missing = [key for key in required if key not in spec]
+    if missing:
+        raise CheckDefinitionError(f'{kind} check needs: {", ".join(missing)}')
+    if 'message' not in spec:
+        raise CheckDefinitionError(f'{kind} check needs a message')
+    node = spec.get('node', default_node)
+    if node not in ('node1', 'node2'):
+        raise CheckDefinitionError(f'Invalid node: {node!r}')
+
+    probe = build(spec)
+    negate = bool(spec.get('negate')) != bool(probe.pop('negate', False))
+    return CompiledCheck(
+        node=node,
+        message=spec['message'],
+        fail_message=spec.get('fail_message', ''),
+        points=int(spec.get('points', DEFAULT_POINTS)),
+        ignore_case=bool(spec.get('ignore_case') or probe.pop('ignore_case', False)),
+        negate=negate,
+        **probe,
+    )
+
+
+def load_task(path):
+    """Load a checks/task-*.json file into a TaskDefinition with compiled checks."""
+    path = Path(path)
+    try:
+        data = json.loads(path.read_text())
+    except json.JSONDecodeError as e:
+        raise CheckDefinitionError(f'{path.name}: {e}') from e
+
+    task = TaskDefinition(
+        id=path.stem,
+        path=path,
+        description=data.get('task', ''),
+        category=data.get('category', ''),
+        target=data.get('target', ''),
+        expected_ip=data.get('expected_ip', ''),
+        notes=tuple(data.get('notes', ())),
+    )
+    try:
+        task.checks = [compile_check(spec, task.target_node) for spec in data.get('checks', [])]
+        if 'depends' in data:
+            task.depends = tuple(parse_dependency(spec) for spec in data['depends'])
+    except ValueError as e:
+        raise CheckDefinitionError(f'{path.name}: {e}') from e
+    return task
+
+
+def render_bash(task):
+    """Bash version of a JSON task, for exam-grader.sh."""
+    lines = ['#!/usr/bin/env bash', f'# Task: {task.description}', f'# Category: {task.category}']
+    if task.target:
+        lines.append(f'# Target: {task.target}')
+    if task.expected_ip:
+        lines.append(f'# EXPECTED_IP: {task.expected_ip}')
+    if task.depends is not None:
+        lines.append(f'# Depends: {" ".join(task.depends)}'.rstrip())
+    lines += [f'# {note}' for note in task.notes]
+    lines.append(f'# Generated from {task.path.name} by `make checks`; edit the JSON instead')
+    for check in task.checks:
+        args = [shlex.quote(check.bash()), shlex.quote(check.message), shlex.quote(check.fail_message)]
+        if check.points != DEFAULT_POINTS:
+            args.append(str(check.points))
+        lines += ['', f'check {args[0]} \\'] + [f'    {arg} \\' for arg in args[1:-1]] + [f'    {args[-1]}']
+    return '\n'.join(lines) + '\n'
+
+
+# --- Migration from bash task scripts ---
+
+GREP_FLAGS = set('qiEF')
+BRE_SPECIAL = set('.[]*^$')
+
+
+class NotConvertible(Exception):
+    """A task script construct has no declarative equivalent."""
+
+
+def _tokens(text):
+    lexer = shlex.shlex(text, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        return list(lexer)
+    except ValueError as e:
+        raise NotConvertible(str(e)) from e
+
+
+def _skip_redirects(tokens, i):
+    """Skip output redirections to /dev/null; returns (index, stdout kept)."""
+    stdout_kept = True
+    while i < len(tokens):
+        if tokens[i] in ('1', '2') and i + 1 < len(tokens) and tokens[i + 1] in ('>', '>&'):
+            fd, op = tokens[i], tokens[i + 1]
+            i += 1
+        else:
+            fd, op = '1', tokens[i]
+        if op == '&>' or (op == '>' and fd == '1'):
+            stdout_kept = False
+        if op not in ('>', '>&', '&>') or i + 1 >= len(tokens) or tokens[i + 1] not in ('/dev/null', '1', '2'):
+            break
+        i += 2
+    return i, stdout_kept
+
+
+def _grep_predicate(tokens, i):
+    """Parse "grep -q[iEF] PATTERN" at tokens[i:]; returns (predicate, next index)."""
+    if i >= len(tokens) or tokens[i] != 'grep':
+        raise NotConvertible('pipe into something other than grep')
+    i += 1
+    flags = set()
+    while i < len(tokens) and tokens[i].startswith('-') and tokens[i] != '--':
+        flags |= set(tokens[i][1:])
+        i += 1
+    if i < len(tokens) and tokens[i] == '--':
+        i += 1
+    if 'q' not in flags or not flags <= GREP_FLAGS or i >= len(tokens):
+        raise NotConvertible(f'unsupported grep options: {"".join(sorted(flags))}')
+    pattern = tokens[i]
+    predicate = {'ignore_case': True} if 'i' in flags else {}
+    if 'F' in flags or not (set(pattern) & (ERE_SPECIAL if 'E' in flags else BRE_SPECIAL | {'\\'})):
+        predicate['contains'] = pattern
+    elif 'E' in flags:
+        predicate['regex'] = pattern
+    elif '\\' in pattern or pattern.startswith('*'):
+        raise NotConvertible(f'basic regex {pattern!r}')
+    else:
+        # BRE without backslashes: the ERE equivalent escapes what BRE takes literally
+        predicate['regex'] = ''.join(f'\\{c}' if c in '+?(){}|' else c for c in pattern)
+    return predicate, i + 1
+
+
+def convert_condition(condition):
+    """Turn a check() condition into a JSON check definition (without messages)."""
+    if any(c in condition for c in '`') or '$(' in condition:
+        raise NotConvertible('command substitution')
+    tokens = _tokens(condition)
+    i = 0
+    negate = tokens[:1] == ['!']
+    if negate:
+        i += 1
+    if tokens[i:i + 1] != ['run_ssh'] or i + 2 >= len(tokens):
+        raise NotConvertible('not a single run_ssh call')
+    host = tokens[i + 1]
+    node = {'$NODE1_IP': 'node1', '$NODE2_IP': 'node2'}.get(host)
+    if node is None:
+        raise NotConvertible(f'host {host!r}')
+    i += 2
+    words = []
+    while i < len(tokens) and tokens[i] not in ('|', '>', '>&', '&>', '&&', '||', ';', '&') \
+            and not (tokens[i] in ('1', '2') and i + 1 < len(tokens) and tokens[i + 1] in ('>', '>&')):
+        words.append(tokens[i])
+        i += 1
+    command = ' '.join(words)
+    if not command or '$' in command or '\\' in command:
+        raise NotConvertible('remote command uses shell expansion')
+
+    check = {'type': 'command', 'node': node, 'command': command}
+    i, _ = _skip_redirects(tokens, i)
+    if i < len(tokens) and tokens[i] == '|':
+        predicate, i = _grep_predicate(tokens, i + 1)
+        check.update(predicate)
+        i, _ = _skip_redirects(tokens, i)
+    if i != len(tokens):
+        raise NotConvertible(f'unexpected {tokens[i]!r}')
+    if negate:
+        check['negate'] = True
+    return _specialize(check)
+
+
+def _strip_redirects(command, keep_stdout):
+    """Drop trailing redirections to /dev/null that cannot affect the check."""
+    words = command.split()
+    while words:
+        if words[-1] in ('2>/dev/null', '2>&1') or (not keep_stdout and words[-1] in ('&>/dev/null', '>/dev/null')):
+            words.pop()
+        elif not keep_stdout and words[-2:] in (['&>', '/dev/null'], ['>', '/dev/null']):
+            del words[-2:]
+        else:
+            break
+    return ' '.join(words) if len(words) != len(command.split()) else command
+
+
+def _specialize(check):
+    """Use a typed check where it is exactly equivalent to the command."""
+    # Only stdout is ever inspected, and only if there is a predicate
+    check['command'] = _strip_redirects(check['command'], keep_stdout='contains' in check or 'regex' in check)
+    command = check['command']
+    # A grep run remotely on the command's output can run locally instead
+    if ' | ' in command and 'contains' not in check and 'regex' not in check:
+        left, right = command.split(' | ', 1)
+        try:
+            tokens = _tokens(right)
+            predicate, end = _grep_predicate(tokens, 0)
+            end, _ = _skip_redirects(tokens, end)
+            if end == len(tokens) and '|' not in left and left.strip():
+                check = {**check, 'command': _strip_redirects(left.strip(), keep_stdout=True), **predicate}
+                command = check['command']
+        except NotConvertible:
+            pass
+    if set(check) - {'type', 'node', 'command', 'negate'}:
+        return check
+
+    words = command.split()
+    if words[:1] == ['[[']:
+        if words[-1] != ']]':
+            return check
+        words = words[:-1]
+    if any(shlex.quote(word) != word for word in words[1:]):
+        return check
+    simple = {
+        ('id',): ('user_exists', 'user'),
+        ('getent', 'group'): ('group_exists', 'group'),
+        ('systemctl', 'is-active'): ('service_active', 'service'),
+        ('systemctl', 'is-enabled'): ('service_enabled', 'service'),
+        ('rpm', '-q'): ('package_installed', 'package'),
+        ('[[', '-d'): ('directory', 'path'),
+        ('[[', '-f'): ('regular_file', 'path'),
+        ('[[', '-e'): ('path_exists', 'path'),
+        ('test', '-d'): ('directory', 'path'),
+        ('test', '-f'): ('regular_file', 'path'),
+        ('test', '-e'): ('path_exists', 'path'),
+    }
+    for prefix, (kind, key) in simple.items():
+        if len(words) == len(prefix) + 1 and tuple(words[:-1]) == prefix and not words[-1].startswith('-') \
+                and not set(words[-1]) & set('*?['):
+            typed = {'type': kind, 'node': check['node'], key: words[-1]}
+            if check.get('negate'):
+                typed = {**typed, 'type': 'user_absent'} if kind == 'user_exists' else {**typed, 'negate': True}
+            return typed
+    # grep -q[F] with a literal pattern on one file
+    if len(words) == 4 and words[0] == 'grep' and words[1] in ('-q', '-qF', '-qi', '-qiF', '-qFi') \
+            and not set(words[2]) & (BRE_SPECIAL | {'\\'}) and not words[2].startswith('-'):
+        typed = {'type': 'file_contains', 'node': check['node'], 'path': words[3], 'text': words[2]}
+        if 'i' in words[1]:
+            typed['ignore_case'] = True
+        if check.get('negate'):
+            typed['negate'] = True
+        return typed
+    return check
+
+
+def _logical_lines(body):
+    lines = []
+    current = ''
+    for line in body.splitlines():
+        if not current and (not line.strip() or line.lstrip().startswith('#')):
+            continue
+        if line.endswith('\\'):
+            current += line[:-1] + ' '
+            continue
+        lines.append((current + line).strip())
+        current = ''
+    if current:
+        lines.append(current.strip())
+    return lines
+
+
+def migrate_script(path, recover_quoting=False):
+    """Convert a bash task script to a JSON task definition.
+
+    Returns the JSON document; raises NotConvertible naming the first
+    construct that has no declarative equivalent.
+    """
+    text = Path(path).read_text()
+    headers = {}
+    for key, value in HEADER_RE.findall(text):
+        headers.setdefault(key, value.strip())
+
+    checks = []
+    for line in _logical_lines(text):
+        if re.match(r'^[A-Za-z_][A-Za-z0-9_]*=', line) and ' ' not in line.split('=', 1)[0]:
+            continue  # variable assignments; conditions using them are rejected below
+        if line.startswith("check \\'"):
+            if not recover_quoting:
+                raise NotConvertible("broken quoting (check \\'...\\'); use --recover-quoting")
+            end = line.rfind("\\'")
+            condition, rest = line[len("check \\'"):end], line[end + 2:]
+            args = [condition] + _tokens(rest)
+        elif line.startswith('check '):
+            args = _tokens(line)[1:]
+        else:
+            raise NotConvertible(f'shell logic: {line[:40]!r}')
+        if len(args) < 2 or any('$' in arg for arg in args[1:3]):
+            raise NotConvertible('check() messages use shell expansion')
+        check = convert_condition(args[0])
+        check['message'] = args[1]
+        if len(args) > 2 and args[2]:
+            check['fail_message'] = args[2]
+        if len(args) > 3:
+            if not args[3].isdigit():
+                raise NotConvertible(f'points {args[3]!r}')
+            if int(args[3]) != DEFAULT_POINTS:
+                check['points'] = int(args[3])
+        checks.append(check)
+    if not checks:
+        raise NotConvertible('no checks')
+
+    notes = []
+    for line in text.splitlines()[1:]:
+        if not line.startswith('#'):
+            break
+        if not HEADER_RE.match(line):
+            notes.append(line[1:].strip())
+
+    task = {'task': headers.get('Task', ''), 'category': headers.get('Category', '')}
+    if headers.get('Target'):
+        task['target'] = headers['Target'].replace(' ', '')
+    if headers.get('EXPECTED_IP'):
+        task['expected_ip'] = headers['EXPECTED_IP'].replace(' ', '')
+    if 'Depends' in headers:
+        task['depends'] = re.findall(r'[^\s,]+', headers['Depends'])
+    if notes:
+        task['notes'] = notes
+    first = ('type', 'node', 'message', 'fail_message')
+    task['checks'] = [{k: check[k] for k in (*first, *sorted(set(check) - set(first))) if k in check}
+                      for check in checks]
+    return task
+
+
+def _main(argv):
+    checks_dir = Path(__file__).parent.parent / 'checks'
+    if not argv or argv[0] not in ('render', 'migrate'):
+        print(__doc__.strip())
+        return 2
+    command, args = argv[0], argv[1:]
+    options = {a for a in args if a.startswith('--')}
+    paths = [Path(a) for a in args if not a.startswith('--')]
+
+    if command == 'render':
+        for path in paths or sorted(checks_dir.glob('*.json')):
+            task = load_task(path)
+            path.with_suffix('.sh').write_text(render_bash(task))
+            print(f'{path.with_suffix(".sh").name}: {len(task.checks)} checks')
+        return 0
+
+    converted = 0
+    for path in paths or sorted(checks_dir.glob('*.sh')):
+        if path.with_suffix('.json').exists():
+            continue
+        try:
+            task = migrate_script(path, recover_quoting='--recover-quoting' in options)
+        except NotConvertible as e:
+            print(f'{path.name}: skipped, {e}')
+            continue
+        converted += 1
+        print(f'{path.name}: {len(task["checks"])} checks')
+        if '--write' in options:
+            json_path = path.with_suffix('.json')
+            json_path.write_text(json.dumps(task, indent=2) + '\n')
+            path.write_text(render_bash(load_task(json_path)))
+    print(f'{converted} scripts convertible' + ('' if '--write' in options else ' (dry run, use --write)'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main(sys.argv[1:]))
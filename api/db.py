@@ -0,0 +1,489 @@
+"""
+Results database
+SQLite storage for exam/practice results: schema migrations, stats rollups
+and a pool of WAL-mode connections shared by the request threads
+"""
+
+import base64
+import json
+import logging
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from metrics import DB_TRANSACTION
+
+logger = logging.getLogger(__name__)
+
+# Applied to every pooled connection. WAL lets readers run while a write
+# is in progress; synchronous=NORMAL is durable across crashes in WAL mode
+CONNECTION_PRAGMAS = (
+    'journal_mode = WAL',
+    'synchronous = NORMAL',
+    'foreign_keys = ON',
+    'busy_timeout = 5000',
+    'cache_size = -8000',
+    'temp_store = MEMORY',
+)
+
+# Idle connections kept open for reuse
+POOL_SIZE = 8
+
+# Compiled statements cached per connection (sqlite3 reuses them by SQL text)
+STATEMENT_CACHE_SIZE = 256
+
+
+# Bump when SCHEMA changes and add the step to migrate_db()
+SCHEMA_VERSION = 4
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        total INTEGER NOT NULL,
+        passed INTEGER NOT NULL,
+        duration_seconds INTEGER,
+        lab_id TEXT
+    );
+    CREATE TABLE IF NOT EXISTS result_checks (
+        result_id INTEGER NOT NULL REFERENCES results(id) ON DELETE CASCADE,
+        position INTEGER NOT NULL,
+        task TEXT NOT NULL,
+        category TEXT NOT NULL,
+        check_name TEXT NOT NULL,
+        passed INTEGER NOT NULL,
+        points INTEGER NOT NULL,
+        PRIMARY KEY (result_id, position)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS result_categories (
+        result_id INTEGER NOT NULL REFERENCES results(id) ON DELETE CASCADE,
+        category TEXT NOT NULL,
+        earned INTEGER NOT NULL,
+        possible INTEGER NOT NULL,
+        PRIMARY KEY (result_id, category)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_results_timestamp ON results (timestamp, id);
+    CREATE INDEX IF NOT EXISTS idx_results_mode ON results (mode, timestamp, id);
+    CREATE INDEX IF NOT EXISTS idx_result_checks_task ON result_checks (task, passed);
+    CREATE INDEX IF NOT EXISTS idx_result_categories_category ON result_categories (category, earned, possible);
+'''
+
+# Lab environments (node pairs) besides the one in the config file, and
+# the index partitioning results by lab (NULL is the config file's lab)
+LAB_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS labs (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        node1 TEXT NOT NULL,
+        node1_ip TEXT NOT NULL,
+        node2 TEXT NOT NULL,
+        node2_ip TEXT NOT NULL,
+        root_password TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_results_lab ON results (lab_id, timestamp, id);
+'''
+
+# State the worker processes of a multi-process deployment share: background
+# jobs and reboots (shared.py), grading sessions, node status and the
+# results of incremental grading
+SHARED_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS operations (
+        kind TEXT NOT NULL,
+        id TEXT NOT NULL,
+        owner INTEGER NOT NULL,
+        revision INTEGER NOT NULL,
+        finished INTEGER NOT NULL,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        snapshot TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (kind, id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS grading_sessions (
+        id TEXT PRIMARY KEY,
+        created_at TEXT NOT NULL,
+        used_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS node_status (
+        lab_id TEXT NOT NULL,
+        node TEXT NOT NULL,
+        state TEXT NOT NULL,
+        probed_at REAL NOT NULL,
+        PRIMARY KEY (lab_id, node)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS task_results (
+        key TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        checks TEXT NOT NULL,
+        used_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_task_results_used ON task_results (used_at);
+'''
+
+# Running totals kept in step with the results tables by update_rollups()
+ROLLUP_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS stats_overall (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        attempts INTEGER NOT NULL,
+        passed INTEGER NOT NULL,
+        score INTEGER NOT NULL,
+        total INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS stats_category (
+        category TEXT PRIMARY KEY,
+        attempts INTEGER NOT NULL,
+        earned INTEGER NOT NULL,
+        possible INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS stats_task (
+        task TEXT PRIMARY KEY,
+        checks INTEGER NOT NULL,
+        checks_passed INTEGER NOT NULL,
+        earned INTEGER NOT NULL,
+        possible INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS stats_day (
+        day TEXT PRIMARY KEY,
+        attempts INTEGER NOT NULL,
+        passed INTEGER NOT NULL,
+        score INTEGER NOT NULL,
+        total INTEGER NOT NULL
+    ) WITHOUT ROWID;
+'''
+
+# Each statement adds :sign times one result's contribution (-1 removes it)
+ROLLUP_UPDATES = (
+    '''INSERT INTO stats_overall (id, attempts, passed, score, total)
+       SELECT 1, :sign, :sign * passed, :sign * score, :sign * total FROM results WHERE id = :id
+       ON CONFLICT (id) DO UPDATE SET attempts = attempts + excluded.attempts,
+           passed = passed + excluded.passed, score = score + excluded.score, total = total + excluded.total''',
+    '''INSERT INTO stats_day (day, attempts, passed, score, total)
+       SELECT substr(timestamp, 1, 10), :sign, :sign * passed, :sign * score, :sign * total
+       FROM results WHERE id = :id
+       ON CONFLICT (day) DO UPDATE SET attempts = attempts + excluded.attempts,
+           passed = passed + excluded.passed, score = score + excluded.score, total = total + excluded.total''',
+    '''INSERT INTO stats_category (category, attempts, earned, possible)
+       SELECT category, :sign, :sign * earned, :sign * possible FROM result_categories WHERE result_id = :id
+       ON CONFLICT (category) DO UPDATE SET attempts = attempts + excluded.attempts,
+           earned = earned + excluded.earned, possible = possible + excluded.possible''',
+    '''INSERT INTO stats_task (task, checks, checks_passed, earned, possible)
+       SELECT task, :sign * COUNT(*), :sign * SUM(passed), :sign * SUM(passed * points), :sign * SUM(points)
+       FROM result_checks WHERE result_id = :id GROUP BY task
+       ON CONFLICT (task) DO UPDATE SET checks = checks + excluded.checks,
+           checks_passed = checks_passed + excluded.checks_passed,
+           earned = earned + excluded.earned, possible = possible + excluded.possible''',
+)
+
+
+# What GET /api/stats reads: the rollups for all results, or (for one lab)
+# the same figures aggregated from that lab's results through idx_results_lab
+STATS_QUERIES = {
+    'overall': 'SELECT attempts AS total, passed FROM stats_overall',
+    'categories': 'SELECT category, earned, possible FROM stats_category',
+    'days': 'SELECT * FROM stats_day ORDER BY day DESC LIMIT 30',
+    'tasks': 'SELECT * FROM stats_task ORDER BY task',
+}
+LAB_STATS_QUERIES = {
+    'overall': 'SELECT COUNT(*) AS total, SUM(passed) AS passed FROM results WHERE lab_id IS :lab',
+    'categories': '''SELECT category, SUM(earned) AS earned, SUM(possible) AS possible
+                    FROM result_categories JOIN results ON results.id = result_id
+                    WHERE lab_id IS :lab GROUP BY category''',
+    'days': '''SELECT substr(timestamp, 1, 10) AS day, COUNT(*) AS attempts, SUM(passed) AS passed,
+                  SUM(score) AS score, SUM(total) AS total
+              FROM results WHERE lab_id IS :lab GROUP BY 1 ORDER BY 1 DESC LIMIT 30''',
+    'tasks': '''SELECT task, COUNT(*) AS checks, SUM(result_checks.passed) AS checks_passed,
+                   SUM(result_checks.passed * points) AS earned, SUM(points) AS possible
+               FROM result_checks JOIN results ON results.id = result_id
+               WHERE lab_id IS :lab GROUP BY task ORDER BY task''',
+}
+
+
+class Database:
+    """Pool of SQLite connections to one database file.
+
+    Each connection is used by one thread at a time; transaction() borrows
+    one (a previously used one when available, so its page cache and
+    prepared statements are reused) and returns it afterwards.
+    """
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = Path(path)
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(f'PRAGMA {pragma}')
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def transaction(self, write=False):
+        """A pooled connection inside one transaction, committed on success.
+
+        Writers take the write lock up front (BEGIN IMMEDIATE) so they queue
+        on busy_timeout instead of failing mid-transaction; readers see one
+        consistent snapshot and never block writers.
+        """
+        conn = self._acquire()
+        healthy = True
+        started = time.monotonic()
+        try:
+            conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            healthy = False
+            raise
+        finally:
+            DB_TRANSACTION.observe(time.monotonic() - started, mode='write' if write else 'read')
+            # A connection that hit a database error is not reused
+            if healthy:
+                self._release(conn)
+            else:
+                conn.close()
+
+    def init(self):
+        """Create or migrate the schema."""
+        conn = self._connect()
+        try:
+            migrate_db(conn)
+        finally:
+            conn.close()
+
+    def close(self):
+        """Close the idle connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def migrate_db(conn):
+    """Bring the schema up to SCHEMA_VERSION (tracked in PRAGMA user_version).
+
+    Version 0 is the original layout with categories and checks stored as
+    JSON text in results; its rows are moved into the normalized tables.
+    Version 2 adds the stats rollups, built from the stored results.
+    Version 3 adds the labs table and the lab of each result.
+    Version 4 adds the tables shared by worker processes.
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Another worker process may have migrated while this one waited for the lock
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            conn.execute('COMMIT')
+            return
+        if version < 1:
+            _migrate_v1(conn)
+        if 'lab_id' not in {row[1] for row in conn.execute('PRAGMA table_info(results)')}:
+            conn.execute('ALTER TABLE results ADD COLUMN lab_id TEXT')
+        for statement in (ROLLUP_SCHEMA + LAB_SCHEMA + SHARED_SCHEMA).split(';'):
+            if statement.strip():
+                conn.execute(statement)
+        rebuild_rollups(conn)
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _migrate_v1(conn):
+    """Create the normalized results tables, moving version 0 JSON blobs into them."""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(results)')}
+    legacy = 'checks' in columns
+    if legacy:
+        conn.execute('ALTER TABLE results RENAME TO results_v0')
+    for statement in SCHEMA.split(';'):
+        if statement.strip():
+            conn.execute(statement)
+    if legacy:
+        rows = conn.execute('''
+            SELECT id, timestamp, mode, score, total, passed, duration_seconds, categories, checks
+            FROM results_v0 ORDER BY id
+        ''').fetchall()
+        for row in rows:
+            (result_id, timestamp, mode, score, total, passed, duration, categories, checks) = row
+            conn.execute('''
+                INSERT INTO results (id, timestamp, mode, score, total, passed, duration_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (result_id, timestamp, mode, score, total, passed, duration))
+            insert_result_details(conn, result_id, _json_or(categories, {}), _json_or(checks, []))
+        conn.execute('DROP TABLE results_v0')
+        logger.info(f"Migrated {len(rows)} results to the normalized schema")
+
+
+# Largest value an SQLite INTEGER column holds
+MAX_INTEGER = 2 ** 63 - 1
+
+
+def _json_or(text, default):
+    try:
+        value = json.loads(text)
+    except (TypeError, ValueError):
+        return default
+    return value if isinstance(value, type(default)) else default
+
+
+def _integer(value):
+    """A posted count as stored (missing or empty is 0); ValueError if it is not a number."""
+    try:
+        number = int(value or 0)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'{value!r} is not a number') from None
+    if not -MAX_INTEGER <= number <= MAX_INTEGER:
+        raise ValueError(f'{value!r} is out of range')
+    return number
+
+
+def _count(value):
+    try:
+        return _integer(value)
+    except ValueError:
+        return 0
+
+
+def result_details_error(categories, checks):
+    """Why the categories and checks of a posted result cannot be stored, or None."""
+    if not isinstance(categories, dict):
+        return 'categories must be an object'
+    if not isinstance(checks, list):
+        return 'checks must be a list'
+    fields = [(f'categories.{category}.{key}', stats.get(key))
+              for category, stats in categories.items() if isinstance(stats, dict)
+              for key in ('earned', 'possible')]
+    fields += [(f'checks[{position}].points', check.get('points'))
+               for position, check in enumerate(checks) if isinstance(check, dict)]
+    for field, value in fields:
+        try:
+            _integer(value)
+        except ValueError as e:
+            return f'{field}: {e}'
+    return None
+
+
+def insert_result_details(conn, result_id, categories, checks):
+    """Store the per-category totals and per-check rows of one result.
+
+    Counts that are not numbers are stored as 0 (posted results are checked
+    with result_details_error first; this covers migrated legacy rows).
+    """
+    conn.executemany(
+        'INSERT OR REPLACE INTO result_categories (result_id, category, earned, possible) VALUES (?, ?, ?, ?)',
+        [(result_id, str(category), _count(stats.get('earned')), _count(stats.get('possible')))
+         for category, stats in categories.items() if isinstance(stats, dict)])
+    conn.executemany(
+        '''INSERT INTO result_checks (result_id, position, task, category, check_name, passed, points)
+           VALUES (?, ?, ?, ?, ?, ?, ?)''',
+        [(result_id, position, str(check.get('task', '')), str(check.get('category', '')),
+          str(check.get('check', '')), 1 if check.get('passed') else 0, _count(check.get('points')))
+         for position, check in enumerate(checks) if isinstance(check, dict)])
+
+
+def update_rollups(conn, result_id, sign):
+    """Add (sign=1) or remove (sign=-1) one stored result from the stats rollups.
+
+    Must run in the transaction that inserts the result (after its rows) or
+    deletes it (before its rows go).
+    """
+    for statement in ROLLUP_UPDATES:
+        conn.execute(statement, {'id': result_id, 'sign': sign})
+    if sign < 0:
+        conn.execute('DELETE FROM stats_overall WHERE attempts <= 0')
+        conn.execute('DELETE FROM stats_day WHERE attempts <= 0')
+        conn.execute('DELETE FROM stats_category WHERE attempts <= 0')
+        conn.execute('DELETE FROM stats_task WHERE checks <= 0')
+
+
+def rebuild_rollups(conn):
+    """Recompute every stats rollup from the results tables."""
+    conn.execute('DELETE FROM stats_overall')
+    conn.execute('DELETE FROM stats_day')
+    conn.execute('DELETE FROM stats_category')
+    conn.execute('DELETE FROM stats_task')
+    conn.execute('''
+        INSERT INTO stats_overall (id, attempts, passed, score, total)
+        SELECT 1, COUNT(*), SUM(passed), SUM(score), SUM(total) FROM results HAVING COUNT(*) > 0
+    ''')
+    conn.execute('''
+        INSERT INTO stats_day (day, attempts, passed, score, total)
+        SELECT substr(timestamp, 1, 10), COUNT(*), SUM(passed), SUM(score), SUM(total)
+        FROM results GROUP BY 1
+    ''')
+    conn.execute('''
+        INSERT INTO stats_category (category, attempts, earned, possible)
+        SELECT category, COUNT(*), SUM(earned), SUM(possible) FROM result_categories GROUP BY category
+    ''')
+    conn.execute('''
+        INSERT INTO stats_task (task, checks, checks_passed, earned, possible)
+        SELECT task, COUNT(*), SUM(passed), SUM(passed * points), SUM(points) FROM result_checks GROUP BY task
+    ''')
+
+
+def load_result_details(conn, result_ids, categories=True, checks=True):
+    """{result_id: (categories, checks)} for the given results, as clients get them.
+
+    Parts not asked for are left empty and not queried.
+    """
+    details = {result_id: ({}, []) for result_id in result_ids}
+    if not details:
+        return details
+    placeholders = ','.join('?' * len(details))
+    if categories:
+        for row in conn.execute(f'''
+                SELECT result_id, category, earned, possible FROM result_categories
+                WHERE result_id IN ({placeholders}) ORDER BY result_id, category''', list(details)):
+            details[row[0]][0][row[1]] = {'earned': row[2], 'possible': row[3]}
+    if checks:
+        for row in conn.execute(f'''
+                SELECT result_id, task, category, check_name, passed, points FROM result_checks
+                WHERE result_id IN ({placeholders}) ORDER BY result_id, position''', list(details)):
+            details[row[0]][1].append({'task': row[1], 'category': row[2], 'check': row[3],
+                                       'passed': bool(row[4]), 'points': row[5]})
+    return details
+
+
+def encode_cursor(timestamp, result_id):
+    """Opaque pagination cursor for the position after (timestamp, id)."""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, result_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor; raises ValueError if it is malformed."""
+    try:
+        timestamp, result_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from e
+    if not isinstance(timestamp, str) or not isinstance(result_id, int):
+        raise ValueError(f'Invalid cursor: {cursor!r}')
+    return timestamp, result_id
@@ -0,0 +1,132 @@
+"""
+Node IP discovery
+Finds the node addresses by asking libvirt and probing candidate IPs concurrently
+"""
+
+import asyncio
+import errno
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+SSH_PORT = 22
+# Hard limit (seconds) for a whole discovery run
+DISCOVERY_DEADLINE = 3.0
+# Last-resort addresses of the default lab setup
+FALLBACK_CANDIDATES = (('node2', '192.168.122.131'), ('node1', '192.168.122.141'))
+
+IPV4_RE = re.compile(r'^(\d{1,3}\.){3}\d{1,3}$')
+
+
+async def virsh_address(vm_name):
+    """IPv4 address libvirt reports for vm_name, or None."""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            'virsh', 'domifaddr', vm_name,
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL)
+    except FileNotFoundError:
+        return None
+    try:
+        stdout, _ = await proc.communicate()
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+    if proc.returncode != 0:
+        return None
+    for line in stdout.decode(errors='replace').splitlines():
+        if 'ipv4' not in line.lower():
+            continue
+        for part in line.split():
+            ip = part.split('/')[0]
+            if '/' in part and IPV4_RE.match(ip):
+                return ip
+    return None
+
+
+async def host_alive(ip, port=SSH_PORT):
+    """TCP connect to ip:port; a refused connection also proves the host is up."""
+    try:
+        _, writer = await asyncio.open_connection(ip, port)
+    except ConnectionRefusedError:
+        return True
+    except OSError as e:
+        return e.errno == errno.ECONNREFUSED
+    writer.close()
+    return True
+
+
+async def _discover(vm_names, candidates, port, deadline):
+    # One probe per distinct IP, one virsh call per VM, all at once
+    probes = {ip: asyncio.ensure_future(host_alive(ip, port)) for _, ip, _ in candidates}
+    lookups = {node: asyncio.ensure_future(virsh_address(name)) for node, name in vm_names.items()}
+    pending = set(probes.values()) | set(lookups.values())
+    found = {}
+
+    def decide(final=False):
+        """Settle each node whose best candidate is known.
+
+        At the deadline (final), take the best answer in so far instead.
+        """
+        for node in vm_names:
+            if node in found:
+                continue
+            lookup = lookups[node]
+            if lookup.done() and lookup.result():
+                found[node] = (lookup.result(), 'virsh')
+                continue
+            if not lookup.done() and not final:
+                continue
+            for candidate_node, ip, method in candidates:
+                if candidate_node != node:
+                    continue
+                probe = probes[ip]
+                if not probe.done() and not final:
+                    break  # a better candidate is still being probed
+                if probe.done() and probe.result():
+                    found[node] = (ip, method)
+                    break
+
+    try:
+        while pending and len(found) < len(vm_names):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            _, pending = await asyncio.wait(pending, timeout=remaining,
+                                            return_when=asyncio.FIRST_COMPLETED)
+            decide()
+        decide(final=True)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return found
+
+
+def discover(vm_names, configured, expected_ips, port=SSH_PORT, deadline=DISCOVERY_DEADLINE):
+    """Find the address of each node within `deadline` seconds.
+
+    vm_names maps node -> libvirt domain name and configured node -> the
+    current IP. Per node, the first answer in this order wins: libvirt, the
+    configured IP (method 'ping'), the EXPECTED_IP of tasks and the
+    built-in fallbacks (method 'scan'). Every candidate is probed at the
+    same time over TCP; at the deadline each node gets the best answer in
+    so far, and nodes without one are left out.
+
+    Returns {node: (ip, method)}.
+    """
+    candidates = []
+    ordered = [(node, ip, 'ping') for node, ip in configured.items() if ip]
+    ordered += [(node, ip, 'scan') for node, ip in (*expected_ips, *FALLBACK_CANDIDATES)]
+    for node, ip, method in ordered:
+        if not any(c[:2] == (node, ip) for c in candidates):
+            candidates.append((node, ip, method))
+
+    started = time.monotonic()
+    found = asyncio.run(_discover(vm_names, candidates, port, started + deadline))
+    logger.debug(f"IP discovery probed {len({ip for _, ip, _ in candidates})} addresses "
+                 f"in {time.monotonic() - started:.2f}s")
+    return found
@@ -0,0 +1,295 @@
+"""
+Remote fact cache
+Per-run cache of remote command results keyed by (node, command), seeded
+from a one-shot snapshot of each node's users, groups, mounts, services,
+SELinux booleans and firewall zones
+"""
+
+import logging
+import re
+import shlex
+import subprocess
+import threading
+import time
+
+from sshpool import RemoteResult
+
+logger = logging.getLogger(__name__)
+
+BOOT_ID_COMMAND = 'cat /proc/sys/kernel/random/boot_id'
+
+# Cached results are reused without a fresh boot id check for this long
+# (seconds); a node cannot go down and come back up within it
+FACT_VERIFY_INTERVAL = 5.0
+
+PASSWD = 'getent passwd'
+GROUP = 'getent group'
+UNITS = 'systemctl list-units --all --plain --no-legend --no-pager'
+UNIT_FILES = 'systemctl list-unit-files --plain --no-legend --no-pager'
+SEBOOLS = 'getsebool -a'
+ZONES = 'firewall-cmd --list-all-zones'
+PERMANENT_ZONES = 'firewall-cmd --permanent --list-all-zones'
+
+# Node-wide snapshots; gathered the first time a check needs one and then
+# used to answer every lookup of that kind, or served as-is when a check
+# runs exactly this command
+FACT_COMMANDS = (
+    PASSWD, GROUP, UNITS, UNIT_FILES, SEBOOLS, ZONES, PERMANENT_ZONES,
+    'systemctl get-default',
+    'getenforce',
+    'mount',
+    'findmnt',
+    'swapon --show',
+    'ip addr show',
+    'ip route show default',
+    'firewall-cmd --list-all',
+)
+
+# Output redirections a check may append: (suffix, keep stdout, keep stderr)
+REDIRECTS = (
+    ('&>/dev/null', False, False),
+    ('&> /dev/null', False, False),
+    ('>/dev/null 2>&1', False, False),
+    ('> /dev/null 2>&1', False, False),
+    ('2>/dev/null', True, False),
+    ('>/dev/null', False, True),
+)
+
+# systemctl is-enabled states that exit 0
+ENABLED_STATES = {'enabled', 'enabled-runtime', 'static', 'alias', 'indirect', 'generated', 'transient'}
+
+SIMPLE_GREP_RE = re.compile(r'^grep( +-[A-Za-z]+)* +("[^"$`\\]*"|\'[^\']*\'|[^\s"\'$`\\|;&<>()]+)$')
+FIREWALL_ZONE_RE = re.compile(
+    r'^firewall-cmd (?P<permanent>--permanent )?--zone=(?P<zone>[\w-]+) --list-(?P<what>all|ports|services)$')
+
+
+class FactCache:
+    """Remote command results shared by every grading unit of one run.
+
+    Keyed by (host, command). Besides exact repeats, common lookups
+    (getent, id, systemctl is-active/is-enabled, getsebool, firewall zones
+    and "<fact> | grep ...") are answered from node-wide fact snapshots, so
+    only the first check of a kind goes to the node. A changed boot id or a
+    node that moved to a new address drops everything known about it.
+    """
+
+    def __init__(self, ssh_pool):
+        self.ssh_pool = ssh_pool
+        self._lock = threading.Lock()
+        self._results = {}  # (host, command) -> RemoteResult
+        self._boot_ids = {}
+        self._verified = {}  # host -> monotonic time of the last boot id check
+
+    def recently_verified(self, host):
+        """Was the boot id of host checked within FACT_VERIFY_INTERVAL?"""
+        return time.monotonic() - self._verified.get(host, float('-inf')) < FACT_VERIFY_INTERVAL
+
+    def check_boot(self, host, boot):
+        """Record a boot id result; returns False (and invalidates) on a reboot."""
+        if boot is None or boot.returncode != 0:
+            return True
+        boot_id = boot.stdout.strip()
+        with self._lock:
+            known = self._boot_ids.get(host)
+            self._boot_ids[host] = boot_id
+            self._verified[host] = time.monotonic()
+        if known is None or known == boot_id:
+            return True
+        logger.info(f"{host} rebooted during grading, dropping cached results")
+        self.invalidate(host, keep_boot_id=True)
+        return False
+
+    def invalidate(self, host, keep_boot_id=False):
+        with self._lock:
+            if not keep_boot_id:
+                self._boot_ids.pop(host, None)
+                self._verified.pop(host, None)
+            for key in [key for key in self._results if key[0] == host]:
+                del self._results[key]
+
+    def store(self, host, command, result):
+        # Connection failures are not facts about the node
+        if result is not None and result.returncode != 255:
+            with self._lock:
+                self._results[(host, command)] = result
+
+    def plan(self, host, commands):
+        """Commands to send so that all of commands can be answered.
+
+        Derivable commands are replaced by the fact snapshots they need;
+        the rest (or those whose facts are unusable) are sent as-is.
+        """
+        plan = []
+        for command in commands:
+            derivation = self._derivation(_strip_redirect(command)[0])
+            missing = [f for f in derivation[0] if (host, f) not in self._results] if derivation else []
+            plan.extend(missing or [command])
+        return list(dict.fromkeys(plan))
+
+    def lookup(self, host, command):
+        """Cached or derived result of command on host, or None."""
+        with self._lock:
+            result = self._results.get((host, command))
+        if result is not None:
+            return result
+
+        command, keep_out, keep_err = _strip_redirect(command)
+        derivation = self._derivation(command)
+        if derivation is None:
+            return None
+        facts, derive = derivation
+        with self._lock:
+            if any((host, fact) not in self._results for fact in facts):
+                return None
+        result = derive(host)
+        if result is None:
+            return None
+        return RemoteResult(result.returncode,
+                            result.stdout if keep_out else b'',
+                            result.stderr if keep_err else b'')
+
+    def _derivation(self, command):
+        """(fact commands needed, function host -> result) for command, or None."""
+        if command in FACT_COMMANDS:
+            return (command,), lambda host: self._results.get((host, command))
+        if ' | ' in command:
+            left, right = command.split(' | ', 1)
+            source = self._derivation(left) if SIMPLE_GREP_RE.match(right) else None
+            if source is None:
+                return None
+            return source[0], lambda host: _grep(right, self.lookup(host, left))
+
+        words = command.split()
+        if len(words) == 3 and words[0] == 'getent' and words[1] in ('passwd', 'group'):
+            fact = PASSWD if words[1] == 'passwd' else GROUP
+            return (fact,), lambda host: self._getent(host, fact, words[2])
+        if len(words) == 2 and words[0] == 'id' and not words[1].startswith('-'):
+            return (PASSWD, GROUP), lambda host: self._id(host, words[1])
+        if (len(words) == 3 and words[0] == 'systemctl' and words[1] in ('is-active', 'is-enabled')
+                and not words[2].startswith('-')):
+            fact = UNITS if words[1] == 'is-active' else UNIT_FILES
+            return (fact,), lambda host: self._systemctl(host, words[1], words[2])
+        if len(words) == 2 and words[0] == 'getsebool' and not words[1].startswith('-'):
+            return (SEBOOLS,), lambda host: self._getsebool(host, words[1])
+        match = FIREWALL_ZONE_RE.match(command)
+        if match:
+            fact = PERMANENT_ZONES if match['permanent'] else ZONES
+            return (fact,), lambda host: self._firewall_zone(host, fact, match['zone'], match['what'])
+        return None
+
+    def _fact(self, host, command):
+        """Output lines of a gathered fact command, or None if unusable."""
+        with self._lock:
+            result = self._results.get((host, command))
+        if result is None or result.returncode != 0:
+            return None
+        return result.stdout.decode(errors='replace').splitlines()
+
+    def _getent(self, host, fact, key):
+        lines = self._fact(host, fact)
+        if lines is None:
+            return None
+        for line in lines:
+            fields = line.split(':')
+            if len(fields) > 2 and key in (fields[0], fields[2]):
+                return RemoteResult(0, f'{line}\n'.encode())
+        return RemoteResult(2)
+
+    def _id(self, host, user):
+        passwd = self._fact(host, PASSWD)
+        groups = self._fact(host, GROUP)
+        if passwd is None or groups is None:
+            return None
+        entry = next((line.split(':') for line in passwd if line.split(':')[0] == user), None)
+        if entry is None or len(entry) < 4:
+            return RemoteResult(1, b'', f"id: '{user}': no such user\n".encode())
+
+        uid, gid = entry[2], entry[3]
+        names = {}
+        member_of = []
+        for line in groups:
+            fields = line.split(':')
+            if len(fields) < 4:
+                continue
+            names.setdefault(fields[2], fields[0])
+            if user in fields[3].split(',') and fields[2] != gid:
+                member_of.append(fields[2])
+        primary = f'{gid}({names[gid]})' if gid in names else gid
+        group_list = ','.join([primary] + [f'{g}({names[g]})' for g in dict.fromkeys(member_of)])
+        return RemoteResult(0, f'uid={uid}({user}) gid={primary} groups={group_list}\n'.encode())
+
+    def _systemctl(self, host, verb, unit):
+        if '.' not in unit:
+            unit = f'{unit}.service'
+        if verb == 'is-active':
+            lines = self._fact(host, UNITS)
+            if lines is None:
+                return None
+            state = next((line.split()[2] for line in lines
+                          if len(line.split()) > 2 and line.split()[0] == unit), 'inactive')
+            return RemoteResult(0 if state == 'active' else 3, f'{state}\n'.encode())
+
+        lines = self._fact(host, UNIT_FILES)
+        if lines is None:
+            return None
+        state = next((line.split()[1] for line in lines
+                      if len(line.split()) > 1 and line.split()[0] == unit), None)
+        if state is None:
+            return RemoteResult(1, b'', f'Failed to get unit file state for {unit}: '
+                                        f'No such file or directory\n'.encode())
+        return RemoteResult(0 if state in ENABLED_STATES else 1, f'{state}\n'.encode())
+
+    def _getsebool(self, host, name):
+        lines = self._fact(host, SEBOOLS)
+        if lines is None:
+            return None
+        for line in lines:
+            if line.split(' --> ')[0] == name:
+                return RemoteResult(0, f'{line}\n'.encode())
+        return RemoteResult(1, b'', f'Error getting active value for {name}\n'.encode())
+
+    def _firewall_zone(self, host, fact, zone, what):
+        lines = self._fact(host, fact)
+        if lines is None:
+            return None
+        block = None
+        for line in lines:
+            if line and not line[0].isspace():
+                if block is not None:
+                    break
+                if line.split()[0] == zone:
+                    block = [line]
+            elif block is not None and line.strip():
+                block.append(line)
+        if block is None:
+            return RemoteResult(112, b'', f'Error: INVALID_ZONE: {zone}\n'.encode())
+        if what == 'all':
+            return RemoteResult(0, ('\n'.join(block) + '\n').encode())
+        for line in block[1:]:
+            key, _, value = line.strip().partition(':')
+            if key == what:
+                return RemoteResult(0, f'{value.strip()}\n'.encode())
+        return RemoteResult(0, b'\n')
+
+
+def _strip_redirect(command):
+    """Split a trailing output redirection off command.
+
+    Returns (command, keep stdout, keep stderr).
+    """
+    for suffix, keep_out, keep_err in REDIRECTS:
+        if command.endswith(suffix):
+            return command[:-len(suffix)].rstrip(), keep_out, keep_err
+    return command, True, True
+
+
+def _grep(grep_command, source):
+    """Run a simple grep command locally over a remote command's result."""
+    if source is None:
+        return None
+    try:
+        proc = subprocess.run(shlex.split(grep_command), input=source.stdout, capture_output=True,
+                              timeout=5)
+    except (ValueError, OSError, subprocess.TimeoutExpired):
+        return None
+    return RemoteResult(proc.returncode, proc.stdout, source.stderr + proc.stderr)
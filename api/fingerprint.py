@@ -0,0 +1,357 @@
+"""
+Task fingerprints
+Remote state each task depends on, fingerprinted in one round trip per node,
+and the last result of every task kept for as long as that state is unchanged
+"""
+
+import hashlib
+import json
+import logging
+import re
+import shlex
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from facts import BOOT_ID_COMMAND, PERMANENT_ZONES, SEBOOLS, UNIT_FILES, ZONES
+
+logger = logging.getLogger(__name__)
+
+# Task results kept for reuse (one per task and node set)
+RESULT_CACHE_SIZE = 4096
+
+# Node-wide state a task can depend on: kind -> commands whose output stands for it
+STATE_PROBES = {
+    'users': ("stat -c '%n %i %s %Y %Z' /etc/passwd /etc/group /etc/shadow /etc/gshadow",
+              'ls -1 /var/lib/systemd/linger'),
+    'units': (UNIT_FILES,
+              'systemctl list-units --all --plain --no-legend --no-pager '
+              '--type=service,socket,target,timer,path,mount,swap'),
+    'storage': ('cat /proc/self/mountinfo /proc/swaps',
+                'lsblk -rbno NAME,SIZE,TYPE,FSTYPE,UUID,LABEL,MOUNTPOINT',
+                "stat -c '%n %Y %s' /etc/lvm/backup/*"),
+    'network': ('ip -o addr show', 'ip -o route show', 'hostname',
+                'cat /etc/hosts /etc/resolv.conf',
+                "stat -c '%n %Y %s' /etc/NetworkManager/system-connections/*"),
+    'firewall': (ZONES, PERMANENT_ZONES),
+    'selinux': ('getenforce', SEBOOLS,
+                "stat -c '%n %Y %s' /etc/selinux/config /var/lib/selinux/targeted/active/*.local"),
+    'packages': ("stat -c '%n %Y %s' /var/lib/rpm/*",),
+}
+
+# What the result of a command depends on besides the absolute paths among
+# its arguments: extra dependency specs, or None when the command reads
+# state that has no cheap fingerprint (live sockets, other hosts, other
+# users' sessions) and its task has to run every time
+COMMAND_STATE = {
+    **dict.fromkeys(('cat', 'grep', 'egrep', 'fgrep', 'stat', 'ls', 'test', '[', '[[', 'head', 'tail',
+                     'wc', 'file', 'readlink', 'realpath', 'md5sum', 'sha256sum', 'diff', 'cmp',
+                     'awk', 'sed', 'cut', 'sort', 'uniq', 'tr', 'tar', 'getfacl', 'lsattr', 'echo',
+                     'printf', 'true', 'false', 'exit'), ()),
+    **dict.fromkeys(('id', 'groups', 'chage'), ('users',)),
+    'loginctl': ('users',),
+    **dict.fromkeys(('mount', 'findmnt', 'df', 'swapon', 'lsblk', 'blkid', 'lvs', 'vgs', 'pvs',
+                     'lvdisplay', 'vgdisplay', 'pvdisplay', 'xfs_info', 'tune2fs', 'dumpe2fs'),
+                    ('storage',)),
+    **dict.fromkeys(('ip', 'hostname', 'hostnamectl', 'nmcli'), ('network',)),
+    'firewall-cmd': ('firewall',),
+    **dict.fromkeys(('getenforce', 'getsebool', 'sestatus', 'semanage', 'matchpathcon'), ('selinux',)),
+    **dict.fromkeys(('rpm', 'dnf', 'yum'), ('packages',)),
+    'crontab': ('path:/var/spool/cron', 'path:/var/spool/cron/*'),
+    'tuned-adm': ('path:/etc/tuned/active_profile', 'path:/etc/tuned/profile_mode'),
+}
+
+# getent database -> what it reads (hosts and ahosts* may ask DNS, which has no fingerprint)
+GETENT_STATE = {
+    **dict.fromkeys(('passwd', 'group', 'shadow', 'gshadow'), ('users',)),
+    'networks': ('network',),
+    'services': ('path:/etc/services',),
+    'protocols': ('path:/etc/protocols',),
+}
+
+# Commands whose operands are files: command -> (leading operands that are
+# not, options that take a value, options that give the pattern or program
+# so that no leading operand is one)
+FILE_OPERANDS = {
+    **dict.fromkeys(('cat', 'wc', 'file', 'readlink', 'realpath', 'md5sum', 'sha256sum', 'diff',
+                     'cmp', 'getfacl', 'lsattr', 'ls'), (0, (), ())),
+    'stat': (0, ('-c', '--format', '--printf'), ()),
+    **dict.fromkeys(('head', 'tail'), (0, ('-n', '-c', '--lines', '--bytes'), ())),
+    'cut': (0, ('-d', '-f', '-c', '-b', '--delimiter', '--fields'), ()),
+    'sort': (0, ('-t', '-k', '-o', '--field-separator', '--key', '--output'), ()),
+    'uniq': (0, ('-f', '-s', '-w'), ()),
+    **dict.fromkeys(('grep', 'egrep', 'fgrep'), (1, ('-e', '-f', '-A', '-B', '-C', '-m', '--regexp', '--file'),
+                                                 ('-e', '-f', '--regexp', '--file'))),
+    'awk': (1, ('-F', '-v', '-f'), ('-f',)),
+    'sed': (1, ('-e', '-f', '--expression', '--file'), ('-e', '-f', '--expression', '--file')),
+}
+# Short options that make a command read whole directory trees
+RECURSIVE_OPTIONS = {'grep': 'rR', 'egrep': 'rR', 'fgrep': 'rR', 'diff': 'rR', 'ls': 'R',
+                     'getfacl': 'R', 'lsattr': 'R'}
+# test operators whose operand is a file
+FILE_TESTS = {'-e', '-f', '-d', '-s', '-r', '-w', '-x', '-L', '-h', '-b', '-c', '-p', '-S', '-O', '-G',
+              '-N', '-k', '-u', '-g'}
+
+SYSTEMCTL_UNIT_VERBS = ('is-active', 'is-enabled', 'is-failed', 'status', 'show', 'cat')
+SYSTEMCTL_LIST_VERBS = ('list-units', 'list-unit-files', 'list-timers', 'list-sockets')
+
+# Shell syntax that ends a command, and words before a command that do not change what it runs
+OPERATORS = {'|', '||', '&&', ';', '&', '(', ')'}
+KEYWORDS = {'!', '{', '}', 'if', 'then', 'else', 'elif', 'fi'}
+OUTPUT_REDIRECTS = {'>', '>>', '&>', '>&', '>|'}
+# Kernel and runtime trees: their files change without their mtimes changing
+VOLATILE_PATHS = ('/proc/', '/sys/', '/run/', '/dev/shm/')
+
+PATH_RE = re.compile(r'^/[\w.@+:*?/-]*$')
+UNIT_RE = re.compile(r'^[\w.@:-]+$')
+STAT_FORMAT = "'%i %s %Y %Z %f %u %g %C'"
+
+
+def parse_dependency(spec):
+    """Validate one declared dependency ("kind", "path:/abs/path" or "unit:name").
+
+    Returns the spec; raises ValueError if it cannot be fingerprinted.
+    """
+    kind, _, arg = spec.partition(':')
+    if kind in STATE_PROBES and not arg:
+        return spec
+    if kind == 'path' and PATH_RE.match(arg):
+        return spec
+    if kind == 'unit' and UNIT_RE.match(arg):
+        return spec
+    raise ValueError(f'Unknown dependency: {spec!r}')
+
+
+def command_dependencies(command):
+    """Dependency specs the result of a remote command depends on.
+
+    Returns a set of specs, or None when the command reads state this
+    module cannot fingerprint (the task is then graded every time).
+    """
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        return None
+
+    specs = set()
+    outer = []  # commands a $(...) or (...) is nested in
+    head, args = None, []  # command word and arguments of the simple command being read
+    skip = False
+    for token in [*tokens, ';']:
+        if skip:
+            skip = False
+            continue
+        if token in OUTPUT_REDIRECTS:
+            skip = True  # output target, not something the command reads
+            continue
+        if token in OPERATORS:
+            if token != '(' and head is not None:
+                found = _simple_command_dependencies(head, args)
+                if found is None:
+                    return None
+                specs |= found
+            if token == '(':
+                outer.append((head, args))
+                head, args = None, []
+            elif token == ')' and outer:
+                head, args = outer.pop()
+            else:
+                head, args = None, []
+            continue
+        if token == '$' or (head is None and token in KEYWORDS):
+            continue
+        if token.startswith(('~', '$')) or '`' in token or '$(' in token:
+            return None  # remote expansion: which state it reads is not known here
+        if head is None and re.match(r'^[A-Za-z_]\w*=', token):
+            args.append(token.split('=', 1)[1])
+        elif head is None:
+            head = token
+        else:
+            args.append(token)
+    return None if outer else specs
+
+
+def _simple_command_dependencies(head, args):
+    if head == 'systemctl':
+        return _systemctl_dependencies(args)
+    name = head.rsplit('/', 1)[-1]
+    if name == 'getent':
+        words = [arg for arg in args if not arg.startswith('-')]
+        extra = GETENT_STATE.get(words[0]) if words else None
+    else:
+        extra = COMMAND_STATE.get(name)
+    if extra is None:
+        return None
+    recursive = RECURSIVE_OPTIONS.get(name, '')
+    for arg in args:
+        if arg in ('--recursive', '--dereference-recursive'):
+            return None
+        if arg.startswith('-') and not arg.startswith('--') and any(c in recursive for c in arg[1:]):
+            return None
+    files = _file_operands(name, args)
+    if files is None or any(not path.startswith('/') for path in files):
+        return None  # relative to the remote working directory: not fingerprinted
+    specs = set(extra)
+    for arg in args:
+        path = arg.split('=', 1)[1] if arg.startswith('-') and '=' in arg else arg
+        if not path.startswith('/') or path == '/dev/null':
+            continue
+        if not PATH_RE.match(path) or path.startswith(VOLATILE_PATHS):
+            return None
+        path = path.rstrip('/') or '/'
+        specs.add(f'path:{path}')
+        if name == 'ls' and not any(c in path for c in '*?'):
+            # ls -l also shows the entries of a directory
+            specs.add(f'path:{path.rstrip("/")}/*')
+    return specs
+
+
+def _file_operands(name, args):
+    """Arguments naming files the command reads; None when it reads its working directory."""
+    if name in ('test', '[', '[['):
+        return [arg for op, arg in zip(args, args[1:]) if op in FILE_TESTS]
+    if name not in FILE_OPERANDS:
+        return []
+    skip, valued, program = FILE_OPERANDS[name]
+    operands = []
+    args = iter(args)
+    for arg in args:
+        if arg == '--':
+            operands.extend(args)
+        elif arg.startswith('--'):
+            option = arg.split('=', 1)[0]
+            skip = 0 if option in program else skip
+            if option == arg and option in valued:
+                next(args, None)
+        elif arg.startswith('-') and arg != '-':
+            # A short option group; a valued option takes the rest of it or the next word
+            for k, letter in enumerate(arg[1:], 2):
+                skip = 0 if f'-{letter}' in program else skip
+                if f'-{letter}' in valued:
+                    if k > len(arg) - 1:
+                        next(args, None)
+                    break
+        else:
+            operands.append(arg)
+    if name == 'ls' and not operands:
+        return None
+    return [arg for arg in operands[skip:] if arg != '-']
+
+
+def _systemctl_dependencies(args):
+    words = [arg for arg in args if not arg.startswith('-')]
+    if '--user' in args or not words:
+        return None
+    verb, units = words[0], words[1:]
+    if verb == 'get-default':
+        return {'path:/etc/systemd/system/default.target'}
+    if verb in SYSTEMCTL_LIST_VERBS:
+        return {'units'}
+    if verb in SYSTEMCTL_UNIT_VERBS and units and all(UNIT_RE.match(unit) for unit in units):
+        return {f'unit:{unit}' for unit in units}
+    return None
+
+
+def probe_commands(spec):
+    """Remote commands whose results make up the fingerprint of a dependency."""
+    kind, _, arg = spec.partition(':')
+    if kind == 'path':
+        # Globs are left for the node to expand, so each match is covered
+        return (f'stat -c {STAT_FORMAT} -- {arg}; stat -L -c {STAT_FORMAT} -- {arg}',)
+    if kind == 'unit':
+        return (f'systemctl show -p Id,LoadState,ActiveState,SubState,UnitFileState,'
+                f'ActiveEnterTimestamp,FragmentPath,DropInPaths -- {arg}',)
+    return STATE_PROBES[kind]
+
+
+def fingerprint(stamp, dependencies, results):
+    """Fingerprint of a task from its node state.
+
+    stamp identifies the task definition and node settings, dependencies
+    maps each host to its dependency specs and results maps (host, command)
+    to RemoteResult. Returns None if a node did not answer every probe.
+    """
+    digest = hashlib.sha256(repr(stamp).encode())
+    for host in sorted(dependencies):
+        for command in [BOOT_ID_COMMAND] + [c for spec in sorted(dependencies[host])
+                                            for c in probe_commands(spec)]:
+            result = results.get((host, command))
+            if result is None or result.returncode == 255:
+                return None
+            digest.update(f'\0{host}\0{command}\0{result.returncode}\0'.encode())
+            digest.update(result.stdout)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Last check records of each task, kept with the fingerprint they were graded at.
+
+    Keyed by task id and node settings, so labs never share results. The
+    least recently used entries go first once max_size is reached. With a
+    database the entries live in it, shared by every worker process.
+    """
+
+    def __init__(self, max_size=RESULT_CACHE_SIZE, db=None):
+        self.max_size = max_size
+        self.db = db
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (fingerprint, checks)
+
+    def get(self, key, fingerprint):
+        """Check records stored for key at this fingerprint, or None."""
+        if self.db:
+            return self._get_shared(json.dumps(key), fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != fingerprint:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, fingerprint, checks):
+        if self.db:
+            return self._put_shared(json.dumps(key), fingerprint, checks)
+        with self._lock:
+            self._entries[key] = (fingerprint, [dict(check) for check in checks])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        if self.db:
+            with self.db.transaction(write=True) as conn:
+                conn.execute('DELETE FROM task_results')
+        with self._lock:
+            self._entries.clear()
+
+    def _get_shared(self, key, fingerprint):
+        try:
+            with self.db.transaction() as conn:
+                row = conn.execute('SELECT checks FROM task_results WHERE key = ? AND fingerprint = ?',
+                                   (key, fingerprint)).fetchone()
+            if row is None:
+                return None
+            with self.db.transaction(write=True) as conn:
+                conn.execute('UPDATE task_results SET used_at = ? WHERE key = ?', (time.time(), key))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read stored task result: {e}")
+            return None
+        return json.loads(row['checks'])
+
+    def _put_shared(self, key, fingerprint, checks):
+        try:
+            with self.db.transaction(write=True) as conn:
+                conn.execute('''
+                    INSERT INTO task_results (key, fingerprint, checks, used_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET fingerprint = excluded.fingerprint,
+                        checks = excluded.checks, used_at = excluded.used_at
+                ''', (key, fingerprint, json.dumps(checks), time.time()))
+                conn.execute('''
+                    DELETE FROM task_results WHERE used_at < (
+                        SELECT used_at FROM task_results ORDER BY used_at DESC LIMIT 1 OFFSET ?)
+                ''', (self.max_size - 1,))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not store task result: {e}")
@@ -0,0 +1,833 @@
+"""
+RHCSA grading engine
+Runs task checks from inside the API process, producing the same result
+schema as `exam-grader.sh --json`
+"""
+
+import contextvars
+import logging
+import os
+import re
+import select
+import shlex
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+from facts import BOOT_ID_COMMAND
+from fingerprint import ResultCache, command_dependencies, fingerprint, parse_dependency, probe_commands
+from metrics import (CHECK_DURATION, GRADE_DURATION, GRADE_SSH_COMMANDS, GRADER_SCRIPT, INCREMENTAL_TASKS,
+                     TASK_GRADES, TASK_SECONDS, ssh_command_tally)
+from session import GradingSession
+from sshpool import SSH_CONTROL_DIR, SSH_CONTROL_PERSIST, RemoteResult
+
+logger = logging.getLogger(__name__)
+
+PASSING_THRESHOLD = 70
+
+# How often (seconds) running grading work checks for cancellation
+CANCEL_POLL_INTERVAL = 0.2
+# Exam rule violations looked for on every node once per session:
+# (name, command, detected(result), message)
+VIOLATION_CHECKS = (
+    ('selinux', 'getenforce', lambda r: b'disabled' in r.stdout.lower(), 'SELinux is disabled'),
+    ('firewalld', 'systemctl is-active firewalld', lambda r: b'inactive' in r.stdout.lower(),
+     'FirewallD is disabled'),
+    ('repos', "grep -l 'http://' /etc/yum.repos.d/* 2>/dev/null | grep -v redhat.repo",
+     lambda r: bool(r.stdout.strip()), 'External repos detected'),
+)
+
+HEADER_RE = re.compile(r'^# (Task|Category|Target|EXPECTED_IP|Depends):[ \t]?(.*)$', re.MULTILINE)
+
+# Bash runtime the task scripts are sourced into: the SSH helpers shared
+# with exam-grader.sh, plus a check() that reports each result as a
+# NUL-separated record (task, passed, points, message, microseconds the
+# condition took or empty on bash < 5) on $GRADER_RESULT_FD
+RUNTIME = r'''
+shopt -s nullglob
+source "$GRADER_BASE_DIR/lib/ssh.sh"
+
+check() {
+    local condition="$1"
+    local ok_msg="$2"
+    local points="${4:-10}"
+    local passed=false
+    # Malformed calls are dropped, as exam-grader.sh does
+    [[ "$points" =~ ^[0-9]+$ ]] || return 1
+    local start="${EPOCHREALTIME/[.,]/}"
+    eval "$condition" && passed=true
+    local end="${EPOCHREALTIME/[.,]/}"
+    printf '%s\0%s\0%s\0%s\0%s\0' "$CURRENT_TASK" "$passed" "$points" "$ok_msg" \
+        "${start:+$(( end - start ))}" >&"$GRADER_RESULT_FD"
+}
+'''
+
+
+# Collect pass: run_ssh records (task, host, command) instead of connecting
+# and succeeds with no output; check() only evaluates to trigger those calls
+COLLECT_MODE = r'''
+run_ssh() {
+    local host="$1"
+    shift
+    printf '%s\0%s\0%s\0' "$CURRENT_TASK" "$host" "$*" >&"$GRADER_RESULT_FD"
+}
+
+check() {
+    eval "$1"
+    return 0
+}
+'''
+
+# Replay pass: run_ssh answers from the batch results, live on a miss (the
+# tasks that had one are listed in $REPLAY_DIR/live)
+REPLAY_MODE = r'''
+declare -A REPLAY_INDEX=()
+declare -a REPLAY_RC=()
+__run_ssh_src=$(declare -f run_ssh)
+eval "run_ssh_live${__run_ssh_src#run_ssh}"
+
+run_ssh() {
+    local host="$1"
+    shift
+    local n="${REPLAY_INDEX["$host"$'\x1f'"$*"]}"
+    if [[ -n "$n" ]]; then
+        cat "$REPLAY_DIR/$n.out"
+        cat "$REPLAY_DIR/$n.err" >&2
+        return "${REPLAY_RC[$n]}"
+    fi
+    printf '%s\n' "$CURRENT_TASK" >>"$REPLAY_DIR/live"
+    run_ssh_live "$host" "$@"
+}
+'''
+
+
+class GradingError(Exception):
+    """Grading could not be started (bad config, unknown tasks)."""
+
+
+class GradingCancelled(Exception):
+    """Grading was cancelled while it was queued or running."""
+
+
+@dataclass
+class TaskDefinition:
+    """Metadata of a checks/task-* file.
+
+    Bash tasks are described by their header comments; declarative (JSON)
+    tasks also carry their compiled checks.
+    """
+    id: str
+    path: Path
+    description: str = ''
+    category: str = ''
+    target: str = ''  # raw "# Target:" header, empty when not declared
+    expected_ip: str = ''
+    checks: list = None  # checkdsl.CompiledCheck list for JSON tasks
+    notes: tuple = ()  # free-form header comments of JSON tasks
+    depends: tuple = None  # declared remote state (fingerprint specs); None to infer it
+
+    @property
+    def resolved_target(self):
+        """Declared target, or one inferred from the description (node1/node2/both)."""
+        if self.target:
+            return self.target
+        desc = self.description
+        if 'node2' in desc and 'node1' not in desc:
+            return 'node2'
+        if 'node1' in desc and 'node2' not in desc:
+            return 'node1'
+        if 'both' in desc or ('node1' in desc and 'node2' in desc):
+            return 'both'
+        return 'node1'
+
+    @property
+    def nodes(self):
+        """Nodes this task is expected to touch."""
+        target = self.resolved_target
+        return ('node1', 'node2') if target == 'both' else (target,)
+
+    @property
+    def target_node(self):
+        """Node whose address the smart connectivity check applies to."""
+        if self.target == 'node2' or ('node2' in self.id and 'node1' not in self.id):
+            return 'node2'
+        return 'node1'
+
+
+def parse_task_file(path):
+    """Parse a task script's header into a TaskDefinition."""
+    path = Path(path)
+    headers = {}
+    for key, value in HEADER_RE.findall(path.read_text(errors='replace')):
+        headers.setdefault(key, value.strip())
+    return TaskDefinition(
+        id=path.stem,
+        path=path,
+        description=headers.get('Task', ''),
+        category=headers.get('Category', ''),
+        target=headers.get('Target', '').replace(' ', ''),
+        expected_ip=headers.get('EXPECTED_IP', '').replace(' ', ''),
+        depends=tuple(re.findall(r'[^\s,]+', headers['Depends'])) if 'Depends' in headers else None,
+    )
+
+
+def normalize_task_id(task):
+    """Accept both "task-01" and "01" forms."""
+    task = str(task)
+    return task if task.startswith('task-') else f'task-{task}'
+
+
+def summarize(checks):
+    """Build the grader result document from a list of check records."""
+    score = sum(c['points'] for c in checks if c['passed'])
+    total = sum(c['points'] for c in checks)
+
+    categories = {}
+    for c in checks:
+        stats = categories.setdefault(c['category'], {'earned': 0, 'possible': 0})
+        stats['possible'] += c['points']
+        if c['passed']:
+            stats['earned'] += c['points']
+
+    return {
+        'timestamp': datetime.now().astimezone().isoformat(timespec='seconds'),
+        'score': score,
+        'total': total,
+        'passed': score >= total // 10 * 7,
+        'passing_threshold': PASSING_THRESHOLD,
+        'categories': dict(sorted(categories.items())),
+        'checks': checks,
+    }
+
+
+def summarize_task(task_id, task_checks):
+    """Aggregate the check records of one task into a task result."""
+    total_points = sum(c.get('points', 0) for c in task_checks if c.get('passed'))
+    max_points = sum(c.get('points', 0) for c in task_checks)
+    all_passed = all(c.get('passed', False) for c in task_checks)
+    passed_count = sum(1 for c in task_checks if c.get('passed'))
+    total_count = len(task_checks)
+
+    # Build detailed message
+    check_details = [f"{'✓' if c.get('passed') else '✗'} {c.get('check', 'Check')}"
+                     for c in task_checks]
+
+    return {
+        'task_id': task_id,
+        'passed': all_passed,
+        'points': total_points,
+        'max_points': max_points,
+        'checks_passed': passed_count,
+        'checks_total': total_count,
+        'details': check_details,
+        'message': f"{passed_count}/{total_count} checks passed",
+        # Reused from an earlier grading: nothing it depends on changed since
+        'cached': bool(task_checks) and all(c.get('cached') for c in task_checks),
+    }
+
+
+class GradingEngine:
+    """Grades tasks in-process using the definitions from a TaskCatalog."""
+
+    def __init__(self, catalog, ssh_pool, base_dir=None, batch=True, results=None):
+        self.catalog = catalog
+        self.batch = batch
+        self.base_dir = Path(base_dir) if base_dir else catalog.checks_dir.parent
+        self.ssh_pool = ssh_pool
+        # Task results for incremental grading; pass a database-backed one to share it
+        self.results = results or ResultCache()
+
+    def select(self, task_ids):
+        """Resolve task ids to definitions, in catalog order."""
+        wanted = {normalize_task_id(t) for t in task_ids}
+        return [t for t in self.catalog.tasks.values() if t.id in wanted]
+
+    def grade(self, task_ids, config, target=None, timeout=None, on_check=None, cancel=None,
+              facts=None, session=None, incremental=False):
+        """Grade the given tasks and return the grader result document.
+
+        config is the raw config mapping (NODE1_IP, ROOT_PASSWORD, ...).
+        on_check, if given, is called with each check record as soon as it
+        is produced. Setting the cancel event stops the run, local and
+        remote processes included. facts is an optional FactCache shared
+        with other grade() calls of the same run, session an optional
+        GradingSession whose address resolutions and violation findings
+        are reused. With incremental, a task whose remote state has the
+        same fingerprint as when it was last graded gets its previous check
+        records back (marked 'cached') instead of running. Raises
+        GradingError, GradingCancelled or subprocess.TimeoutExpired.
+        """
+        started = time.monotonic()
+        outcome = 'error'
+        with ssh_command_tally() as tally:
+            try:
+                result = self._grade(task_ids, config, target, timeout, on_check, cancel, facts, session,
+                                     incremental)
+                outcome = 'ok'
+                return result
+            except GradingCancelled:
+                outcome = 'cancelled'
+                raise
+            except subprocess.TimeoutExpired:
+                outcome = 'timeout'
+                raise
+            finally:
+                elapsed = time.monotonic() - started
+                GRADE_DURATION.observe(elapsed, outcome=outcome)
+                GRADE_SSH_COMMANDS.observe(tally.count)
+                if len(task_ids) == 1 and outcome == 'ok':
+                    task_id = normalize_task_id(task_ids[0])
+                    TASK_SECONDS.inc(elapsed, task=task_id)
+                    TASK_GRADES.inc(task=task_id)
+
+    def _grade(self, task_ids, config, target, timeout, on_check, cancel, facts, session, incremental):
+        nodes = self.node_settings(config, target)
+        tasks = self.select(task_ids)
+        if not tasks:
+            raise GradingError('No matching tasks found')
+        session = session or GradingSession()
+
+        violations = session.violations(
+            (nodes['NODE1_IP'], nodes['NODE2_IP']),
+            lambda: self._detect_violations(nodes, timeout, cancel, facts))
+
+        checks = []
+        runnable = []
+        for task in tasks:
+            address, failure = self._resolve_address(task, nodes, session)
+            if address and facts is not None:
+                # The node moved to a new address: nothing known about it holds
+                facts.invalidate(nodes[f'{task.target_node.upper()}_IP'])
+                facts.invalidate(address)
+            if failure:
+                checks.append(failure)
+                if on_check:
+                    on_check(failure)
+            else:
+                runnable.append((task, address))
+
+        deadline = time.monotonic() + timeout if timeout else None
+        fingerprints, calls = {}, None
+        if incremental:
+            fingerprints, calls = self._fingerprints(runnable, nodes, _remaining(deadline), cancel, facts)
+            runnable = self._reuse_results(runnable, nodes, fingerprints, checks, on_check)
+
+        declarative = [(task, address) for task, address in runnable if task.checks is not None]
+        scripted = [(task, address) for task, address in runnable if task.checks is None]
+        graded = []
+        live = set()
+        if declarative:
+            graded.extend(self._run_declarative(declarative, nodes, _remaining(deadline), on_check, cancel,
+                                                facts))
+        if scripted:
+            graded.extend(self._run_tasks(scripted, nodes, _remaining(deadline), on_check, cancel, facts,
+                                          calls, live))
+        checks.extend(graded)
+        if fingerprints:
+            self._store_results(runnable, nodes, fingerprints, graded, live)
+
+        # Report checks in task order, as the bash grader does
+        order = {task.id: i for i, task in enumerate(tasks)}
+        checks.sort(key=lambda c: order.get(c['task'], len(order)))
+        return {**summarize(checks), 'session': session.id, 'violations': violations}
+
+    def node_settings(self, config, target=None):
+        """Node names/addresses for this run, with the target override applied."""
+        if not config:
+            raise GradingError('Config file not found. Run: cp config.example config && vim config')
+        nodes = {
+            'NODE1': config.get('NODE1') or 'rhcsa1',
+            'NODE1_IP': config.get('NODE1_IP', ''),
+            'NODE2': config.get('NODE2') or 'rhcsa2',
+            'NODE2_IP': config.get('NODE2_IP', ''),
+            'ROOT_PASSWORD': config.get('ROOT_PASSWORD', ''),
+        }
+        if not nodes['NODE1_IP']:
+            raise GradingError('NODE1_IP not set in config')
+        if not nodes['NODE2_IP']:
+            raise GradingError('NODE2_IP not set in config')
+
+        if target == 'node1':
+            nodes['NODE2_IP'], nodes['NODE2'] = nodes['NODE1_IP'], nodes['NODE1']
+        elif target == 'node2':
+            nodes['NODE1_IP'], nodes['NODE1'] = nodes['NODE2_IP'], nodes['NODE2']
+        return nodes
+
+    def _resolve_address(self, task, nodes, session):
+        """Smart connectivity check for tasks that change a node's IP.
+
+        The probes run once per session and address pair. Returns (address
+        override or None, failure record or None).
+        """
+        if not task.expected_ip:
+            return None, None
+
+        password = nodes['ROOT_PASSWORD']
+        original_ip = nodes[f'{task.target_node.upper()}_IP']
+
+        def probe():
+            # Expected IP is active: grade against it
+            if self.ssh_pool.probe(task.expected_ip, password):
+                logger.debug(f"{task.id}: detected new IP {task.expected_ip}")
+                return task.expected_ip
+            # Host only answers on its original IP: let the checks run there and fail
+            if self.ssh_pool.probe(original_ip, password):
+                return original_ip
+            return None
+
+        address = session.address(task.expected_ip, original_ip, probe)
+        if address == task.expected_ip:
+            return address, None
+        if address == original_ip:
+            return None, None
+        # Neither answers: cannot grade this task
+        return None, {
+            'task': task.id,
+            'category': task.category,
+            'check': 'Connectivity Check',
+            'passed': False,
+            'points': 0,
+            'message': f'Critical: Connection lost to both {task.expected_ip} and {original_ip}',
+        }
+
+    def _fingerprints(self, runnable, nodes, timeout, cancel=None, facts=None):
+        """Fingerprint the remote state of each task, one SSH session per node.
+
+        Returns ({task id: fingerprint}, run_ssh calls collected from the
+        scripted tasks or None). Tasks whose dependencies cannot be worked
+        out get no fingerprint and are graded as usual.
+        """
+        scripted = [(task, address) for task, address in runnable if task.checks is None]
+        calls = self._collect(scripted, nodes, timeout, cancel) if scripted and self.batch else None
+
+        dependencies = {}
+        for task, address in runnable:
+            found = self._task_dependencies(task, address, nodes, calls)
+            if found is not None:
+                dependencies[task.id] = (task, address, found)
+        probes = [(host, command) for _, _, found in dependencies.values() for host, specs in found.items()
+                  for command in [BOOT_ID_COMMAND, *(c for spec in specs for c in probe_commands(spec))]]
+        results = self._run_batches(probes, nodes['ROOT_PASSWORD'], timeout, cancel, facts)
+
+        fingerprints = {}
+        for task_id, (task, address, found) in dependencies.items():
+            stamp = self._task_stamp(task, address, nodes)
+            value = fingerprint(stamp, found, results) if stamp else None
+            if value:
+                fingerprints[task_id] = value
+        return fingerprints, calls
+
+    def _task_dependencies(self, task, address, nodes, calls):
+        """{host: dependency specs} of a task, or None if they are not known.
+
+        Declared dependencies are used as given; otherwise they are inferred
+        from the task's remote commands.
+        """
+        hosts = {node: address if address and node == task.target_node else nodes[f'{node.upper()}_IP']
+                 for node in ('node1', 'node2')}
+        found = {hosts[node]: set() for node in task.nodes}
+        if task.depends is not None:
+            try:
+                specs = {parse_dependency(spec) for spec in task.depends}
+            except ValueError as e:
+                logger.warning(f"{task.id}: {e}")
+                return None
+            for node in task.nodes:
+                found[hosts[node]] |= specs
+            return found
+
+        if task.checks is not None:
+            commands = [(hosts[check.node], check.command) for check in task.checks]
+        elif calls is not None:
+            commands = [(host, command) for task_id, host, command in calls if task_id == task.id]
+        else:
+            return None
+        for host, command in commands:
+            specs = command_dependencies(command)
+            if specs is None:
+                return None
+            found.setdefault(host, set()).update(specs)
+        return found
+
+    @staticmethod
+    def _task_stamp(task, address, nodes):
+        """What besides node state a task's result depends on: its definition and node names."""
+        try:
+            st = task.path.stat()
+        except OSError:
+            return None
+        return (task.id, st.st_mtime_ns, st.st_size, nodes['NODE1'], nodes['NODE2'], address)
+
+    @staticmethod
+    def _result_key(task, nodes):
+        return task.id, nodes['NODE1_IP'], nodes['NODE2_IP']
+
+    def _reuse_results(self, runnable, nodes, fingerprints, checks, on_check=None):
+        """Add the stored checks of tasks whose fingerprint is unchanged; returns the rest."""
+        remaining = []
+        for task, address in runnable:
+            value = fingerprints.get(task.id)
+            stored = self.results.get(self._result_key(task, nodes), value) if value else None
+            if stored is None:
+                INCREMENTAL_TASKS.inc(outcome='miss' if value else 'uncacheable')
+                remaining.append((task, address))
+                continue
+            INCREMENTAL_TASKS.inc(outcome='hit')
+            for check in stored:
+                record = {**check, 'cached': True}
+                checks.append(record)
+                if on_check:
+                    on_check(record)
+        if len(remaining) < len(runnable):
+            logger.debug(f"Reused {len(runnable) - len(remaining)}/{len(runnable)} task results")
+        return remaining
+
+    def _store_results(self, runnable, nodes, fingerprints, checks, live=()):
+        """Keep the new checks of each fingerprinted task for the next incremental run.
+
+        Tasks that sent commands the fingerprint did not cover are not kept.
+        """
+        by_task = {}
+        for check in checks:
+            by_task.setdefault(check['task'], []).append(check)
+        for task, _ in runnable:
+            if task.id in fingerprints and task.id not in live and by_task.get(task.id):
+                self.results.put(self._result_key(task, nodes), fingerprints[task.id], by_task[task.id])
+
+    def _detect_violations(self, nodes, timeout, cancel=None, facts=None):
+        """Exam rule violations on the nodes, as {'node', 'violation', 'message'} records."""
+        hosts = {}
+        for node in ('node1', 'node2'):
+            hosts.setdefault(nodes[f'{node.upper()}_IP'], node)
+        calls = [(host, command) for host in hosts for _, command, _, _ in VIOLATION_CHECKS]
+        results = self._run_batches(calls, nodes['ROOT_PASSWORD'], timeout, cancel, facts)
+        violations = []
+        for host, node in hosts.items():
+            for name, command, detected, message in VIOLATION_CHECKS:
+                result = results.get((host, command))
+                if result is not None and result.returncode != 255 and detected(result):
+                    violations.append({'node': node, 'violation': name, 'message': message})
+        if violations:
+            found = '; '.join(f"{v['node']}: {v['message']}" for v in violations)
+            logger.warning(f"Violations found: {found}")
+        return violations
+
+    def _driver_script(self, runnable, nodes, mode_setup=''):
+        """Bash script that sources each task with its node settings."""
+        lines = [RUNTIME, mode_setup]
+        lines += [f'{key}={shlex.quote(value)}' for key, value in nodes.items()]
+        for task, address in runnable:
+            lines.append(f'CURRENT_TASK={shlex.quote(task.id)}')
+            lines.append(f'CURRENT_CATEGORY={shlex.quote(task.category)}')
+            node_var = f'{task.target_node.upper()}_IP'
+            if address:
+                lines.append(f'{node_var}={shlex.quote(address)}')
+            lines.append(f'source {shlex.quote(str(task.path))}')
+            if address:
+                lines.append(f'{node_var}={shlex.quote(nodes[node_var])}')
+        return '\n'.join(lines) + '\n'
+
+    def _collect(self, runnable, nodes, timeout, cancel=None):
+        """Run the collect pass: every (task, host, command) run_ssh call of the tasks."""
+        script = self._driver_script(runnable, nodes, COLLECT_MODE)
+        return self._run_script(script, 3, timeout, cancel=cancel, stage='collect')
+
+    def _run_tasks(self, runnable, nodes, timeout, on_check=None, cancel=None, facts=None, calls=None,
+                   live=None):
+        """Run the task scripts and collect check records.
+
+        In batch mode this is three steps: a collect pass records every
+        run_ssh call without executing it (calls, if given, is that pass
+        already done for these tasks or more), each node then runs all of
+        its commands in one SSH session, and a replay pass evaluates the
+        checks against those results. Commands only discovered during
+        replay (e.g. built from another command's output) still run live;
+        the ids of the tasks that sent one are added to the live set.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        categories = {task.id: task.category for task, _ in runnable}
+
+        with tempfile.TemporaryDirectory(prefix='rhcsa-grade-') as replay_dir:
+            mode_setup = ''
+            if self.batch:
+                if calls is None:
+                    calls = self._collect(runnable, nodes, _remaining(deadline), cancel)
+                results = self._run_batches([(host, command) for task_id, host, command in calls
+                                             if task_id in categories],
+                                            nodes['ROOT_PASSWORD'], _remaining(deadline), cancel, facts)
+                mode_setup = _replay_setup(results, replay_dir)
+
+            checks = []
+
+            def add_check(record):
+                task_id, passed, points, message, elapsed = record
+                if elapsed:
+                    CHECK_DURATION.observe(int(elapsed) / 1e6)
+                check = {
+                    'task': task_id,
+                    'category': categories.get(task_id, ''),
+                    'check': message,
+                    'passed': passed == 'true',
+                    'points': int(points),
+                }
+                checks.append(check)
+                if on_check:
+                    on_check(check)
+
+            script = self._driver_script(runnable, nodes, mode_setup)
+            self._run_script(script, 5, _remaining(deadline), on_record=add_check, cancel=cancel,
+                             stage='replay' if self.batch else 'live')
+            live_log = Path(replay_dir, 'live')
+            if live is not None and live_log.exists():
+                live.update(live_log.read_text().split())
+        return checks
+
+    def _run_declarative(self, runnable, nodes, timeout, on_check=None, cancel=None, facts=None):
+        """Grade JSON tasks: run their merged probes and evaluate them here.
+
+        Identical probes (e.g. one stat for a directory, owner and mode
+        check) are sent once, through the same batches and fact cache as
+        bash tasks.
+        """
+        probes = []
+        for task, address in runnable:
+            for check in task.checks:
+                host = nodes[f'{check.node.upper()}_IP']
+                if address and check.node == task.target_node:
+                    host = address
+                probes.append((task, check, host))
+
+        results = self._run_batches([(host, check.command) for _, check, host in probes],
+                                    nodes['ROOT_PASSWORD'], timeout, cancel, facts)
+        checks = []
+        for task, check, host in probes:
+            result = results.get((host, check.command))
+            if result is None:
+                logger.warning(f"{task.id}: no result for {check.command!r} on {host}")
+                result = RemoteResult(255)
+            record = {
+                'task': task.id,
+                'category': task.category,
+                'check': check.message,
+                'passed': check.passed(result),
+                'points': check.points,
+            }
+            checks.append(record)
+            if on_check:
+                on_check(record)
+        return checks
+
+    def _run_batches(self, calls, password, timeout, cancel=None, facts=None):
+        """Run the collected (host, command) calls, one SSH session per host.
+
+        Returns {(host, command): RemoteResult}. On cancellation the remote
+        batches are killed, which also ends their SSH sessions.
+        """
+        by_host = {}
+        for host, command in calls:
+            commands = by_host.setdefault(host, [])
+            if command not in commands:
+                commands.append(command)
+        if not by_host:
+            return {}
+
+        results = {}
+        tag = f'rhcsa-batch-{uuid.uuid4().hex[:12]}'
+        with ThreadPoolExecutor(max_workers=len(by_host)) as executor:
+            # In a copy of this context, so the commands count towards this grade's tally
+            futures = {executor.submit(contextvars.copy_context().run, self._run_host_batch, host, commands,
+                                       password, timeout, tag, facts): host
+                       for host, commands in by_host.items()}
+            running = set(futures)
+            while running:
+                _, running = wait(running, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                if running and cancel is not None and cancel.is_set():
+                    for future in running:
+                        self.ssh_pool.cancel_batch(futures[future], tag, password)
+                    wait(running)
+                    raise GradingCancelled()
+            for future in futures:
+                host = futures[future]
+                try:
+                    batch = future.result()
+                except subprocess.TimeoutExpired:
+                    logger.warning(f"Batch on {host} timed out, falling back to live commands")
+                    continue
+                for command, result in zip(by_host[host], batch):
+                    if result is not None:
+                        results[(host, command)] = result
+        logger.debug(f"Batched {len(results)}/{len(calls)} remote calls over {len(by_host)} sessions")
+        return results
+
+    def _run_host_batch(self, host, commands, password, timeout, tag, facts=None):
+        """Results for one host's commands, from the fact cache where possible."""
+        if facts is None:
+            return self.ssh_pool.run_batch(host, commands, password, timeout, tag)
+
+        results = [facts.lookup(host, command) for command in commands]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending and facts.recently_verified(host):
+            logger.debug(f"{host}: all {len(commands)} commands from fact cache")
+            return results
+
+        # Every batch re-reads the boot id: results from before a reboot
+        # must not be reused
+        plan = facts.plan(host, [commands[i] for i in pending])
+        batch = self.ssh_pool.run_batch(host, [BOOT_ID_COMMAND] + plan, password, timeout, tag)
+        if not facts.check_boot(host, batch[0]):
+            return self._run_host_batch(host, commands, password, timeout, tag, facts)
+        sent = dict(zip(plan, batch[1:]))
+        for command, result in sent.items():
+            facts.store(host, command, result)
+
+        missing = []
+        for i in pending:
+            results[i] = facts.lookup(host, commands[i]) or sent.get(commands[i])
+            if results[i] is None:
+                missing.append(i)
+        # Facts this node cannot provide (e.g. no firewalld): ask directly,
+        # unless the node was not reachable at all
+        reachable = batch[0] is not None and batch[0].returncode != 255
+        if missing and reachable:
+            retry = self.ssh_pool.run_batch(host, [commands[i] for i in missing], password, timeout, tag)
+            for i, result in zip(missing, retry):
+                results[i] = result
+                facts.store(host, commands[i], result)
+        elif missing:
+            for i in missing:
+                results[i] = batch[0]
+        logger.debug(f"{host}: {len(commands) - len(pending)}/{len(commands)} commands from fact cache")
+        return results
+
+    def _run_script(self, script, nfields, timeout, on_record=None, cancel=None, stage='live'):
+        """Run a driver script in one bash process and return its records.
+
+        on_record is called from a reader thread as each record arrives.
+        stage names the pass (collect, replay or live) for the metrics.
+        """
+        if cancel is not None and cancel.is_set():
+            raise GradingCancelled()
+        with GRADER_SCRIPT.time(stage=stage):
+            return self._run_driver(script, nfields, timeout, on_record, cancel)
+
+    def _run_driver(self, script, nfields, timeout, on_record, cancel):
+        read_fd, write_fd = os.pipe()
+        env = {
+            **os.environ,
+            'GRADER_BASE_DIR': str(self.base_dir),
+            'GRADER_RESULT_FD': str(write_fd),
+            'SSH_CONTROL_DIR': str(SSH_CONTROL_DIR),
+            'SSH_CONTROL_PERSIST': str(SSH_CONTROL_PERSIST),
+        }
+        try:
+            proc = subprocess.Popen(
+                ['bash', '-c', script],
+                cwd=str(self.base_dir),
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                pass_fds=(write_fd,),
+                start_new_session=True,
+            )
+        finally:
+            os.close(write_fd)
+
+        records = []
+
+        def collect(record):
+            records.append(record)
+            if on_record:
+                on_record(record)
+
+        reader = threading.Thread(target=_read_records, args=(read_fd, proc, nfields, collect),
+                                  daemon=True)
+        reader.start()
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            while True:
+                wait_for = CANCEL_POLL_INTERVAL if cancel is not None else None
+                if deadline is not None:
+                    left = max(deadline - time.monotonic(), 0)
+                    wait_for = left if wait_for is None else min(wait_for, left)
+                try:
+                    _, stderr = proc.communicate(timeout=wait_for)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel is not None and cancel.is_set():
+                        _kill_group(proc)
+                        proc.communicate()
+                        raise GradingCancelled()
+                    if deadline is not None and time.monotonic() >= deadline:
+                        _kill_group(proc)
+                        proc.communicate()
+                        raise subprocess.TimeoutExpired(proc.args, timeout)
+        finally:
+            reader.join()
+
+        if stderr:
+            logger.debug(f"Task script stderr: {stderr[-500:].decode(errors='replace')}")
+        return records
+
+
+def _remaining(deadline):
+    """Seconds left until deadline (None for no limit)."""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise subprocess.TimeoutExpired('grader', 0)
+    return remaining
+
+
+def _replay_setup(results, replay_dir):
+    """Bash snippet loading batch results for the replay pass.
+
+    Output is stored in files so it is replayed byte for byte.
+    """
+    lines = [REPLAY_MODE, f'REPLAY_DIR={shlex.quote(replay_dir)}']
+    for n, ((host, command), result) in enumerate(results.items()):
+        Path(replay_dir, f'{n}.out').write_bytes(result.stdout)
+        Path(replay_dir, f'{n}.err').write_bytes(result.stderr)
+        key = shlex.quote(f'{host}\x1f{command}')
+        lines.append(f'REPLAY_INDEX[{key}]={n}; REPLAY_RC[{n}]={result.returncode}')
+    return '\n'.join(lines)
+
+
+def _read_records(fd, proc, nfields, on_record):
+    """Split the NUL-separated result stream into records of nfields.
+
+    Reads until the grading process has exited and the pipe is drained; EOF
+    alone is not enough since a persisted SSH master may inherit the fd.
+    """
+    pending = []
+    partial = b''
+    with os.fdopen(fd, 'rb', buffering=0) as stream:
+        while True:
+            ready, _, _ = select.select([stream], [], [], 0.2)
+            if ready:
+                chunk = stream.read(65536)
+                if not chunk:
+                    break
+                *fields, partial = (partial + chunk).split(b'\0')
+                pending.extend(f.decode(errors='replace') for f in fields)
+                while len(pending) >= nfields:
+                    on_record(tuple(pending[:nfields]))
+                    del pending[:nfields]
+            elif proc.poll() is not None:
+                break
+
+
+def _kill_group(proc):
+    """Kill a grading process and everything it spawned (ssh, sshpass)."""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
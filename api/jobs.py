@@ -0,0 +1,265 @@
+"""
+Grading jobs
+Background grading runs that clients poll for progress and can cancel
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from grader import summarize
+from labs import DEFAULT_LAB
+from scheduler import task_result
+from session import GradingSession
+from shared import SharedRecords
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs are kept this long (seconds) for clients to fetch results
+JOB_RETENTION = 3600
+# How often (seconds) a running job looks for a cancellation requested through another worker
+CANCEL_CHECK_INTERVAL = 1.0
+
+JOB_FINISHED = ('completed', 'cancelled')
+
+
+class CancelFlag:
+    """A job's cancel event (an Event look-alike for the grading engine).
+
+    Besides set(), cancellation can be requested from another worker
+    process through the shared records; is_set() looks for that at most
+    every CANCEL_CHECK_INTERVAL seconds and then calls on_request.
+    """
+
+    def __init__(self, requested=None, on_request=None):
+        self._event = threading.Event()
+        self._requested = requested
+        self._on_request = on_request
+        self._checked = 0.0
+
+    def set(self):
+        self._event.set()
+
+    def seen(self):
+        """Set, as far as this process knows (no shared records lookup)."""
+        return self._event.is_set()
+
+    def is_set(self):
+        if self._event.is_set() or self._requested is None:
+            return self._event.is_set()
+        now = time.monotonic()
+        if now - self._checked < CANCEL_CHECK_INTERVAL:
+            return False
+        self._checked = now
+        try:
+            requested = self._requested()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not check for a cancellation request: {e}")
+            return False
+        if requested:
+            self._event.set()
+            if self._on_request:
+                self._on_request()
+        return requested
+
+
+class GradingJob:
+    """One grading run: per-task units on the scheduler plus their progress."""
+
+    def __init__(self, task_ids, target=None, timeout=None, session=None, lab=None, records=None):
+        self.id = uuid.uuid4().hex
+        self.lab = lab
+        self.records = records
+        self.session = session or GradingSession()
+        self.task_ids = list(task_ids)
+        self.target = target
+        self.timeout = timeout
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.cancel_event = CancelFlag(
+            (lambda: records.cancel_requested(self.id)) if records else None, self.cancel)
+        self.checks = []
+        self.task_results = []
+        self.result = None
+        self._status = 'queued'
+        self._futures = []
+        self._finished = 0
+        self._finished_mono = None
+        self._revision = 0
+        self._lock = threading.Lock()
+
+    def start(self, submitted):
+        """Track the (task_id, future) units the scheduler queued for this job."""
+        self._futures = [future for _, future in submitted]
+        self.save()
+        for task_id, future in submitted:
+            future.add_done_callback(lambda f, task_id=task_id: self._task_done(task_id, f))
+
+    def save(self):
+        """Publish the job's state to the other worker processes."""
+        if self.records is None:
+            return
+        with self._lock:
+            self._revision += 1
+            revision = self._revision
+            snapshot = self._snapshot()
+        try:
+            self.records.save(self.id, revision, snapshot, snapshot['status'] in JOB_FINISHED)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not save grading job {self.id}: {e}")
+
+    def add_check(self, check):
+        with self._lock:
+            self.checks.append(check)
+
+    def _task_done(self, task_id, future):
+        _, record = task_result(task_id, future, self.timeout)
+        with self._lock:
+            self.task_results.append(record)
+            self._finished += 1
+            done = self._finished == len(self._futures)
+        if not done:
+            self.save()
+            return
+        with self._lock:
+            if self.cancel_event.seen():
+                self._status = 'cancelled'
+            else:
+                order = {task_id: i for i, task_id in enumerate(self.task_ids)}
+                checks = sorted(self.checks, key=lambda c: order.get(c['task'], len(order)))
+                self.result = {**summarize(checks), 'session': self.session.id,
+                               'violations': self.session.known_violations()}
+                self._status = 'completed'
+            self.finished_at = datetime.now().isoformat()
+            self._finished_mono = time.monotonic()
+        self.save()
+        logger.info(f"Grading job {self.id} {self._status}")
+
+    def cancel(self):
+        """Stop the job: drop queued tasks and kill the running ones."""
+        self.cancel_event.set()
+        for future in self._futures:
+            future.cancel()
+        self.save()
+
+    @property
+    def status(self):
+        if self._status == 'queued' and any(f.running() or f.done() for f in self._futures):
+            return 'running'
+        return self._status
+
+    @property
+    def finished(self):
+        return self._status in JOB_FINISHED
+
+    def expired(self, cutoff):
+        """Finished before the monotonic time cutoff."""
+        return self._finished_mono is not None and self._finished_mono < cutoff
+
+    def to_dict(self, since=0):
+        """Job state for clients; checks are returned from offset `since` on."""
+        with self._lock:
+            return self._snapshot(since)
+
+    def _snapshot(self, since=0):
+        status = self.status
+        if status == 'running' and self.cancel_event.seen():
+            status = 'cancelling'
+        return {
+            'job_id': self.id,
+            'status': status,
+            'target': self.target,
+            'lab': self.lab or DEFAULT_LAB,
+            'session': self.session.id,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'tasks_total': len(self._futures),
+            'tasks_done': self._finished,
+            'tasks': list(self.task_results),
+            'checks': self.checks[since:],
+            'next': len(self.checks),
+            'result': self.result,
+        }
+
+
+class SharedJob:
+    """A job run by another worker process, as last published by it."""
+
+    def __init__(self, snapshot, orphaned=False):
+        self.snapshot = snapshot
+        if orphaned:
+            # Its worker exited (restart, crash): the job will never finish
+            self.snapshot = {**snapshot, 'status': 'cancelled', 'error': 'Grading worker exited'}
+        self.id = snapshot['job_id']
+
+    @property
+    def finished(self):
+        return self.snapshot['status'] in JOB_FINISHED
+
+    def to_dict(self, since=0):
+        return {**self.snapshot, 'checks': self.snapshot['checks'][since:]}
+
+
+class JobManager:
+    """Registry of grading jobs running on a GradingScheduler.
+
+    With a database, jobs are also published there, so any worker process
+    can report on (and cancel) a job another worker is running.
+    """
+
+    def __init__(self, scheduler, retention=JOB_RETENTION, db=None):
+        self.scheduler = scheduler
+        self.retention = retention
+        self.records = SharedRecords(db, 'job') if db else None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, task_ids, config, target=None, timeout=None, session=None, lab=None,
+               incremental=False):
+        """Queue a grading job for lab (None for the config file).
+
+        Raises GradingError for bad config or tasks.
+        """
+        job = GradingJob(task_ids, target, timeout, session, lab, self.records)
+        submitted = self.scheduler.submit_each(task_ids, config, target, timeout,
+                                               on_check=job.add_check, cancel=job.cancel_event,
+                                               session=job.session, lab=lab, incremental=incremental)
+        job.task_ids = [task_id for task_id, _ in submitted]
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        job.start(submitted)
+        logger.info(f"Grading job {job.id} queued: {len(submitted)} tasks")
+        return job
+
+    def get(self, job_id):
+        """The job (a SharedJob if another worker runs it), or None."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.records:
+            found = self.records.load(job_id)
+            if found:
+                job = SharedJob(*found)
+        return job
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job and not job.finished:
+            logger.info(f"Cancelling grading job {job_id}")
+            if isinstance(job, SharedJob):
+                self.records.request_cancel(job_id)
+                job = SharedJob({**job.snapshot, 'status': 'cancelling'})
+            else:
+                job.cancel()
+        return job
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items() if job.expired(cutoff)]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if self.records:
+            self.records.prune(self.retention)
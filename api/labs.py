@@ -0,0 +1,128 @@
+"""
+Lab environments
+Node pairs with their own addresses and credentials, kept in the results database
+"""
+
+import logging
+import re
+import threading
+from datetime import datetime
+from types import MappingProxyType
+
+from settings import LabConfig
+
+logger = logging.getLogger(__name__)
+
+# The lab of the config file; results of it are stored without a lab id
+DEFAULT_LAB = 'default'
+
+LAB_ID_RE = re.compile(r'^[a-z0-9][a-z0-9_-]{0,62}$')
+
+# Lab columns and the config file keys they stand for
+LAB_COLUMNS = {
+    'node1': 'NODE1',
+    'node1_ip': 'NODE1_IP',
+    'node2': 'NODE2',
+    'node2_ip': 'NODE2_IP',
+    'root_password': 'ROOT_PASSWORD',
+}
+
+
+class LabStore:
+    """Labs in the database, each served as a LabConfig like the config file.
+
+    A lab's LabConfig is built once and kept until the lab changes, so
+    grading many labs does not read the database on every request.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._configs = {}
+        self._changes = 0  # bumped on every write, so a read racing one is not cached
+
+    @staticmethod
+    def _config(row):
+        return LabConfig(MappingProxyType({key: row[column] for column, key in LAB_COLUMNS.items()}),
+                         exists=True)
+
+    def get(self, lab_id):
+        """LabConfig of lab_id, or None if there is no such lab."""
+        with self._lock:
+            config = self._configs.get(lab_id)
+            changes = self._changes
+        if config is not None:
+            return config
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT * FROM labs WHERE id = ?', (lab_id,)).fetchone()
+        if row is None:
+            return None
+        config = self._config(row)
+        with self._lock:
+            if changes == self._changes:
+                self._configs[lab_id] = config
+        return config
+
+    def list(self):
+        """Every lab as served to clients (without passwords), by id."""
+        with self.db.transaction() as conn:
+            rows = conn.execute('SELECT * FROM labs ORDER BY id').fetchall()
+        return [self._public(row) for row in rows]
+
+    def describe(self, lab_id):
+        """One lab as served to clients, or None."""
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT * FROM labs WHERE id = ?', (lab_id,)).fetchone()
+        return self._public(row) if row else None
+
+    def _public(self, row):
+        return {'id': row['id'], 'name': row['name'], **self._config(row).public(),
+                'created_at': row['created_at'], 'updated_at': row['updated_at']}
+
+    def create(self, lab_id, name, values):
+        """Add a lab; values maps LAB_COLUMNS keys to settings.
+
+        Returns False if the id is taken.
+        """
+        now = datetime.now().isoformat()
+        row = {column: values.get(column, '') for column in LAB_COLUMNS}
+        with self.db.transaction(write=True) as conn:
+            if conn.execute('SELECT 1 FROM labs WHERE id = ?', (lab_id,)).fetchone():
+                return False
+            conn.execute(f'''
+                INSERT INTO labs (id, name, {', '.join(row)}, created_at, updated_at)
+                VALUES (?, ?, {', '.join('?' * len(row))}, ?, ?)
+            ''', (lab_id, name or lab_id, *row.values(), now, now))
+        logger.info(f"Lab {lab_id} created")
+        return True
+
+    def update(self, lab_id, values, name=None):
+        """Change some settings of a lab; returns its new LabConfig or None if unknown."""
+        changes = {column: value for column, value in values.items() if column in LAB_COLUMNS}
+        if name:
+            changes['name'] = name
+        with self.db.transaction(write=True) as conn:
+            if changes:
+                assignments = ', '.join(f'{column} = ?' for column in changes)
+                conn.execute(f'UPDATE labs SET {assignments}, updated_at = ? WHERE id = ?',
+                             (*changes.values(), datetime.now().isoformat(), lab_id))
+            row = conn.execute('SELECT * FROM labs WHERE id = ?', (lab_id,)).fetchone()
+        self._forget(lab_id)
+        if row is None:
+            return None
+        logger.info(f"Lab {lab_id} updated: {', '.join(sorted(changes))}")
+        return self._config(row)
+
+    def delete(self, lab_id):
+        """Remove a lab (its stored results stay); returns False if unknown."""
+        with self.db.transaction(write=True) as conn:
+            deleted = conn.execute('DELETE FROM labs WHERE id = ?', (lab_id,)).rowcount
+        self._forget(lab_id)
+        if deleted:
+            logger.info(f"Lab {lab_id} deleted")
+        return bool(deleted)
+
+    def _forget(self, lab_id):
+        with self._lock:
+            self._changes += 1
+            self._configs.pop(lab_id, None)
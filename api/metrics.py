@@ -0,0 +1,358 @@
+"""
+Metrics
+Counters and histograms served by /metrics in the Prometheus text format,
+summed over the worker processes when they share a metrics directory
+"""
+
+import atexit
+import contextvars
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Directory the worker processes of a multi-process deployment share their
+# samples through (set by gunicorn.conf.py); unset, /metrics covers this process
+MULTIPROCESS_DIR = os.environ.get('RHCSA_METRICS_DIR')
+# How often (seconds) a worker writes its samples there; /metrics also writes its own first
+FLUSH_INTERVAL = 5
+# Samples of exited workers, folded together (see _fold)
+ACCUMULATED = 'accumulated.json'
+
+# This process's name in MULTIPROCESS_DIR (pids get reused) and its held lock file
+_process = {'pid': None, 'id': None, 'lock': None}
+
+# Seconds; covers a cached check (milliseconds) up to a full exam (minutes)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """One metric family; samples are keyed by the values of its labels."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def values(self):
+        """{label values tuple: value} of this process."""
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(a, b):
+        """One value from the values two processes have for the same labels."""
+        return a + b
+
+    def samples(self, values):
+        """(suffix, label values, extra labels, value) for every sample of values."""
+        raise NotImplementedError
+
+    def render(self, values=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, values, extra, value in self.samples(self.values() if values is None else values):
+            lines.append(f'{self.name}{suffix}{_labels(self.labelnames, values, extra)} {_number(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self, values):
+        return [('', key, (), value) for key, value in sorted(values.items())]
+
+
+class Gauge(Metric):
+    """A value read when the metrics are rendered: collect() returns
+    {label values tuple: value}."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def values(self):
+        return {tuple(str(v) for v in key): value for key, value in self.collect().items()}
+
+    def samples(self, values):
+        return [('', key, (), value) for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, count, total = self._values.get(key, ((0,) * len(self.buckets), 0, 0))
+            counts = tuple(n + (value <= bound) for n, bound in zip(counts, self.buckets))
+            self._values[key] = (counts, count + 1, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the with block."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    @staticmethod
+    def merge(a, b):
+        return tuple(x + y for x, y in zip(a[0], b[0])), a[1] + b[1], a[2] + b[2]
+
+    def samples(self, values):
+        samples = []
+        for key, (counts, count, total) in sorted(values.items()):
+            # Buckets are stored cumulative: each counts the values <= its bound
+            for bound, n in zip(self.buckets, counts):
+                samples.append(('_bucket', key, (('le', _number(bound)),), n))
+            samples.append(('_bucket', key, (('le', '+Inf'),), count))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), count))
+        return samples
+
+
+class _Tally:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        with self._lock:
+            self.count += n
+
+
+# Remote commands of the grading unit running in this context (see ssh_command_tally)
+_ssh_tally = contextvars.ContextVar('ssh_tally', default=None)
+
+
+@contextmanager
+def ssh_command_tally():
+    """Count the remote commands sent while the with block runs.
+
+    Threads started for it only add to the tally if they run in a copy of
+    this context (contextvars.copy_context().run).
+    """
+    tally = _Tally()
+    token = _ssh_tally.set(tally)
+    try:
+        yield tally
+    finally:
+        _ssh_tally.reset(token)
+
+
+def count_ssh_commands(n, kind):
+    SSH_COMMANDS.inc(n, kind=kind)
+    tally = _ssh_tally.get()
+    if tally is not None:
+        tally.add(n)
+
+
+def _process_id():
+    """Name of this process's files in MULTIPROCESS_DIR.
+
+    The process holds an exclusive flock on <id>.lock for as long as it
+    runs, which is how the others tell that it has exited.
+    """
+    if _process['pid'] != os.getpid():
+        process_id = f'{os.getpid()}-{uuid.uuid4().hex}'
+        fd = os.open(Path(MULTIPROCESS_DIR) / f'{process_id}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        _process.update(pid=os.getpid(), id=process_id, lock=fd)
+    return _process['id']
+
+
+def _exited(process_id):
+    """Has the process that wrote <process_id>.json exited?"""
+    try:
+        fd = os.open(Path(MULTIPROCESS_DIR) / f'{process_id}.lock', os.O_RDWR)
+    except FileNotFoundError:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+
+def _write_json(path, value):
+    tmp = path.with_name(f'.{path.name}.tmp')
+    tmp.write_text(json.dumps(value))
+    os.replace(tmp, path)
+
+
+def _flush():
+    """Write this process's samples to MULTIPROCESS_DIR/<process id>.json."""
+    snapshot = {metric.name: [[list(key), value] for key, value in metric.values().items()]
+                for metric in REGISTRY}
+    _write_json(Path(MULTIPROCESS_DIR) / f'{_process_id()}.json', snapshot)
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            _flush()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not write metrics to {MULTIPROCESS_DIR}: {e}")
+
+
+def _add(merged, snapshot, gauges=True):
+    """Add the samples of one snapshot ({name: [[key, value], ...]}) to merged."""
+    metrics = {metric.name: metric for metric in REGISTRY}
+    for name, items in snapshot.items():
+        metric = metrics.get(name)
+        if metric is None or (metric.kind == 'gauge' and not gauges):
+            continue
+        values = merged.setdefault(name, {})
+        for key, value in items:
+            key = tuple(key)
+            values[key] = metric.merge(values[key], value) if key in values else value
+
+
+def _fold(directory):
+    """Move the counters and histograms of exited processes into ACCUMULATED.
+
+    Returns its samples. Folded process ids are recorded in the same write,
+    so a fold cut short is neither lost nor counted twice.
+    """
+    path = directory / ACCUMULATED
+    try:
+        accumulated = json.loads(path.read_text())
+    except FileNotFoundError:
+        accumulated = {'folded': [], 'metrics': {}}
+    merged = {}
+    _add(merged, accumulated['metrics'])
+    present = {data.stem for data in directory.glob('*-*.json')}
+    # Ids are only remembered while their files may still be around
+    folded = set(accumulated['folded']) & present
+    exited = list(folded)  # already counted; only their files are left
+    for process_id in sorted(present - folded):
+        if _exited(process_id):
+            _add(merged, json.loads((directory / f'{process_id}.json').read_text()), gauges=False)
+            folded.add(process_id)
+            exited.append(process_id)
+    if folded != set(accumulated['folded']):
+        _write_json(path, {'folded': sorted(folded),
+                           'metrics': {name: [[list(key), value] for key, value in values.items()]
+                                       for name, values in merged.items()}})
+    for process_id in exited:
+        (directory / f'{process_id}.json').unlink(missing_ok=True)
+        (directory / f'{process_id}.lock').unlink(missing_ok=True)
+    return merged
+
+
+def _merged():
+    """{metric name: values} summed over every process's file.
+
+    Counters and histograms keep the counts of workers that have exited, so
+    the sums never go down; gauges only count the workers still running.
+    """
+    _flush()
+    directory = Path(MULTIPROCESS_DIR)
+    fd = os.open(directory / '.fold.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        merged = _fold(directory)
+        for data in directory.glob('*-*.json'):
+            try:
+                _add(merged, json.loads(data.read_text()))
+            except (OSError, ValueError):
+                continue  # its process exited and another one folded it meanwhile
+    finally:
+        os.close(fd)
+    return {metric.name: merged.get(metric.name, {}) for metric in REGISTRY}
+
+
+def render():
+    """Every metric in the Prometheus text exposition format (0.0.4)."""
+    if MULTIPROCESS_DIR:
+        values = _merged()
+        return '\n'.join(metric.render(values[metric.name]) for metric in REGISTRY) + '\n'
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+HTTP_REQUESTS = Counter('rhcsa_http_requests_total', 'HTTP requests handled.',
+                        ('method', 'endpoint', 'status'))
+HTTP_LATENCY = Histogram('rhcsa_http_request_duration_seconds',
+                         'Time to produce a response (streamed bodies: until the stream starts).',
+                         ('method', 'endpoint'))
+GRADE_DURATION = Histogram('rhcsa_grade_duration_seconds', 'Wall time of one grading unit.', ('outcome',))
+TASK_SECONDS = Counter('rhcsa_task_grade_seconds_total',
+                       'Wall time spent grading each task on its own (per-task units).', ('task',))
+TASK_GRADES = Counter('rhcsa_task_grades_total', 'Per-task grading units run.', ('task',))
+INCREMENTAL_TASKS = Counter('rhcsa_incremental_tasks_total',
+                            'Tasks in incremental grading: result reused (hit), regraded after a state '
+                            'change (miss) or graded because their state has no fingerprint (uncacheable).',
+                            ('outcome',))
+CHECK_DURATION = Histogram('rhcsa_check_duration_seconds',
+                           'Time to evaluate one check of a task script, live SSH calls included.')
+REMOTE_COMMAND_DURATION = Histogram('rhcsa_remote_command_duration_seconds',
+                                    'Run time of one batched remote command on the node.')
+GRADER_SCRIPT = Histogram('rhcsa_grader_script_seconds',
+                          'Wall time of the bash task driver subprocess.', ('stage',))
+SSH_CONNECT = Histogram('rhcsa_ssh_connect_seconds', 'Time to establish an SSH master connection.',
+                        ('outcome',))
+SSH_COMMANDS = Counter('rhcsa_ssh_commands_total', 'Remote commands sent over SSH.', ('kind',))
+GRADE_SSH_COMMANDS = Histogram('rhcsa_grade_ssh_commands', 'Remote commands sent per grading unit.',
+                               buckets=COUNT_BUCKETS)
+GRADING_TIMEOUTS = Counter('rhcsa_grading_timeouts_total',
+                           'Grading that hit its time limit (TIMEOUT_GRADER or TIMEOUT_SINGLE_TASK).',
+                           ('limit',))
+DB_TRANSACTION = Histogram('rhcsa_db_transaction_seconds',
+                           'Time a database transaction held its connection, queries included.',
+                           ('mode',))
+
+if MULTIPROCESS_DIR:
+    Path(MULTIPROCESS_DIR).mkdir(mode=0o700, parents=True, exist_ok=True)
+    _process_id()
+    threading.Thread(target=_flush_periodically, daemon=True, name='metrics_flush').start()
+    atexit.register(_flush)
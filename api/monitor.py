@@ -0,0 +1,206 @@
+"""
+Node monitor
+Background thread that keeps the reachability of both nodes current
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from reboot import SSH_PORT, probe_port
+
+logger = logging.getLogger(__name__)
+
+NODES = ('node1', 'node2')
+# Seconds between TCP probes of the SSH port, and between SSH logins while the port stays open
+TCP_INTERVAL = 5
+AUTH_INTERVAL = 60
+# Cached state older than this is not trusted (e.g. the monitor fell behind)
+MAX_AGE = 30
+
+
+class NodeMonitor:
+    """Reachability of the nodes, refreshed in the background.
+
+    Every TCP_INTERVAL seconds the SSH port of each node gets a TCP probe,
+    which is enough to notice a node going away. An SSH login (through the
+    pool, so it also keeps the master connection warm) is only done when
+    the port comes back, when the node settings change, and every
+    AUTH_INTERVAL seconds otherwise.
+
+    With a database, the states are shared with the monitors of the other
+    worker processes (per lab): a monitor that finds states another one
+    probed within the last interval takes them instead of probing again.
+    """
+
+    def __init__(self, ssh_pool, load_config, port=SSH_PORT, interval=TCP_INTERVAL,
+                 auth_interval=AUTH_INTERVAL, db=None, lab=None):
+        self.ssh_pool = ssh_pool
+        self.load_config = load_config
+        self.db = db
+        self.lab = lab
+        self.port = port
+        self.interval = interval
+        self.auth_interval = auth_interval
+        self._states = {}
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=len(NODES), thread_name_prefix='monitor')
+        self._forced_done = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start the monitor thread (once)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='node-monitor', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Node monitor refresh failed")
+            self._stop.wait(self.interval)
+
+    def refresh(self, force=False):
+        """Probe both nodes now; force makes every node log in over SSH.
+
+        Concurrent callers share one probe instead of each starting their own.
+        """
+        requested = time.monotonic()
+        with self._probe_lock:
+            if force and self._forced_done is not None and self._forced_done >= requested:
+                return
+            if not force and self._fresh_since(requested):
+                return
+            states = None if force else self._shared_states()
+            if states is None:
+                settings = self.load_config().settings
+                states = dict(zip(NODES, self._executor.map(
+                    lambda node: self._probe(node, settings, force), NODES)))
+                self._publish(states)
+            for node, state in states.items():
+                with self._lock:
+                    previous = self._states.get(node)
+                    self._states[node] = state
+                if previous is None or previous['ok'] != state['ok']:
+                    logger.info(f"{node} is {'reachable' if state['ok'] else 'unreachable'} "
+                                f"({state['target'] or 'not configured'})")
+            if force:
+                self._forced_done = time.monotonic()
+
+    def _fresh_since(self, since):
+        """Every node was probed after monotonic time since."""
+        with self._lock:
+            return len(self._states) == len(NODES) and all(
+                s['_probed'] >= since for s in self._states.values())
+
+    @staticmethod
+    def _settings_key(settings, node):
+        """Digest of the settings a node state was probed with (the password is part of them)."""
+        values = (settings.get(node.upper(), ''), settings.get(f'{node.upper()}_IP', ''),
+                  settings.get('ROOT_PASSWORD', ''))
+        return hashlib.sha256(repr(values).encode()).hexdigest()
+
+    def _shared_states(self):
+        """States of both nodes another worker process probed within the last interval, or None."""
+        if self.db is None:
+            return None
+        try:
+            with self.db.transaction() as conn:
+                rows = conn.execute('SELECT node, state, probed_at FROM node_status WHERE lab_id = ?',
+                                    (self.lab or '',)).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read shared node status: {e}")
+            return None
+        settings = self.load_config().settings
+        now, mono = time.time(), time.monotonic()
+        states = {}
+        for row in rows:
+            state = json.loads(row['state'])
+            age = now - row['probed_at']
+            if not 0 <= age < self.interval or state['_key'] != self._settings_key(settings, row['node']):
+                return None
+            auth_age = state.pop('_auth_age')
+            states[row['node']] = {**state, '_probed': mono - age,
+                                   '_authenticated': None if auth_age is None else mono - age - auth_age}
+        return states if set(states) == set(NODES) else None
+
+    def _publish(self, states):
+        """Share freshly probed states with the other worker processes."""
+        if self.db is None:
+            return
+        now, mono = time.time(), time.monotonic()
+        rows = []
+        for node, state in states.items():
+            shared = {key: value for key, value in state.items() if key not in ('_probed', '_authenticated')}
+            shared['_auth_age'] = (None if state['_authenticated'] is None
+                                   else state['_probed'] - state['_authenticated'])
+            rows.append((self.lab or '', node, json.dumps(shared), now - (mono - state['_probed'])))
+        try:
+            with self.db.transaction(write=True) as conn:
+                conn.executemany('''
+                    INSERT INTO node_status (lab_id, node, state, probed_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (lab_id, node) DO UPDATE SET state = excluded.state,
+                        probed_at = excluded.probed_at
+                ''', rows)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not share node status: {e}")
+
+    def _probe(self, node, settings, force):
+        hostname = settings.get(node.upper(), '')
+        ip = settings.get(f'{node.upper()}_IP', '')
+        password = settings.get('ROOT_PASSWORD', '')
+        key = self._settings_key(settings, node)
+        with self._lock:
+            previous = self._states.get(node)
+        now = time.monotonic()
+        state = {'ok': False, 'target': None, 'port': None, '_key': key, '_probed': now,
+                 '_authenticated': None, 'checked_at': datetime.now().isoformat()}
+        if not (hostname or ip):
+            return state
+
+        state['port'] = probe_port(ip or hostname, self.port)
+        # Log in when asked to, for new settings, and when the port is open on
+        # a node that was down or whose last login is getting old
+        login = force or previous is None or previous['_key'] != key or (
+            state['port'] == 'open' and (not previous['ok'] or previous['_authenticated'] is None
+                                         or now - previous['_authenticated'] >= self.auth_interval))
+        if login:
+            reached = self.ssh_pool.probe_node(hostname, ip, password)
+            state.update(ok=bool(reached), target=reached, _authenticated=now if reached else None)
+        elif state['port'] == 'open':
+            state.update(ok=True, target=previous['target'], _authenticated=previous['_authenticated'])
+        return state
+
+    def status(self, fresh=False):
+        """{node: state} for both nodes; fresh (or a stale cache) probes first.
+
+        The first call starts the background monitor.
+        """
+        self.start()
+        with self._lock:
+            stale = len(self._states) < len(NODES) or any(
+                time.monotonic() - s['_probed'] > MAX_AGE for s in self._states.values())
+        if fresh or stale:
+            self.refresh(force=fresh)
+        with self._lock:
+            now = time.monotonic()
+            return {node: {
+                'ok': state['ok'],
+                'target': state['target'],
+                'port': state['port'],
+                'checked_at': state['checked_at'],
+                'age': round(now - state['_probed'], 1),
+            } for node, state in self._states.items()}
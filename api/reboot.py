@@ -0,0 +1,327 @@
+"""
+Node reboots
+Background reboots that publish readiness states as the node goes down and comes back
+"""
+
+import errno
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from labs import DEFAULT_LAB
+from shared import SharedRecords
+
+logger = logging.getLogger(__name__)
+
+SSH_PORT = 22
+# Give up on a node that is not back this long (seconds) after the reboot command
+REBOOT_TIMEOUT = 150
+# Time between port probes, and the connect timeout of each
+PROBE_INTERVAL = 0.5
+PROBE_TIMEOUT = 1.0
+# While the port still answers after the reboot command, look for a new boot this often
+SENT_RECHECK = 10
+# Finished reboots are kept this long (seconds) for clients to fetch their events
+REBOOT_RETENTION = 3600
+
+# Progress states, in order; a state the node passes too quickly is skipped
+REBOOT_STATES = ('sent', 'down', 'booting', 'sshd-up', 'ready')
+REBOOT_FINISHED = ('ready', 'failed')
+
+# Prints the current boot id, then reboots once the SSH session has returned
+REBOOT_COMMAND = 'cat /proc/sys/kernel/random/boot_id; nohup sh -c "sleep 1; reboot" &>/dev/null &'
+BOOT_ID_COMMAND = 'cat /proc/sys/kernel/random/boot_id'
+
+
+def probe_port(host, port=SSH_PORT, timeout=PROBE_TIMEOUT):
+    """TCP probe of host:port.
+
+    Returns 'open' when sshd answers with its banner, 'refused' when the
+    host is up but nothing listens (or sshd is not ready yet), and
+    'unreachable' when nothing answers at all.
+    """
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.settimeout(timeout)
+            return 'open' if sock.recv(4).startswith(b'SSH-') else 'refused'
+    except (ConnectionRefusedError, ConnectionResetError):
+        return 'refused'
+    except OSError as e:
+        if e.errno == errno.ECONNREFUSED:
+            return 'refused'
+        return 'unreachable'
+
+
+class Reboot:
+    """One node reboot and the states it went through."""
+
+    def __init__(self, node, host, lab=None, records=None):
+        self.id = uuid.uuid4().hex
+        self.lab = lab
+        self.records = records
+        self.node = node
+        self.host = host
+        self.created_at = datetime.now().isoformat()
+        self.events = []
+        self.error = None
+        self.boot_id = None
+        self._started = time.monotonic()
+        self._finished_mono = None
+        self._changed = threading.Condition()
+
+    @property
+    def state(self):
+        with self._changed:
+            return self.events[-1]['state'] if self.events else 'queued'
+
+    @property
+    def finished(self):
+        return self.state in REBOOT_FINISHED
+
+    def publish(self, state, message=None):
+        """Record a state transition and wake up subscribers."""
+        event = {'state': state, 'node': self.node,
+                 'elapsed': round(time.monotonic() - self._started, 2),
+                 'at': datetime.now().isoformat()}
+        if message:
+            event['message'] = message
+        with self._changed:
+            if state == 'failed':
+                self.error = message
+            if state in REBOOT_FINISHED:
+                self._finished_mono = time.monotonic()
+            self.events.append(event)
+            self._changed.notify_all()
+        logger.info(f"Reboot {self.id} of {self.node}: {state}" + (f" ({message})" if message else ''))
+        self.save()
+
+    def save(self):
+        """Publish the reboot's state to the other worker processes."""
+        if self.records is None:
+            return
+        snapshot = self.to_dict()
+        try:
+            self.records.save(self.id, len(snapshot['events']), snapshot, self.finished)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not save reboot {self.id}: {e}")
+
+    def wait(self, since=0, timeout=None):
+        """Block until there are events past offset `since` (or timeout); returns them."""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > since or self.finished, timeout)
+            return self.events[since:]
+
+    def subscribe(self, since=0, heartbeat=15):
+        """Yield events from offset `since` on as they happen, until the reboot finishes.
+
+        Yields None every `heartbeat` seconds without news so streams can
+        keep the connection alive.
+        """
+        while True:
+            events = self.wait(since, timeout=heartbeat)
+            if not events:
+                if self.finished:
+                    return
+                yield None
+                continue
+            for event in events:
+                yield event
+            since += len(events)
+            if events[-1]['state'] in REBOOT_FINISHED:
+                return
+
+    def expired(self, cutoff):
+        """Finished before the monotonic time cutoff."""
+        return self._finished_mono is not None and self._finished_mono < cutoff
+
+    def to_dict(self):
+        with self._changed:
+            state = self.events[-1]['state'] if self.events else 'queued'
+            return {
+                'reboot_id': self.id,
+                'node': self.node,
+                'lab': self.lab or DEFAULT_LAB,
+                'state': state,
+                'ok': state == 'ready',
+                'created_at': self.created_at,
+                'error': self.error,
+                'events': list(self.events),
+            }
+
+
+class SharedReboot:
+    """A reboot followed by another worker process, as last published by it."""
+
+    def __init__(self, records, snapshot, orphaned=False):
+        self.records = records
+        self.id = snapshot['reboot_id']
+        self._snapshot = self._mark_orphaned(snapshot) if orphaned else snapshot
+
+    @staticmethod
+    def _mark_orphaned(snapshot):
+        # Its worker exited before the node was back: nobody is following it any more
+        return {**snapshot, 'state': 'failed', 'ok': False, 'error': 'Reboot worker exited'}
+
+    @property
+    def state(self):
+        return self._snapshot['state']
+
+    @property
+    def finished(self):
+        return self.state in REBOOT_FINISHED
+
+    def to_dict(self):
+        return self._snapshot
+
+    def subscribe(self, since=0, heartbeat=15):
+        """Like Reboot.subscribe, polling the shared record for new events."""
+        quiet = 0.0
+        while True:
+            events = self._snapshot['events'][since:]
+            for event in events:
+                yield event
+            since += len(events)
+            if self.finished:
+                return
+            if events:
+                quiet = 0.0
+            elif quiet >= heartbeat:
+                quiet = 0.0
+                yield None
+            time.sleep(PROBE_INTERVAL)
+            quiet += PROBE_INTERVAL
+            found = self.records.load(self.id)
+            if found is None:
+                return
+            snapshot, orphaned = found
+            self._snapshot = self._mark_orphaned(snapshot) if orphaned else snapshot
+
+
+class RebootManager:
+    """Runs node reboots on their own threads, at most one per lab node at a time.
+
+    After the reboot command, readiness is followed with cheap TCP probes of
+    the SSH port: the port stops answering (down), the host refuses the
+    connection while sshd is not up yet (booting), sshd sends its banner
+    (sshd-up). Only then is SSH used once more, to confirm the node is on a
+    new boot id (ready). With a database, reboots are also published there
+    so any worker process can report on them.
+    """
+
+    def __init__(self, ssh_pool, port=SSH_PORT, timeout=REBOOT_TIMEOUT, retention=REBOOT_RETENTION,
+                 db=None):
+        self.ssh_pool = ssh_pool
+        self.port = port
+        self.timeout = timeout
+        self.retention = retention
+        self.records = SharedRecords(db, 'reboot') if db else None
+        self._reboots = {}
+        self._lock = threading.Lock()
+
+    def start(self, node, host, password, options=(), lab=None):
+        """Reboot node (of lab, None for the config file) at host in the background.
+
+        Returns (reboot, created); a reboot of the node that is still in
+        progress is returned as is instead of starting another one.
+        """
+        with self._lock:
+            self._prune()
+            for reboot in self._reboots.values():
+                if reboot.node == node and reboot.lab == lab and not reboot.finished:
+                    return reboot, False
+            # ...or in another worker process
+            for snapshot in self.records.active() if self.records else ():
+                if snapshot['node'] == node and snapshot['lab'] == (lab or DEFAULT_LAB):
+                    return SharedReboot(self.records, snapshot), False
+            reboot = Reboot(node, host, lab, self.records)
+            self._reboots[reboot.id] = reboot
+        reboot.save()
+        threading.Thread(target=self._run, args=(reboot, password, list(options)),
+                         name=f'reboot-{node}', daemon=True).start()
+        return reboot, True
+
+    def get(self, reboot_id):
+        """The reboot (a SharedReboot if another worker follows it), or None."""
+        with self._lock:
+            reboot = self._reboots.get(reboot_id)
+        if reboot is None and self.records:
+            found = self.records.load(reboot_id)
+            if found:
+                reboot = SharedReboot(self.records, *found)
+        return reboot
+
+    def _run(self, reboot, password, options):
+        try:
+            self._reboot(reboot, password, options)
+        except Exception as e:
+            logger.exception(f"Reboot of {reboot.node} failed")
+            reboot.publish('failed', str(e))
+
+    def _reboot(self, reboot, password, options):
+        host = reboot.host
+        result = self.ssh_pool.run(host, REBOOT_COMMAND, password, timeout=15, options=options)
+        if result.returncode != 0:
+            reboot.publish('failed', f'Reboot command failed: {result.stderr.strip() or result.returncode}')
+            return
+        reboot.boot_id = result.stdout.strip() or None
+        # The master connection dies with the node; drop it so it gets re-established
+        self.ssh_pool.close(host)
+        reboot.publish('sent')
+
+        deadline = time.monotonic() + self.timeout
+        state = 'sent'
+        previous = None
+        last_check = time.monotonic()
+        while time.monotonic() < deadline:
+            status = probe_port(host, self.port)
+            if status == 'open' and state == 'sent':
+                # Still shutting down, unless the whole reboot slipped between
+                # two probes; check for a new boot id only now and then
+                if time.monotonic() - last_check >= SENT_RECHECK:
+                    last_check = time.monotonic()
+                    if self._confirmed(reboot, password, options):
+                        reboot.publish('sshd-up')
+                        reboot.publish('ready')
+                        return
+            elif status == 'open':
+                if state != 'sshd-up':
+                    state = 'sshd-up'
+                    reboot.publish(state)
+                if self._confirmed(reboot, password, options):
+                    reboot.publish('ready')
+                    return
+            elif state == 'sent':
+                state = 'down'
+                reboot.publish(state)
+            elif state == 'down' and status == 'refused' and previous == 'unreachable':
+                # The network stack answers again but sshd is not listening yet
+                state = 'booting'
+                reboot.publish(state)
+            previous = status
+            time.sleep(PROBE_INTERVAL)
+
+        reboot.publish('failed', f'{reboot.node} did not come back online within {self.timeout}s')
+
+    def _confirmed(self, reboot, password, options):
+        """SSH works and the node is on a new boot (any boot, if the old id is unknown)."""
+        try:
+            result = self.ssh_pool.run(reboot.host, BOOT_ID_COMMAND, password, timeout=10, options=options)
+        except Exception as e:
+            logger.debug(f"Reboot {reboot.id}: SSH confirmation failed: {e}")
+            self.ssh_pool.close(reboot.host)
+            return False
+        if result.returncode != 0:
+            return False
+        return reboot.boot_id is None or result.stdout.strip() != reboot.boot_id
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.retention
+        expired = [reboot_id for reboot_id, r in self._reboots.items() if r.expired(cutoff)]
+        for reboot_id in expired:
+            del self._reboots[reboot_id]
+        if self.records:
+            self.records.prune(self.retention)
@@ -0,0 +1,269 @@
+"""
+Grading scheduler
+Runs grading work on a bounded worker pool shared fairly between labs, with a
+concurrency cap per node
+"""
+
+import fcntl
+import logging
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future
+from pathlib import Path
+
+from facts import FactCache
+from grader import CANCEL_POLL_INTERVAL, GradingCancelled, GradingError, summarize_task
+from metrics import GRADING_TIMEOUTS
+from session import GradingSession
+
+logger = logging.getLogger(__name__)
+
+
+class FairExecutor:
+    """Bounded worker pool that takes turns between queues.
+
+    Work is queued per key (the lab it is for) and idle workers serve the
+    keys round-robin, so a lab that queues a full exam does not hold up
+    the labs that queue after it. Work for one key runs in order.
+    """
+
+    def __init__(self, max_workers, thread_name_prefix='worker'):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        self._queues = OrderedDict()  # key -> deque of (future, fn, args), in turn order
+        self._changed = threading.Condition()
+        self._queued = 0
+        self._workers = 0
+        self._idle = 0
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) under key; returns its Future."""
+        future = Future()
+        with self._changed:
+            self._queues.setdefault(key, deque()).append((future, fn, args))
+            self._queued += 1
+            if self._idle < self._queued and self._workers < self.max_workers:
+                self._workers += 1
+                threading.Thread(target=self._work, daemon=True,
+                                 name=f'{self.thread_name_prefix}_{self._workers}').start()
+            self._changed.notify()
+        return future
+
+    def pending(self):
+        """{key: queued work items}, cancelled ones included until a worker drops them."""
+        with self._changed:
+            return {key: len(items) for key, items in self._queues.items()}
+
+    def _next(self):
+        # The key at the front gets this turn and goes to the back if it has more
+        key, items = self._queues.popitem(last=False)
+        item = items.popleft()
+        self._queued -= 1
+        if items:
+            self._queues[key] = items
+        return item
+
+    def _work(self):
+        while True:
+            with self._changed:
+                self._idle += 1
+                self._changed.wait_for(lambda: self._queues)
+                self._idle -= 1
+                future, fn, args = self._next()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+class NodeSlots:
+    """Grading slots per node address that hold across processes.
+
+    Each slot is a lock file in directory and a holder keeps an exclusive
+    flock on one, so the worker processes of a multi-process deployment
+    together never exceed per_node sessions on a node.
+    """
+
+    def __init__(self, directory, per_node):
+        self.directory = Path(directory)
+        self.per_node = per_node
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    def acquire(self, address, cancel=None):
+        """Wait for a free slot on address; returns the function that releases it."""
+        name = re.sub(r'[^\w.:-]', '_', address)
+        while True:
+            for n in range(self.per_node):
+                fd = os.open(self.directory / f'{name}.{n}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    continue
+                return lambda: os.close(fd)
+            if cancel is not None and cancel.is_set():
+                raise GradingCancelled()
+            time.sleep(CANCEL_POLL_INTERVAL)
+
+
+class GradingScheduler:
+    """Bounded worker pool in front of the grading engine.
+
+    Every unit of work holds a slot on each node it touches while it runs, so
+    no matter how many requests arrive at once a node never sees more than
+    per_node concurrent grading sessions. Work is queued per lab and the
+    labs take turns on the workers. Given a slot_dir, the slots are lock
+    files there (NodeSlots), so the cap holds across worker processes.
+    """
+
+    def __init__(self, engine, max_workers=8, per_node=4, slot_dir=None):
+        self.engine = engine
+        self.per_node = per_node
+        self._executor = FairExecutor(max_workers, thread_name_prefix='grader')
+        self._lock = threading.Lock()
+        self._node_slots = {}
+        self._shared_slots = NodeSlots(slot_dir, per_node) if slot_dir else None
+
+    def pending(self):
+        """{lab: units of work waiting for a worker}."""
+        return self._executor.pending()
+
+    def _slots(self, address):
+        with self._lock:
+            if address not in self._node_slots:
+                self._node_slots[address] = threading.BoundedSemaphore(self.per_node)
+            return self._node_slots[address]
+
+    def _addresses(self, tasks, nodes):
+        """Node addresses a set of tasks touches, in a stable lock order."""
+        return sorted({nodes[f'{node.upper()}_IP'] for task in tasks for node in task.nodes})
+
+    def _grade(self, task_ids, config, target, timeout, addresses, on_check=None, cancel=None,
+               facts=None, session=None, incremental=False):
+        # Work cancelled while it was queued does not start
+        if cancel is not None and cancel.is_set():
+            raise GradingCancelled()
+        acquired = []
+        try:
+            for address in addresses:
+                acquired.append(self._acquire(address, cancel))
+            return self.engine.grade(task_ids, config, target=target, timeout=timeout,
+                                     on_check=on_check, cancel=cancel, facts=facts, session=session,
+                                     incremental=incremental)
+        finally:
+            for release in reversed(acquired):
+                release()
+
+    def _acquire(self, address, cancel=None):
+        """Take a slot on a node; returns the function that releases it."""
+        if self._shared_slots:
+            return self._shared_slots.acquire(address, cancel)
+        slot = self._slots(address)
+        # Keep checking for cancellation while waiting for a busy node
+        while not slot.acquire(timeout=CANCEL_POLL_INTERVAL):
+            if cancel is not None and cancel.is_set():
+                raise GradingCancelled()
+        return slot.release
+
+    def submit(self, task_ids, config, target=None, timeout=None, on_check=None, cancel=None,
+               session=None, lab=None, incremental=False):
+        """Grade task_ids as one unit; returns a Future of the grader result.
+
+        lab names the lab config belongs to (None for the config file); it
+        only decides whose turn the work waits for. incremental reuses the
+        results of tasks whose node state did not change (see
+        GradingEngine.grade). Raises GradingError straight away for bad
+        config or unknown tasks.
+        """
+        nodes = self.engine.node_settings(config, target)
+        tasks = self.engine.select(task_ids)
+        addresses = self._addresses(tasks, nodes)
+        return self._executor.submit(lab, self._grade, task_ids, config, target, timeout, addresses,
+                                     on_check, cancel, None, session, incremental)
+
+    def submit_each(self, task_ids, config, target=None, timeout=None, on_check=None, cancel=None,
+                    session=None, lab=None, incremental=False):
+        """Queue every task as its own unit of work.
+
+        Returns [(task_id, future)] in task order. Setting cancel stops the
+        running units; queued ones should be cancelled through their futures.
+        The units share one FactCache, so a node state query made by several
+        tasks goes over the network once, and one GradingSession (the given
+        one, or a new one), so violation checks and address probes run once.
+        """
+        nodes = self.engine.node_settings(config, target)
+        tasks = self.engine.select(task_ids)
+        if not tasks:
+            raise GradingError('No matching tasks found')
+        facts = FactCache(self.engine.ssh_pool) if len(tasks) > 1 else None
+        session = session or GradingSession()
+        return [(task.id, self._executor.submit(lab, self._grade, [task.id], config, target, timeout,
+                                                self._addresses([task], nodes), on_check, cancel,
+                                                facts, session, incremental))
+                for task in tasks]
+
+    def stream(self, task_ids, config, target=None, timeout=None, session=None, lab=None,
+               incremental=False):
+        """Grade each task separately and return an iterator of events.
+
+        Events arrive as they happen: ('check', record) for every check
+        result and ('task', task_id, future) when a task finishes. All tasks
+        are queued immediately (GradingError is raised here). If the
+        consumer stops iterating, e.g. because the client disconnected,
+        queued tasks are dropped and running ones are cancelled.
+        """
+        events = queue.Queue()
+        cancel = threading.Event()
+        submitted = self.submit_each(task_ids, config, target, timeout,
+                                     on_check=lambda check: events.put(('check', check)),
+                                     cancel=cancel, session=session, lab=lab, incremental=incremental)
+        for task_id, future in submitted:
+            future.add_done_callback(lambda f, task_id=task_id: events.put(('task', task_id, f)))
+        return self._events(events, [future for _, future in submitted], cancel)
+
+    @staticmethod
+    def _events(events, futures, cancel):
+        remaining = len(futures)
+        try:
+            while remaining:
+                event = events.get()
+                if event[0] == 'task':
+                    remaining -= 1
+                yield event
+        finally:
+            cancel.set()
+            cancelled = sum(future.cancel() for future in futures)
+            if cancelled:
+                logger.info(f"Cancelled {cancelled} queued grading tasks")
+
+
+def task_result(task_id, future, timeout=None):
+    """Turn a finished per-task future into (checks, task record).
+
+    The record is the per-task result served to clients; failures become
+    records with an 'error' field instead of raising.
+    """
+    try:
+        task_checks = future.result()['checks']
+    except (CancelledError, GradingCancelled):
+        return [], {'task_id': task_id, 'passed': False, 'error': 'Grading cancelled',
+                    'message': 'Grading was cancelled.'}
+    except subprocess.TimeoutExpired:
+        GRADING_TIMEOUTS.inc(limit='single_task')
+        return [], {'task_id': task_id, 'passed': False, 'error': 'Grading timed out',
+                    'message': f'Task grading took longer than {timeout} seconds.'}
+    except Exception as e:
+        logger.error(f"Grading {task_id} failed: {e}")
+        return [], {'task_id': task_id, 'passed': False, 'error': 'Grader failed', 'message': str(e)}
+    if not task_checks:
+        return [], {'task_id': task_id, 'passed': False, 'message': 'Task not found in grader output'}
+    return task_checks, summarize_task(task_id, task_checks)
@@ -0,0 +1,153 @@
+"""
+Grading sessions
+Node address resolution and violation detection done once per grading run
+and shared by every task evaluation in it
+"""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Sessions not used for this long (seconds) are dropped
+SESSION_RETENTION = 3600
+# How often (seconds) the use of a session is recorded in the shared table
+SESSION_TOUCH_INTERVAL = 60
+
+
+class GradingSession:
+    """What the task evaluations of one grading run have in common.
+
+    A task that moves a node to its EXPECTED_IP needs to know which address
+    the node answers on, and every run checks the nodes for exam rule
+    violations. Both are worked out by the first evaluation that needs them;
+    concurrent evaluations wait for that answer instead of asking the nodes
+    again.
+    """
+
+    def __init__(self, session_id=None):
+        self.id = session_id or uuid.uuid4().hex
+        self.created_at = datetime.now().isoformat()
+        self.used = time.monotonic()
+        self._lock = threading.Lock()
+        self._addresses = {}  # (expected_ip, original_ip) -> Future of the IP that answers
+        self._violations = {}  # node addresses -> Future of the violation list
+
+    def _once(self, table, key, compute):
+        with self._lock:
+            self.used = time.monotonic()
+            future = table.get(key)
+            owner = future is None
+            if owner:
+                future = table[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            # Not cached: the next evaluation tries again
+            with self._lock:
+                del table[key]
+            future.set_exception(e)
+            raise
+        future.set_result(value)
+        return value
+
+    def address(self, expected_ip, original_ip, probe):
+        """Address the node answers on (expected_ip, original_ip or None).
+
+        probe() works it out the first time.
+        """
+        return self._once(self._addresses, (expected_ip, original_ip), probe)
+
+    def violations(self, addresses, detect):
+        """Violations found on the nodes at addresses; detect() looks the first time."""
+        return self._once(self._violations, tuple(sorted(set(addresses))), detect)
+
+    def known_violations(self):
+        """Every violation found so far, across node sets."""
+        with self._lock:
+            futures = [f for f in self._violations.values() if f.done() and not f.exception()]
+        found = []
+        for future in futures:
+            found.extend(v for v in future.result() if v not in found)
+        return found
+
+    def to_dict(self):
+        with self._lock:
+            addresses = [(key, f.result()) for key, f in self._addresses.items()
+                         if f.done() and not f.exception()]
+        return {
+            'session_id': self.id,
+            'created_at': self.created_at,
+            'addresses': [{'expected_ip': expected, 'original_ip': original, 'address': address}
+                          for (expected, original), address in addresses],
+            'violations': self.known_violations(),
+        }
+
+
+class SessionManager:
+    """Registry of grading sessions that clients reuse across requests.
+
+    With a database, session ids are also recorded there, so a session
+    started through one worker process is valid on all of them. Each
+    process keeps its own address and violation findings for it.
+    """
+
+    def __init__(self, retention=SESSION_RETENTION, db=None):
+        self.retention = retention
+        self.db = db
+        self._sessions = {}
+        self._touched = {}  # session id -> monotonic time its use was last recorded in db
+        self._lock = threading.Lock()
+
+    def create(self):
+        session = GradingSession()
+        with self._lock:
+            self._prune()
+            self._sessions[session.id] = session
+        if self.db:
+            with self.db.transaction(write=True) as conn:
+                conn.execute('DELETE FROM grading_sessions WHERE used_at < ?', (time.time() - self.retention,))
+                conn.execute('INSERT INTO grading_sessions (id, created_at, used_at) VALUES (?, ?, ?)',
+                             (session.id, session.created_at, time.time()))
+            self._touched[session.id] = time.monotonic()
+        logger.info(f"Grading session {session.id} started")
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None and self.db:
+            session = self._load(session_id)
+        if session:
+            session.used = time.monotonic()
+            if self.db and session.used - self._touched.get(session_id, 0) >= SESSION_TOUCH_INTERVAL:
+                with self.db.transaction(write=True) as conn:
+                    conn.execute('UPDATE grading_sessions SET used_at = ? WHERE id = ?',
+                                 (time.time(), session_id))
+                self._touched[session_id] = session.used
+        return session
+
+    def _load(self, session_id):
+        """A session another worker process started, or None."""
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT created_at FROM grading_sessions WHERE id = ? AND used_at >= ?',
+                               (session_id, time.time() - self.retention)).fetchone()
+        if row is None:
+            return None
+        with self._lock:
+            session = self._sessions.setdefault(session_id, GradingSession(session_id))
+        session.created_at = row['created_at']
+        return session
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.retention
+        expired = [session_id for session_id, s in self._sessions.items() if s.used < cutoff]
+        for session_id in expired:
+            del self._sessions[session_id]
+            self._touched.pop(session_id, None)
@@ -0,0 +1,160 @@
+"""
+Lab settings
+Parsed view of the config file, cached until the file changes, with atomic updates
+"""
+
+import fcntl
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+CONFIG_HEADER = '# RHCSA Practice Labs Configuration\n'
+
+
+@dataclass(frozen=True)
+class LabConfig:
+    """One version of the config file.
+
+    settings holds every raw KEY -> value pair (quotes stripped) and is what
+    the grader takes (read-only, as it is shared by every request until the
+    file changes); it is empty when there is no config file.
+    """
+    settings: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))
+    exists: bool = False
+
+    @property
+    def node1(self):
+        return self.settings.get('NODE1') or 'rhcsa1'
+
+    @property
+    def node1_ip(self):
+        return self.settings.get('NODE1_IP', '')
+
+    @property
+    def node2(self):
+        return self.settings.get('NODE2') or 'rhcsa2'
+
+    @property
+    def node2_ip(self):
+        return self.settings.get('NODE2_IP', '')
+
+    @property
+    def root_password(self):
+        return self.settings.get('ROOT_PASSWORD', '')
+
+    def node_ip(self, node):
+        """Configured IP of 'node1' or 'node2'."""
+        return self.settings.get(f'{node.upper()}_IP', '')
+
+    def public(self):
+        """Settings as served by GET /api/config (the password is never exposed)."""
+        return {
+            'node1': self.settings.get('NODE1', 'rhcsa1'),
+            'node1_ip': self.node1_ip,
+            'node2': self.settings.get('NODE2', 'rhcsa2'),
+            'node2_ip': self.node2_ip,
+            'has_password': bool(self.root_password),
+        }
+
+
+def parse_config(text):
+    """KEY -> value pairs of a shell-style config file."""
+    settings = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        settings[key.strip()] = value.strip().strip('"\'')
+    return settings
+
+
+def render_config(text, values):
+    """Config file text with values set: existing lines are replaced in
+    place (keeping comments and unknown keys), new keys are appended."""
+    lines = text.splitlines(keepends=True) if text else [CONFIG_HEADER]
+    if lines and not lines[-1].endswith('\n'):
+        lines[-1] += '\n'
+    pending = dict(values)
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith('#') or '=' not in line:
+            continue
+        key = line.split('=', 1)[0].strip()
+        if key in pending:
+            lines[i] = f'{key}="{pending.pop(key)}"\n'
+    lines += [f'{key}="{value}"\n' for key, value in pending.items()]
+    return ''.join(lines)
+
+
+class ConfigStore:
+    """The config file, parsed once and re-read only when it changes.
+
+    load() costs a stat() while the file is unchanged. update() is the one
+    way the API writes the file: under a lock (shared with other processes
+    through a lock file) it re-reads the current version, applies the
+    changes and swaps the new file in with a rename, so concurrent writers
+    never lose each other's changes and readers never see a partial file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._config = LabConfig()
+
+    def _stat(self):
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def load(self):
+        """Current LabConfig, re-parsed if the file changed since the last load."""
+        stamp = self._stat()
+        if stamp == self._stamp:
+            return self._config
+        with self._lock:
+            return self._reload()
+
+    def _reload(self):
+        stamp = self._stat()
+        if stamp == self._stamp:
+            return self._config
+        try:
+            text = self.path.read_text()
+        except FileNotFoundError:
+            config, stamp = LabConfig(), None
+        else:
+            config = LabConfig(MappingProxyType(parse_config(text)), exists=True)
+        if self._stamp is not None or stamp is not None:
+            logger.debug(f"Config {'loaded' if stamp else 'missing'}: {self.path}")
+        self._config, self._stamp = config, stamp
+        return config
+
+    def update(self, values):
+        """Set KEY -> value pairs in the file and return the new LabConfig."""
+        lock_path = self.path.with_name(f'.{self.path.name}.lock')
+        with self._lock, open(lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                current = self.path.read_text()
+                mode = self.path.stat().st_mode & 0o777
+            except FileNotFoundError:
+                current, mode = '', 0o600
+            text = render_config(current, values)
+            if text != current:
+                tmp = self.path.with_name(f'.{self.path.name}.{os.getpid()}.tmp')
+                with open(tmp, 'w') as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(tmp, mode)
+                os.replace(tmp, self.path)
+                logger.info(f"Config updated: {', '.join(sorted(values))}")
+            return self._reload()
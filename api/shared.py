@@ -0,0 +1,90 @@
+"""
+Shared records
+Snapshots of background work (grading jobs, reboots) in the results database,
+so any worker process can report on work another one is running
+"""
+
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def process_alive(pid):
+    """Is process pid still running (on this host)?"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedRecords:
+    """Latest snapshot of each piece of work of one kind, by id.
+
+    The process running the work saves a snapshot after every change, with
+    a revision that only goes up so a late writer cannot roll it back.
+    Other processes read snapshots and leave requests (cancellation) that
+    the owner picks up. Work whose owner process is gone is reported as
+    orphaned rather than left running forever.
+    """
+
+    def __init__(self, db, kind):
+        self.db = db
+        self.kind = kind
+
+    def save(self, record_id, revision, snapshot, finished=False):
+        with self.db.transaction(write=True) as conn:
+            conn.execute('''
+                INSERT INTO operations (kind, id, owner, revision, finished, snapshot, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, id) DO UPDATE SET revision = excluded.revision,
+                    finished = excluded.finished, snapshot = excluded.snapshot,
+                    updated_at = excluded.updated_at
+                WHERE excluded.revision > operations.revision
+            ''', (self.kind, record_id, os.getpid(), revision, int(finished), json.dumps(snapshot),
+                  time.time()))
+
+    def load(self, record_id):
+        """(snapshot, orphaned) of a record, or None if there is no such record.
+
+        orphaned is True when the work is unfinished and its owner has exited.
+        """
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT owner, finished, snapshot FROM operations WHERE kind = ? AND id = ?',
+                               (self.kind, record_id)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row['snapshot']), not row['finished'] and not process_alive(row['owner'])
+
+    def active(self):
+        """Snapshots of the unfinished records whose owner is still running."""
+        with self.db.transaction() as conn:
+            rows = conn.execute('SELECT owner, snapshot FROM operations WHERE kind = ? AND finished = 0',
+                                (self.kind,)).fetchall()
+        return [json.loads(row['snapshot']) for row in rows if process_alive(row['owner'])]
+
+    def request_cancel(self, record_id):
+        """Ask the owner to cancel; returns False if the record is unknown or finished."""
+        with self.db.transaction(write=True) as conn:
+            return conn.execute('''
+                UPDATE operations SET cancel_requested = 1 WHERE kind = ? AND id = ? AND finished = 0
+            ''', (self.kind, record_id)).rowcount > 0
+
+    def cancel_requested(self, record_id):
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT cancel_requested FROM operations WHERE kind = ? AND id = ?',
+                               (self.kind, record_id)).fetchone()
+        return bool(row and row['cancel_requested'])
+
+    def prune(self, retention):
+        """Drop records last updated more than retention seconds ago."""
+        with self.db.transaction(write=True) as conn:
+            deleted = conn.execute('DELETE FROM operations WHERE kind = ? AND updated_at < ?',
+                                   (self.kind, time.time() - retention)).rowcount
+        if deleted:
+            logger.debug(f"Dropped {deleted} expired {self.kind} records")
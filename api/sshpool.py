@@ -0,0 +1,226 @@
+"""
+SSH connection pool
+Keeps one persistent, multiplexed OpenSSH master connection per node
+"""
+
+import base64
+import logging
+import os
+import re
+import shlex
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from metrics import REMOTE_COMMAND_DURATION, SSH_CONNECT, count_ssh_commands
+
+logger = logging.getLogger(__name__)
+
+# Shared with exam-grader.sh so masters opened by either side are reused
+SSH_CONTROL_DIR = Path(os.environ.get('SSH_CONTROL_DIR', f'/tmp/rhcsa-ssh-{os.getuid()}'))
+SSH_CONTROL_PERSIST = int(os.environ.get('SSH_CONTROL_PERSIST', '600'))
+SSH_CONNECT_TIMEOUT = 5
+
+# Runs each command of a batch and prints one record per command:
+# "<index> <exit code> <base64 stdout> <base64 stderr> [<run time in us>]"
+# (no run time from bash < 5, which lacks EPOCHREALTIME)
+BATCH_PRELUDE = r'''
+__rhcsa_tmp=$(mktemp -d) || exit 97
+trap 'rm -rf "$__rhcsa_tmp"' EXIT
+__rhcsa_exec() {
+    local start="${EPOCHREALTIME/[.,]/}"
+    bash -c "$2" >"$__rhcsa_tmp/out" 2>"$__rhcsa_tmp/err" </dev/null
+    local rc=$? end="${EPOCHREALTIME/[.,]/}"
+    printf '%s %s ' "$1" "$rc"
+    base64 -w0 <"$__rhcsa_tmp/out"
+    printf ' '
+    base64 -w0 <"$__rhcsa_tmp/err"
+    [[ -n "$start" ]] && printf ' %s' "$(( end - start ))"
+    printf '\n'
+}
+'''
+BATCH_RECORD_RE = re.compile(r'^(\d+) (\d+) ([A-Za-z0-9+/=]*) ([A-Za-z0-9+/=]*)(?: (\d+))?$')
+
+
+@dataclass
+class RemoteResult:
+    """Outcome of one remote command (bytes, as the command produced them)."""
+    returncode: int
+    stdout: bytes = b''
+    stderr: bytes = b''
+
+
+class SSHPool:
+    """Per-node ControlMaster connections with health checks.
+
+    A master is opened lazily by ensure() and then every run() is a cheap
+    multiplexed session over it. Masters that died (node rebooted, network
+    change) fail the `ssh -O check` health check and are re-established on
+    the next ensure().
+    """
+
+    def __init__(self, control_dir=SSH_CONTROL_DIR, user='root'):
+        self.control_dir = Path(control_dir)
+        self.user = user
+        self._lock = threading.Lock()
+        self._host_locks = {}
+
+    def _host_lock(self, host):
+        with self._lock:
+            return self._host_locks.setdefault(host, threading.Lock())
+
+    def _ssh_args(self, options=()):
+        args = ['ssh',
+                '-o', f'ConnectTimeout={SSH_CONNECT_TIMEOUT}',
+                '-o', f'ControlPath={self.control_dir}/%C',
+                '-o', 'ServerAliveInterval=5',
+                '-o', 'ServerAliveCountMax=2']
+        for opt in options:
+            args += ['-o', opt]
+        return args
+
+    def _command(self, host, password, args):
+        """Build the full command line, using sshpass when a password is set."""
+        cmd = self._ssh_args() + args + [f'{self.user}@{host}']
+        env = None
+        if password:
+            cmd = ['sshpass', '-e'] + cmd
+            env = {**os.environ, 'SSHPASS': password}
+        return cmd, env
+
+    def is_alive(self, host):
+        """Health check: is there a live master for this host?"""
+        cmd = self._ssh_args() + ['-O', 'check', f'{self.user}@{host}']
+        try:
+            result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL, timeout=SSH_CONNECT_TIMEOUT)
+        except (subprocess.TimeoutExpired, FileNotFoundError):
+            return False
+        return result.returncode == 0
+
+    def ensure(self, host, password=None, options=()):
+        """Make sure a master connection to host exists, opening one if needed.
+
+        Returns True when the node is reachable and authentication works.
+        """
+        if not host:
+            return False
+        with self._host_lock(host):
+            if self.is_alive(host):
+                return True
+
+            self.control_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # Run a no-op with ControlMaster=auto: ssh becomes the master and
+            # backgrounds itself when the session ends. All stdio goes to
+            # /dev/null since the persisted master keeps inherited fds open.
+            opts = ['ControlMaster=auto', f'ControlPersist={SSH_CONTROL_PERSIST}', *options]
+            cmd, env = self._command(host, password, [arg for o in opts for arg in ('-o', o)])
+            cmd.append('true')
+            started = time.monotonic()
+            try:
+                result = subprocess.run(cmd, env=env, stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                        timeout=SSH_CONNECT_TIMEOUT + 10)
+            except subprocess.TimeoutExpired:
+                SSH_CONNECT.observe(time.monotonic() - started, outcome='timeout')
+                logger.warning(f"SSH master to {host} timed out")
+                return False
+            except FileNotFoundError as e:
+                logger.error(f"SSH master to {host} failed: {e}")
+                return False
+
+            SSH_CONNECT.observe(time.monotonic() - started, outcome='ok' if result.returncode == 0 else 'failed')
+            if result.returncode != 0:
+                logger.debug(f"SSH master to {host} failed: rc={result.returncode}")
+                return False
+            logger.debug(f"SSH master to {host} established")
+            return True
+
+    def run(self, host, command, password=None, timeout=30, options=(), input=None, text=True):
+        """Run a command on host over the pooled connection.
+
+        Falls back to a direct connection if no master can be opened.
+        Returns a subprocess.CompletedProcess; raises subprocess.TimeoutExpired.
+        """
+        count_ssh_commands(1, 'single')
+        return self._run(host, command, password, timeout, options, input, text)
+
+    def _run(self, host, command, password=None, timeout=30, options=(), input=None, text=True):
+        self.ensure(host, password, options)
+        # ControlMaster=no: reuse the master if present, never become one here
+        opts = ['ControlMaster=no', *options]
+        cmd, env = self._command(host, password, [arg for o in opts for arg in ('-o', o)])
+        cmd.append(command)
+        stdin = None if input is not None else subprocess.DEVNULL
+        return subprocess.run(cmd, env=env, stdin=stdin, input=input, capture_output=True,
+                              text=text, timeout=timeout)
+
+    def run_batch(self, host, commands, password=None, timeout=None, tag=None):
+        """Run several commands on host in a single SSH session.
+
+        Returns a list of RemoteResult aligned with commands. Entries are None
+        for commands that produced no record (e.g. the session broke midway);
+        if the node could not be reached at all every entry reports ssh's 255.
+        A tag shows up in the remote command line so cancel_batch() can
+        find the batch.
+        """
+        script = BATCH_PRELUDE + ''.join(
+            f'__rhcsa_exec {i} {shlex.quote(command)}\n' for i, command in enumerate(commands))
+        remote = f'bash -s {shlex.quote(tag)}' if tag else 'bash -s'
+        count_ssh_commands(len(commands), 'batched')
+        result = self._run(host, remote, password, timeout=timeout, input=script.encode(),
+                           text=False)
+
+        results = [None] * len(commands)
+        for line in result.stdout.decode(errors='replace').splitlines():
+            match = BATCH_RECORD_RE.match(line)
+            if match and int(match.group(1)) < len(commands):
+                index, rc, out, err, elapsed = match.groups()
+                results[int(index)] = RemoteResult(int(rc), base64.b64decode(out), base64.b64decode(err))
+                if elapsed:
+                    REMOTE_COMMAND_DURATION.observe(int(elapsed) / 1e6)
+
+        if result.returncode == 255 and not any(results):
+            # Same outcome every command would have had over a direct ssh
+            results = [RemoteResult(255, b'', result.stderr) for _ in commands]
+        return results
+
+    def cancel_batch(self, host, tag, password=None):
+        """Kill a running batch started with tag, and everything it spawned."""
+        # "[r]hcsa" keeps pgrep from matching this command's own shell
+        pattern = shlex.quote(f'[{tag[0]}]{tag[1:]}')
+        command = (f'for pid in $(pgrep -f {pattern}); do '
+                   f'kill -KILL -- -$pid 2>/dev/null || kill -KILL $pid; done; true')
+        try:
+            self.run(host, command, password, timeout=SSH_CONNECT_TIMEOUT + 5)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Cancelling batch {tag} on {host} timed out")
+
+    def probe(self, host, password=None, options=()):
+        """Check that host answers over SSH, re-establishing a stale master."""
+        if not self.ensure(host, password, options):
+            return False
+        try:
+            return self.run(host, 'true', password, timeout=SSH_CONNECT_TIMEOUT + 5,
+                            options=options).returncode == 0
+        except subprocess.TimeoutExpired:
+            self.close(host)
+            return False
+
+    def probe_node(self, hostname, ip, password=None):
+        """Probe a node trying hostname first, then IP. Returns the target or None."""
+        for target in (hostname, ip):
+            if target and self.probe(target, password):
+                return target
+        return None
+
+    def close(self, host):
+        """Tear down the master for host (e.g. before a reboot)."""
+        cmd = self._ssh_args() + ['-O', 'exit', f'{self.user}@{host}']
+        try:
+            subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, timeout=SSH_CONNECT_TIMEOUT)
+        except (subprocess.TimeoutExpired, FileNotFoundError):
+            pass
@@ -0,0 +1,292 @@
+"""
+Grading benchmark
+Runs the checks/ task set against local stand-in nodes and reports grading
+latency and SSH round trips, through exam-grader.sh and through the API
+
+Usage:
+    python3 bench/run.py [--rtt SECONDS] [--tasks 01,05,...] [--only bash|api]
+                         [--per-task] [--json FILE] [--baseline FILE] [--tolerance 0.2]
+
+The nodes are stand-ins: bench/fakenode/ssh runs each remote command on
+this machine after sleeping for the simulated network round trips, with
+bench/fixture (canned systemctl, getenforce, firewall-cmd, ... output and
+its own passwd/group) shadowing the local commands. Checks on files (test,
+stat, grep) see the local filesystem. Nothing is changed on this machine.
+
+Phases:
+    bash full   exam-grader.sh over every task, once
+    bash task   exam-grader.sh --tasks=N, once per task
+    api full    POST /api/grade-tasks over every task (streamed)
+    api task    POST /api/grade-tasks for a single task, once per task
+    api check   per-check time within the api task runs (time since the
+                request started or the previous check arrived)
+
+Round trips are counted from the fake ssh log: 3 per new connection, 1 per
+session over a master. With --baseline, the run fails (exit 1) when a p95
+or a round trip count got worse than the baseline by more than tolerance.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+BASE_DIR = BENCH_DIR.parent
+NODE_ADDRESSES = {'NODE1_IP': '127.0.0.1', 'NODE2_IP': '127.0.0.2'}
+ROUND_TRIPS = {'master': 3, 'connect': 3, 'session': 1}
+DEFAULT_RTT = 0.005
+
+
+class FakeNodes:
+    """Temporary environment that routes ssh to the stand-in nodes."""
+
+    def __init__(self, rtt=DEFAULT_RTT):
+        self.dir = Path(tempfile.mkdtemp(prefix='rhcsa-bench-'))
+        self.log = self.dir / 'ssh.log'
+        self.log.touch()
+        self.config = self.dir / 'config'
+
+        bin_dir = self.dir / 'bin'
+        node_bin = self.dir / 'node-bin'
+        bin_dir.mkdir()
+        node_bin.mkdir()
+        for name in ('ssh', 'sshpass'):
+            (bin_dir / name).symlink_to(BENCH_DIR / 'fakenode' / name)
+        for name in fixture_commands():
+            (node_bin / name).symlink_to(BENCH_DIR / 'fakenode' / 'canned')
+
+        settings = {'NODE1': 'node1', 'NODE2': 'node2', **NODE_ADDRESSES, 'ROOT_PASSWORD': 'bench'}
+        self.config.write_text(''.join(f'{key}="{value}"\n' for key, value in settings.items()))
+        self.env = {
+            **os.environ,
+            'PATH': f'{bin_dir}:{os.environ.get("PATH", "")}',
+            'BENCH_DIR': str(self.dir),
+            'BENCH_LOG': str(self.log),
+            'BENCH_RTT': str(rtt),
+            'BENCH_HOSTS': ' '.join(NODE_ADDRESSES.values()),
+            'BENCH_FIXTURE': str(BENCH_DIR / 'fixture'),
+            'BENCH_NODE_BIN': str(node_bin),
+            'RHCSA_CONFIG': str(self.config),
+            'SSH_CONTROL_DIR': str(self.dir / 'control'),
+            'RHCSA_DB': str(self.dir / 'results.db'),
+            'RHCSA_LOG': str(self.dir / 'api.log'),
+        }
+
+    def disconnect(self):
+        """Drop every master connection, so the next phase starts cold."""
+        shutil.rmtree(self.dir / 'masters', ignore_errors=True)
+
+    def offset(self):
+        return self.log.stat().st_size
+
+    def calls(self, since=0):
+        """Counter of ssh invocation kinds logged after offset since."""
+        with open(self.log, 'rb') as f:
+            f.seek(since)
+            return Counter(line.split()[1].decode() for line in f if line.strip())
+
+    def close(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def fixture_commands():
+    """Command names the fixture answers for."""
+    names = {'getent', 'id'}
+    for line in (BENCH_DIR / 'fixture' / 'commands').read_text().splitlines():
+        if line.startswith('$ '):
+            names.add(line.split()[1])
+    return sorted(names)
+
+
+def round_trips(calls):
+    return sum(ROUND_TRIPS.get(kind, 0) * count for kind, count in calls.items())
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values (None when empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)]
+
+
+def stats(samples):
+    times = [s['seconds'] for s in samples]
+    return {
+        'runs': len(samples),
+        'total': sum(times),
+        'p50': percentile(times, 50),
+        'p95': percentile(times, 95),
+        'max': max(times, default=None),
+        'round_trips': sum(s.get('round_trips', 0) for s in samples),
+    }
+
+
+def bench_bash(nodes, task_ids, full):
+    """Run exam-grader.sh (all tasks, or one task per run)."""
+    runs = [task_ids] if full else [[t] for t in task_ids]
+    samples = []
+    nodes.disconnect()
+    for tasks in runs:
+        selection = ','.join(t.removeprefix('task-') for t in tasks)
+        since = nodes.offset()
+        start = time.monotonic()
+        result = subprocess.run([str(BASE_DIR / 'exam-grader.sh'), '--json', '--skip-reboot',
+                                 f'--tasks={selection}'],
+                                env=nodes.env, cwd=BASE_DIR, stdin=subprocess.DEVNULL,
+                                capture_output=True, text=True)
+        seconds = time.monotonic() - start
+        calls = nodes.calls(since)
+        samples.append({'task': 'all' if full else tasks[0], 'seconds': seconds,
+                        'round_trips': round_trips(calls), 'calls': dict(calls),
+                        'checks': result.stdout.count('"task":'), 'rc': result.returncode})
+    return samples
+
+
+def _grade_streamed(client, task_ids, on_check):
+    """POST /api/grade-tasks and call on_check() as each check record arrives."""
+    response = client.post('/api/grade-tasks', json={'tasks': task_ids}, buffered=False)
+    checks = 0
+    try:
+        for chunk in response.response:
+            for line in (chunk.encode() if isinstance(chunk, str) else chunk).splitlines():
+                if line.strip() and json.loads(line)['type'] == 'check':
+                    checks += 1
+                    on_check()
+    finally:
+        response.close()
+    return checks
+
+
+def bench_api(nodes, task_ids, full):
+    """Grade through the Flask app (in-process WSGI client, streamed results).
+
+    Returns (per-run samples, per-check samples).
+    """
+    import app as api
+
+    logging.disable(logging.INFO)
+    client = api.app.test_client()
+    runs = [task_ids] if full else [[t] for t in task_ids]
+    samples, check_samples = [], []
+    nodes.disconnect()
+    for tasks in runs:
+        since = nodes.offset()
+        start = last = time.monotonic()
+
+        def on_check():
+            nonlocal last
+            now = time.monotonic()
+            check_samples.append({'task': tasks[0], 'seconds': now - last})
+            last = now
+
+        checks = _grade_streamed(client, tasks, on_check)
+        calls = nodes.calls(since)
+        samples.append({'task': 'all' if full else tasks[0], 'seconds': time.monotonic() - start,
+                        'round_trips': round_trips(calls), 'calls': dict(calls), 'checks': checks})
+    return samples, check_samples
+
+
+def load_task_ids(selection):
+    sys.path.insert(0, str(BASE_DIR / 'api'))
+    from catalog import TaskCatalog
+    from grader import normalize_task_id
+
+    catalog = TaskCatalog(BASE_DIR / 'checks')
+    if not selection:
+        return list(catalog.tasks)
+    wanted = {normalize_task_id(t.strip()) for t in selection.split(',')}
+    return [task_id for task_id in catalog.tasks if task_id in wanted]
+
+
+def regressions(report, baseline, tolerance):
+    """Phases whose p95 or round trips got worse than baseline."""
+    found = []
+    for phase, current in report['phases'].items():
+        previous = baseline.get('phases', {}).get(phase)
+        if not previous:
+            continue
+        if previous['p95'] and current['p95'] > previous['p95'] * (1 + tolerance):
+            found.append(f"{phase}: p95 {current['p95']:.3f}s (baseline {previous['p95']:.3f}s)")
+        if current['round_trips'] > previous['round_trips']:
+            found.append(f"{phase}: {current['round_trips']} round trips (baseline {previous['round_trips']})")
+    return found
+
+
+def _seconds(value):
+    return '-' if value is None else f'{value:.3f}'
+
+
+def print_report(report, per_task):
+    print(f"{len(report['tasks'])} tasks, simulated RTT {report['rtt'] * 1000:.1f} ms\n")
+    print(f"{'phase':<10} {'runs':>5} {'total s':>9} {'p50 s':>8} {'p95 s':>8} {'max s':>8} {'round trips':>12}")
+    for phase, s in report['phases'].items():
+        print(f"{phase:<10} {s['runs']:>5} {s['total']:>9.2f} {_seconds(s['p50']):>8} "
+              f"{_seconds(s['p95']):>8} {_seconds(s['max']):>8} {s['round_trips']:>12}")
+    if not per_task:
+        return
+    rows = {}
+    for phase in ('bash task', 'api task'):
+        for sample in report['samples'].get(phase, []):
+            rows.setdefault(sample['task'], {})[phase] = sample
+    print(f"\n{'task':<10} {'checks':>6} {'bash s':>8} {'bash rt':>8} {'api s':>8} {'api rt':>8}")
+    for task_id, row in rows.items():
+        bash, api = row.get('bash task', {}), row.get('api task', {})
+        checks = api.get('checks', bash.get('checks', 0))
+        print(f"{task_id:<10} {checks:>6} {_seconds(bash.get('seconds')):>8} {bash.get('round_trips', '-'):>8} "
+              f"{_seconds(api.get('seconds')):>8} {api.get('round_trips', '-'):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark grading against local stand-in nodes')
+    parser.add_argument('--rtt', type=float, default=DEFAULT_RTT, help='simulated network round trip (seconds)')
+    parser.add_argument('--tasks', help='comma-separated task ids (default: all)')
+    parser.add_argument('--only', choices=('bash', 'api'), help='benchmark one grader only')
+    parser.add_argument('--per-task', action='store_true', help='print per-task timings')
+    parser.add_argument('--json', type=Path, help='write the full report to this file')
+    parser.add_argument('--baseline', type=Path, help='fail on regressions against this --json report')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown (default 0.2)')
+    args = parser.parse_args()
+
+    nodes = FakeNodes(args.rtt)
+    os.environ.update(nodes.env)
+    task_ids = load_task_ids(args.tasks)
+    samples = {}
+    try:
+        if args.only != 'api':
+            samples['bash full'] = bench_bash(nodes, task_ids, full=True)
+            samples['bash task'] = bench_bash(nodes, task_ids, full=False)
+        if args.only != 'bash':
+            samples['api full'], _ = bench_api(nodes, task_ids, full=True)
+            samples['api task'], samples['api check'] = bench_api(nodes, task_ids, full=False)
+    finally:
+        nodes.close()
+
+    report = {
+        'rtt': args.rtt,
+        'tasks': task_ids,
+        'phases': {phase: stats(s) for phase, s in samples.items()},
+        'samples': samples,
+    }
+    print_report(report, args.per_task)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2) + '\n')
+
+    if args.baseline:
+        found = regressions(report, json.loads(args.baseline.read_text()), args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,7 +2,8 @@
 # Task: Set hostname to rhcsa1 on node1
 # Category: networking
 # Target: node1
+# Generated from task-03.json by `make checks`; edit the JSON instead
 
-check 'run_ssh "$NODE1_IP" "hostname -s" 2>/dev/null | grep -q "^rhcsa1$"' \
-    "Hostname set to rhcsa1" \
-    "Hostname not set to rhcsa1"
+check 'run_ssh "$NODE1_IP" "hostname -s" 2>/dev/null | grep -qE -- '"'"'^rhcsa1$'"'"'' \
+    'Hostname set to rhcsa1' \
+    'Hostname not set to rhcsa1'
@@ -2,7 +2,8 @@
 # Task: Set hostname to rhcsa2 on node2
 # Category: networking
 # Target: node2
+# Generated from task-04.json by `make checks`; edit the JSON instead
 
-check 'run_ssh "$NODE2_IP" "hostname -s" 2>/dev/null | grep -q "^rhcsa2$"' \
-    "Hostname set to rhcsa2" \
-    "Hostname not set to rhcsa2"
+check 'run_ssh "$NODE2_IP" "hostname -s" 2>/dev/null | grep -qE -- '"'"'^rhcsa2$'"'"'' \
+    'Hostname set to rhcsa2' \
+    'Hostname not set to rhcsa2'
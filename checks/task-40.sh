@@ -2,11 +2,12 @@
 # Task: On rhcsa2 - Create compressed archive of /usr/lib
 # Category: essential-tools
 # Store as /var/tmp/usr.tar.bz2
+# Generated from task-40.json by `make checks`; edit the JSON instead
 
-check 'run_ssh "$NODE2_IP" "[[ -f /var/tmp/usr.tar.bz2 ]]" 2>/dev/null' \
-    "Archive /var/tmp/usr.tar.bz2 exists on node2" \
-    "Archive /var/tmp/usr.tar.bz2 does not exist"
+check 'run_ssh "$NODE2_IP" "stat -L -c %f:%a:%U:%G /var/tmp/usr.tar.bz2" 2>/dev/null | grep -qE -- '"'"'^8[0-9a-f]{3}:'"'"'' \
+    'Archive /var/tmp/usr.tar.bz2 exists on node2' \
+    'Archive /var/tmp/usr.tar.bz2 does not exist'
 
-check 'run_ssh "$NODE2_IP" "file /var/tmp/usr.tar.bz2 | grep -qi bzip2" 2>/dev/null' \
-    "Archive is bzip2 compressed" \
-    "Archive is not bzip2 compressed"
+check 'run_ssh "$NODE2_IP" "file /var/tmp/usr.tar.bz2" 2>/dev/null | grep -qFi -- bzip2' \
+    'Archive is bzip2 compressed' \
+    'Archive is not bzip2 compressed'
@@ -1,11 +1,12 @@
 #!/usr/bin/env bash
 # Task: On rhcsa2 - Create /dir1/dir2/dir3/dir4 with SELinux contexts of /etc
 # Category: security
+# Generated from task-44.json by `make checks`; edit the JSON instead
 
-check 'run_ssh "$NODE2_IP" "[[ -d /dir1/dir2/dir3/dir4 ]]" 2>/dev/null' \
-    "Directory hierarchy exists on node2" \
-    "Directory hierarchy does not exist on node2"
+check 'run_ssh "$NODE2_IP" "stat -L -c %f:%a:%U:%G /dir1/dir2/dir3/dir4" 2>/dev/null | grep -qE -- '"'"'^4[0-9a-f]{3}:'"'"'' \
+    'Directory hierarchy exists on node2' \
+    'Directory hierarchy does not exist on node2'
 
-check 'run_ssh "$NODE2_IP" "ls -Zd /dir1 2>/dev/null | grep -q etc_t"' \
-    "/dir1 has etc_t SELinux context" \
-    "/dir1 does not have etc_t SELinux context"
+check 'run_ssh "$NODE2_IP" "ls -Zd /dir1" 2>/dev/null | grep -qF -- etc_t' \
+    '/dir1 has etc_t SELinux context' \
+    '/dir1 does not have etc_t SELinux context'
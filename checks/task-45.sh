@@ -1,11 +1,12 @@
 #!/usr/bin/env bash
 # Task: On rhcsa2 - Find files modified in last 30 days, save to /var/tmp/modfiles.txt
 # Category: essential-tools
+# Generated from task-45.json by `make checks`; edit the JSON instead
 
-check 'run_ssh "$NODE2_IP" "[[ -f /var/tmp/modfiles.txt ]]" 2>/dev/null' \
-    "File /var/tmp/modfiles.txt exists on node2" \
-    "File /var/tmp/modfiles.txt does not exist"
+check 'run_ssh "$NODE2_IP" "stat -L -c %f:%a:%U:%G /var/tmp/modfiles.txt" 2>/dev/null | grep -qE -- '"'"'^8[0-9a-f]{3}:'"'"'' \
+    'File /var/tmp/modfiles.txt exists on node2' \
+    'File /var/tmp/modfiles.txt does not exist'
 
-check 'run_ssh "$NODE2_IP" "[[ -s /var/tmp/modfiles.txt ]]" 2>/dev/null' \
-    "/var/tmp/modfiles.txt is not empty" \
-    "/var/tmp/modfiles.txt is empty"
+check 'run_ssh "$NODE2_IP" "[[ -s /var/tmp/modfiles.txt ]]" &>/dev/null' \
+    '/var/tmp/modfiles.txt is not empty' \
+    '/var/tmp/modfiles.txt is empty'
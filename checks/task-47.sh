@@ -2,11 +2,12 @@
 # Task: On rhcsa2 - Add custom message to /var/log/messages
 # Category: operate-systems
 # Confirm with regex, output to /root/customlogmessage
+# Generated from task-47.json by `make checks`; edit the JSON instead
 
-check 'run_ssh "$NODE2_IP" "[[ -f /root/customlogmessage ]]" 2>/dev/null' \
-    "File /root/customlogmessage exists on node2" \
-    "File /root/customlogmessage does not exist"
+check 'run_ssh "$NODE2_IP" "stat -L -c %f:%a:%U:%G /root/customlogmessage" 2>/dev/null | grep -qE -- '"'"'^8[0-9a-f]{3}:'"'"'' \
+    'File /root/customlogmessage exists on node2' \
+    'File /root/customlogmessage does not exist'
 
-check 'run_ssh "$NODE2_IP" "grep -q \"RHCSA sample exam\" /root/customlogmessage 2>/dev/null"' \
-    "Custom log message captured in output" \
-    "Custom log message not found in output"
+check 'run_ssh "$NODE2_IP" "grep -q \"RHCSA sample exam\" /root/customlogmessage" &>/dev/null' \
+    'Custom log message captured in output' \
+    'Custom log message not found in output'
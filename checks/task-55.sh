@@ -1,11 +1,12 @@
 #!/usr/bin/env bash
 # Task: On rhcsa2 - Determine and apply recommended tuned profile
 # Category: operate-systems
+# Generated from task-55.json by `make checks`; edit the JSON instead
 
-check 'run_ssh "$NODE2_IP" "systemctl is-active tuned &>/dev/null" 2>/dev/null' \
-    "tuned service is running on node2" \
-    "tuned service is not running on node2"
+check 'run_ssh "$NODE2_IP" "systemctl is-active tuned" &>/dev/null' \
+    'tuned service is running on node2' \
+    'tuned service is not running on node2'
 
-check 'run_ssh "$NODE2_IP" "tuned-adm active &>/dev/null" 2>/dev/null' \
-    "A tuned profile is active on node2" \
-    "No tuned profile is active on node2"
+check 'run_ssh "$NODE2_IP" "tuned-adm active" &>/dev/null' \
+    'A tuned profile is active on node2' \
+    'No tuned profile is active on node2'
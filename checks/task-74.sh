@@ -1,15 +1,16 @@
 #!/usr/bin/env bash
 # Task: On rhcsa2 - SSH config: allow root, port 2022
 # Category: security
+# Generated from task-74.json by `make checks`; edit the JSON instead
 
-check 'run_ssh "$NODE2_IP" "grep -q \"^PermitRootLogin yes\" /etc/ssh/sshd_config"' \
-    "Root login is permitted on node2" \
-    "Root login is not permitted on node2"
+check 'run_ssh "$NODE2_IP" "grep -q \"^PermitRootLogin yes\" /etc/ssh/sshd_config" &>/dev/null' \
+    'Root login is permitted on node2' \
+    'Root login is not permitted on node2'
 
-check 'run_ssh "$NODE2_IP" "grep -q \"^Port 2022\" /etc/ssh/sshd_config"' \
-    "SSH port 2022 configured on node2" \
-    "SSH port 2022 not configured on node2"
+check 'run_ssh "$NODE2_IP" "grep -q \"^Port 2022\" /etc/ssh/sshd_config" &>/dev/null' \
+    'SSH port 2022 configured on node2' \
+    'SSH port 2022 not configured on node2'
 
-check 'run_ssh "$NODE2_IP" "ss -tlnp | grep -q :2022"' \
-    "SSH listening on port 2022 on node2" \
-    "SSH not listening on port 2022"
+check 'run_ssh "$NODE2_IP" "ss -tlnp" 2>/dev/null | grep -qF -- :2022' \
+    'SSH listening on port 2022 on node2' \
+    'SSH not listening on port 2022'
@@ -2,11 +2,12 @@
 # Task: Configure mariadb container from task-75 as systemd user container
 # Category: containers
 # (This is a continuation of task 75)
+# Generated from task-76.json by `make checks`; edit the JSON instead
 
-check 'run_ssh "$NODE2_IP" "[[ -d /home/edwin/.config/systemd/user ]]"' \
-    "Systemd user directory exists for edwin" \
-    "Systemd user directory does not exist"
+check 'run_ssh "$NODE2_IP" "stat -L -c %f:%a:%U:%G /home/edwin/.config/systemd/user" 2>/dev/null | grep -qE -- '"'"'^4[0-9a-f]{3}:'"'"'' \
+    'Systemd user directory exists for edwin' \
+    'Systemd user directory does not exist'
 
-check 'run_ssh "$NODE2_IP" "ls /home/edwin/.config/systemd/user/*.service 2>/dev/null | grep -qi container"' \
-    "Container service file exists for edwin" \
-    "Container service file does not exist"
+check 'run_ssh "$NODE2_IP" "ls /home/edwin/.config/systemd/user/*.service" 2>/dev/null | grep -qFi -- container' \
+    'Container service file exists for edwin' \
+    'Container service file does not exist'
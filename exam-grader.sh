@@ -12,7 +12,7 @@ shopt -s nullglob
 # ----------------------------------------
 readonly BASE_DIR=$(dirname "$0")
 readonly LOG_FILE="${BASE_DIR}/exam-grader.log"
-readonly CONFIG_FILE="${BASE_DIR}/config"
+readonly CONFIG_FILE="${RHCSA_CONFIG:-${BASE_DIR}/config}"
 readonly RED='\033[0;31m'
 readonly GREEN='\033[0;32m'
 readonly YELLOW='\033[1;33m'
@@ -27,62 +27,26 @@ TOTAL=0
 DRY_RUN=false
 SKIP_REBOOT=false
 JSON_OUTPUT=false
+JSON_LINES=false
 LIST_TASKS=false
 SELECTED_TASKS=""
 TARGET_OVERRIDE=""
 
-# For JSON output - stores results
+# Start of the run in microseconds (empty on bash < 5), for the JSON duration_ms
+readonly STARTED_US="${EPOCHREALTIME/[.,]/}"
+
+# For JSON output - one JSON object per check, plus points per category
 declare -a RESULTS_JSON=()
+declare -A CAT_EARNED=()
+declare -A CAT_POSSIBLE=()
+# ssh_probe results by address, so tasks sharing an EXPECTED_IP probe it once per run
+declare -A PROBED=()
 CURRENT_TASK=""
 CURRENT_CATEGORY=""
 #-----------------------------------------
 
-# SSH options for non-interactive remote checks
-SSH_OPTS="-o ConnectTimeout=5"
-
-# SSH wrapper - uses sshpass with ROOT_PASSWORD when set
-# Usage: run_ssh <host> <command>
-# Note: Prefer hostnames over IPs as some systems block IP-based SSH
-run_ssh() {
-    local host="$1"
-    shift
-    if [[ -n "$ROOT_PASSWORD" ]]; then
-        sshpass -p "$ROOT_PASSWORD" ssh $SSH_OPTS root@"$host" "$@"
-    else
-        ssh $SSH_OPTS root@"$host" "$@"
-    fi
-}
-
-# Low-level SSH probe - tests if we can connect to a target
-# Returns 0 on success, 1 on failure
-# Usage: ssh_probe <target>
-ssh_probe() {
-    local target="$1"
-    # Use sshpass if password is set
-    if [[ -n "$ROOT_PASSWORD" ]]; then
-       sshpass -p "$ROOT_PASSWORD" ssh $SSH_OPTS root@"$target" exit &>/dev/null
-    else
-       ssh $SSH_OPTS root@"$target" exit &>/dev/null
-    fi
-    return $?
-}
-
-# Probe a node trying hostname first, then IP
-# Outputs the successful target or empty string
-# Usage: ssh_probe_node <hostname> <ip>
-ssh_probe_node() {
-    local hostname="$1"
-    local ip="$2"
-
-    if [[ -n "$hostname" ]] && ssh_probe "$hostname"; then
-        echo "$hostname"
-        return 0
-    elif [[ -n "$ip" ]] && ssh_probe "$ip"; then
-        echo "$ip"
-        return 0
-    fi
-    return 1
-}
+# SSH helpers (run_ssh, ssh_probe, ...)
+source "${BASE_DIR}/lib/ssh.sh"
 
 # ----------------------------------------
 # Argument parsing
@@ -95,6 +59,7 @@ usage() {
     echo "  --check-ssh       Check SSH connectivity between nodes"
     echo "  --skip-reboot     Skip the reboot check (for API/automation use)"
     echo "  --json            Output results as JSON (for API integration)"
+    echo "  --jsonl           Output each check as a JSON line as it runs, then a summary line"
     echo "  --tasks=LIST      Run only specific tasks (comma-separated, e.g., --tasks=01,05,27)"
     echo "  --target=VM       Override target VM (node1, node2, or both)"
     echo "  --list-tasks      List all available tasks with categories"
@@ -121,6 +86,11 @@ parse_args() {
                 JSON_OUTPUT=true
                 shift
                 ;;
+            --jsonl)
+                JSON_OUTPUT=true
+                JSON_LINES=true
+                shift
+                ;;
             --tasks=*)
                 SELECTED_TASKS="${1#*=}"
                 shift
@@ -210,7 +180,13 @@ check() {
     local points="${4:-10}"
     local passed=false
 
+    # A malformed check call (e.g. broken quoting in a task) is not scored
+    if [[ ! "$points" =~ ^[0-9]+$ ]]; then
+        echo "check: invalid points '$points' in $CURRENT_TASK" >&2
+        return 1
+    fi
     TOTAL=$(( TOTAL + points ))
+    local start="${EPOCHREALTIME/[.,]/}"
     if eval "$condition"; then
         passed=true
         SCORE=$(( SCORE + points ))
@@ -223,17 +199,69 @@ check() {
         fi
     fi
 
-    # Store result for JSON output
+    # Store result for JSON output, with the time the condition took
     if [[ "$JSON_OUTPUT" == true ]]; then
-        local json_entry=$(cat <<EOF
-{"task":"$CURRENT_TASK","category":"$CURRENT_CATEGORY","check":"$ok_msg","passed":$passed,"points":$points}
-EOF
-)
-        RESULTS_JSON+=("$json_entry")
+        record_check "$ok_msg" "$passed" "$points" "" "${start:+$(( ${EPOCHREALTIME/[.,]/} - start ))}"
+    fi
+}
+
+# Microseconds as milliseconds with 3 decimals; result in REPLY
+us_to_ms() {
+    printf -v REPLY '%d.%03d' "$(( $1 / 1000 ))" "$(( $1 % 1000 ))"
+}
+
+# Escape a string for use inside a JSON string literal; result in REPLY
+# (no subshell, as it runs for every check)
+json_escape() {
+    local s="${1//\\/\\\\}"
+    s="${s//\"/\\\"}"
+    s="${s//$'\n'/\\n}"
+    s="${s//$'\r'/\\r}"
+    s="${s//$'\t'/\\t}"
+    REPLY="${s//[$'\001'-$'\037']/}"
+}
+
+# Record one check result for JSON output and add its points to the category
+# totals; with --jsonl it is also written out right away
+# Usage: record_check 'check' passed points ['message'] [microseconds taken]
+record_check() {
+    local check="$1"
+    local passed="$2"
+    local points="$3"
+    local task category entry
+
+    json_escape "$CURRENT_TASK"; task="$REPLY"
+    json_escape "$CURRENT_CATEGORY"; category="$REPLY"
+    json_escape "$check"
+    entry="{\"task\":\"$task\",\"category\":\"$category\",\"check\":\"$REPLY\",\"passed\":$passed,\"points\":$points"
+    if [[ -n "$4" ]]; then
+        json_escape "$4"
+        entry+=",\"message\":\"$REPLY\""
     fi
+    if [[ -n "$5" ]]; then
+        us_to_ms "$5"
+        entry+=",\"duration_ms\":$REPLY"
+    fi
+    entry+="}"
+    RESULTS_JSON+=("$entry")
+
+    CAT_POSSIBLE[$category]=$(( ${CAT_POSSIBLE[$category]:-0} + points ))
+    [[ "$passed" == true ]] && CAT_EARNED[$category]=$(( ${CAT_EARNED[$category]:-0} + points ))
+    [[ "$JSON_LINES" == true ]] && printf '{"type":"check",%s\n' "${entry:1}"
+    return 0
 }
 
 # Sources task script and compound each score
+# ssh_probe once per address per run
+probe_once() {
+	local ip="$1"
+	if [[ -z "${PROBED[$ip]+set}" ]]; then
+		ssh_probe "$ip"
+		PROBED[$ip]=$?
+	fi
+	return "${PROBED[$ip]}"
+}
+
 evaluate_task() {
 	local task="$1"
 	CURRENT_TASK=$(basename "$task" .sh)
@@ -264,14 +292,14 @@ evaluate_task() {
 	    fi
 
 	    # Case 1: Expected IP is active -> Use it and proceed
-	    if ssh_probe "$expected_ip"; then
+	    if probe_once "$expected_ip"; then
 	        eval "$node_var='${expected_ip}'"
 	        [[ "$JSON_OUTPUT" == false ]] && echo -e "${GREEN}[INFO]${NC} Task $CURRENT_TASK: Detected new IP $expected_ip active. Using it for grading."
 	    
         # Case 2: Expected IP unreachable, trying Original IP
 	    else
             # Case 3: Original IP is active -> Task likely failed (network settings incorrect)
-	        if ssh_probe "$original_ip"; then
+	        if probe_once "$original_ip"; then
                 [[ "$JSON_OUTPUT" == false ]] && echo -e "${RED}[FAIL]${NC} Task $CURRENT_TASK: Target IP $expected_ip unreachable, but host is accessible via $original_ip. Task failed."
                 # We do NOT update the IP, so the script will try to grade on original_ip and likely fail checks
                 # Or we could just fail fast here? The user asked: "if the target ip doesnt work, but host works, task failed"
@@ -281,7 +309,7 @@ evaluate_task() {
             else
                 [[ "$JSON_OUTPUT" == false ]] && echo -e "${RED}[ERROR]${NC} Task $CURRENT_TASK: Could not reach node via Target ($expected_ip) or Original ($original_ip) IP."
                 if [[ "$JSON_OUTPUT" == true ]]; then
-                     echo "{\"task\":\"$CURRENT_TASK\",\"category\":\"$CURRENT_CATEGORY\",\"check\":\"Connectivity Check\",\"passed\":false,\"points\":0,\"message\":\"Critical: Connection lost to both $expected_ip and $original_ip\"}," >> "${RESULTS_JSON_FILE}" 
+                     record_check "Connectivity Check" false 0 "Critical: Connection lost to both $expected_ip and $original_ip"
                 else
                      echo -e "${RED}CRITICAL:${NC} Connection lost. Cannot grade this task."
                 fi
@@ -350,26 +378,30 @@ check_outcome() {
 output_json() {
 	local passed="$1"
 	local timestamp=$(date -Iseconds)
+	local duration=""
+	if [[ -n "$STARTED_US" ]]; then
+		us_to_ms "$(( ${EPOCHREALTIME/[.,]/} - STARTED_US ))"
+		duration=',"duration_ms":'"$REPLY"
+	fi
 
-	# Build results array
-	local results_arr=""
-	for i in "${!RESULTS_JSON[@]}"; do
-		[[ $i -gt 0 ]] && results_arr+=","
-		results_arr+="${RESULTS_JSON[$i]}"
-	done
-
-	# Calculate category stats
-	local categories=$(printf '%s\n' "${RESULTS_JSON[@]}" | grep -oP '"category":"\K[^"]+' | sort -u)
+	# Category totals were summed as the checks ran
 	local cat_stats=""
-	local first=true
-	for cat in $categories; do
-		local cat_total=$(printf '%s\n' "${RESULTS_JSON[@]}" | grep "\"category\":\"$cat\"" | grep -oP '"points":\K[0-9]+' | paste -sd+ | bc)
-		local cat_passed=$(printf '%s\n' "${RESULTS_JSON[@]}" | grep "\"category\":\"$cat\"" | grep '"passed":true' | grep -oP '"points":\K[0-9]+' | paste -sd+ | bc)
-		[[ -z "$cat_passed" ]] && cat_passed=0
-		[[ "$first" == false ]] && cat_stats+=","
-		cat_stats+="\"$cat\":{\"earned\":$cat_passed,\"possible\":$cat_total}"
-		first=false
-	done
+	local cat
+	while IFS= read -r cat; do
+		[[ -z "$cat" ]] && continue
+		[[ -n "$cat_stats" ]] && cat_stats+=","
+		cat_stats+="\"$cat\":{\"earned\":${CAT_EARNED[$cat]:-0},\"possible\":${CAT_POSSIBLE[$cat]}}"
+	done < <(printf '%s\n' "${!CAT_POSSIBLE[@]}" | LC_ALL=C sort)
+
+	if [[ "$JSON_LINES" == true ]]; then
+		printf '{"type":"summary","timestamp":"%s","score":%d,"total":%d,"passed":%s,"passing_threshold":70,"categories":{%s}%s}\n' \
+			"$timestamp" "$SCORE" "$TOTAL" "$passed" "$cat_stats" "$duration"
+		return
+	fi
+
+	# Build results array
+	local IFS=","
+	local results_arr="${RESULTS_JSON[*]}"
 
 	cat <<EOF
 {
@@ -379,7 +411,7 @@ output_json() {
   "passed": $passed,
   "passing_threshold": 70,
   "categories": {$cat_stats},
-  "checks": [$results_arr]
+  "checks": [$results_arr]$duration
 }
 EOF
 }
@@ -0,0 +1,42 @@
+"""
+Gunicorn settings
+Production serving: pre-forked worker processes, each with a pool of request threads
+"""
+
+import multiprocessing
+import os
+import shutil
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+wsgi_app = 'app:app'
+pythonpath = os.path.join(here, 'api')
+
+bind = os.environ.get('RHCSA_BIND', '0.0.0.0:5000')
+
+# Grading waits on SSH, not the CPU: a few processes with many threads each.
+# Jobs, sessions, reboots, node status and task results live in results.db,
+# so any worker answers for work another one started.
+workers = int(os.environ.get('RHCSA_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('RHCSA_THREADS', 8))
+
+# Longer than a full grading run (TIMEOUT_GRADER in api/app.py)
+timeout = 330
+graceful_timeout = 30
+
+# Not preloaded: each worker opens its own database connections and SSH
+# masters after the fork instead of inheriting the master's
+preload_app = False
+
+# Workers write their metrics here and /metrics on any of them reports the
+# sum over all (see api/metrics.py): by default next to the results database.
+# Set before the fork so workers inherit it
+state_dir = os.path.dirname(os.path.abspath(os.environ.get('RHCSA_DB', os.path.join(here, 'results.db'))))
+metrics_dir = os.environ.setdefault('RHCSA_METRICS_DIR', os.path.join(state_dir, '.metrics'))
+
+
+def on_starting(server):
+    """Start the counters from zero: drop the samples of the previous server run."""
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, mode=0o700, exist_ok=True)
@@ -0,0 +1,66 @@
+#!/usr/bin/env bash
+# SSH helpers shared by exam-grader.sh and the API grading engine
+# Expects ROOT_PASSWORD to be set (or empty for key-based auth)
+
+# SSH options for non-interactive remote checks
+# Connections are multiplexed: one persistent master per node (ControlMaster),
+# shared by every run_ssh call and by the API, which uses the same ControlPath
+SSH_CONTROL_DIR="${SSH_CONTROL_DIR:-/tmp/rhcsa-ssh-${UID}}"
+SSH_CONTROL_PERSIST="${SSH_CONTROL_PERSIST:-600}"
+SSH_OPTS="-o ConnectTimeout=5 -o ControlPath=${SSH_CONTROL_DIR}/%C -o ServerAliveInterval=5 -o ServerAliveCountMax=2"
+
+# Low-level ssh invocation - uses sshpass with ROOT_PASSWORD when set
+# Usage: ssh_cmd <ssh args...>
+ssh_cmd() {
+    if [[ -n "$ROOT_PASSWORD" ]]; then
+        sshpass -p "$ROOT_PASSWORD" ssh $SSH_OPTS "$@"
+    else
+        ssh $SSH_OPTS "$@"
+    fi
+}
+
+# Make sure a master connection to the target exists (health check first)
+# The master backgrounds itself and keeps inherited fds open, so all of its
+# stdio must point at /dev/null or callers reading our output would hang
+# Usage: ssh_mux_ensure <host>
+ssh_mux_ensure() {
+    local host="$1"
+    ssh $SSH_OPTS -O check root@"$host" &>/dev/null && return 0
+    [[ -d "$SSH_CONTROL_DIR" ]] || mkdir -p -m 700 "$SSH_CONTROL_DIR"
+    ssh_cmd -o ControlMaster=auto -o ControlPersist="$SSH_CONTROL_PERSIST" root@"$host" true </dev/null &>/dev/null
+}
+
+# SSH wrapper - runs a command over the node's master connection
+# Usage: run_ssh <host> <command>
+# Note: Prefer hostnames over IPs as some systems block IP-based SSH
+run_ssh() {
+    local host="$1"
+    shift
+    ssh_mux_ensure "$host"
+    ssh_cmd -o ControlMaster=no root@"$host" "$@"
+}
+
+# Low-level SSH probe - tests if we can connect to a target
+# Returns 0 on success, 1 on failure
+# Usage: ssh_probe <target>
+ssh_probe() {
+    local target="$1"
+    ssh_mux_ensure "$target" && ssh_cmd -o ControlMaster=no root@"$target" exit </dev/null &>/dev/null
+}
+
+# Probe a node trying hostname first, then IP
+# Outputs the successful target or empty string
+# Usage: ssh_probe_node <hostname> <ip>
+ssh_probe_node() {
+    local hostname="$1"
+    local ip="$2"
+
+    if [[ -n "$hostname" ]] && ssh_probe "$hostname"; then
+        echo "$hostname"
+        return 0
+    elif [[ -n "$ip" ]] && ssh_probe "$ip"; then
+        echo "$ip"
+        return 0
+    fi
+    return 1
+}
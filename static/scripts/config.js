@@ -55,7 +55,7 @@ async function saveConfig() {
 async function refreshVmInfo() {
     // Test connection and update status
     try {
-        const res = await fetch('/api/test-connection', { method: 'POST' });
+        const res = await fetch('/api/test-connection?fresh=1', { method: 'POST' });
         const data = await res.json();
 
         document.getElementById('vm1-status').className = 'dot ' + (data.node1 ? 'ok' : 'fail');
@@ -140,7 +140,7 @@ async function quickTestConnection() {
     document.getElementById('vm2-status').style.backgroundColor = 'var(--text-muted)';
 
     try {
-        const res = await fetch('/api/test-connection', { method: 'POST' });
+        const res = await fetch('/api/test-connection?fresh=1', { method: 'POST' });
         const data = await res.json();
 
         // Clear manual styles
@@ -178,7 +178,7 @@ async function testConnection() {
     `;
 
     try {
-        const res = await fetch('/api/test-connection', { method: 'POST' });
+        const res = await fetch('/api/test-connection?fresh=1', { method: 'POST' });
         const data = await res.json();
 
         document.getElementById('vm1-status').className = 'dot ' + (data.node1 ? 'ok' : 'fail');
@@ -543,9 +543,10 @@ async function gradeCurrentTask(taskId) {
     }
 
     try {
+        // Incremental: an unchanged task answers from its last result
         const url = selectedVm === 'default'
-            ? `/api/grade-task/${taskId}`
-            : `/api/grade-task/${taskId}?target=${selectedVm}`;
+            ? `/api/grade-task/${taskId}?incremental=1`
+            : `/api/grade-task/${taskId}?target=${selectedVm}&incremental=1`;
         const res = await fetch(url, { method: 'POST' });
         const result = await res.json();
 
@@ -624,6 +625,12 @@ function abortGrading() {
     window.gradingAborted = true;
     document.getElementById('grading-status').textContent = 'Cancelling...';
     document.getElementById('cancel-grading-btn').disabled = true;
+
+    // Stop the server-side job too, so it stops using the VMs
+    if (window.gradingJobId) {
+        fetch(`/api/jobs/${window.gradingJobId}`, { method: 'DELETE' })
+            .catch(e => console.error('Failed to cancel grading job:', e));
+    }
 }
 
 async function submitExam() {
@@ -673,44 +680,23 @@ async function submitExam() {
 
     // Reboot both VMs in parallel before grading
     try {
-        // Progress Animation for Reboot
-        let p = 0;
-        const rebootInterval = setInterval(() => {
+        // Both nodes report their progress; the bar follows the slower one
+        const progress = { node1: 0, node2: 0 };
+        const onState = node => state => {
             if (window.gradingAborted) return;
-            p += 0.5; // Slow increment
-            if (p > 95) p = 95;
-
-            // Update bar
-            progressFill.style.width = p + '%';
-
-            // Update text based on progress
-            if (p < 15) statusEl.textContent = 'Sending reboot signals to VMs...';
-            else if (p < 40) statusEl.textContent = 'Systems are ensuring configurations persist...';
-            else if (p < 70) statusEl.textContent = 'Waiting for SSH services to come back online...';
-            else statusEl.textContent = 'Finalizing connection establishment...';
-        }, 100); // Update every 100ms
+            const [percent, label] = REBOOT_PROGRESS[state] || [95, 'Finalizing...'];
+            progress[node] = percent;
+            const slowest = Math.min(progress.node1, progress.node2);
+            progressFill.style.width = slowest + '%';
+            if (progress[node] === slowest) statusEl.textContent = `${label} (${node})`;
+        };
 
         // Execute reboots
-        const rebootPromises = Promise.all([
-            fetch('/api/reboot-vm', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ node: 'node1' })
-            }).then(r => r.json()).catch(() => ({ ok: false })),
-            fetch('/api/reboot-vm', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ node: 'node2' })
-            }).then(r => r.json()).catch(() => ({ ok: false }))
+        const [r1, r2] = await Promise.all([
+            rebootAndWait('node1', onState('node1')).catch(() => ({ ok: false })),
+            rebootAndWait('node2', onState('node2')).catch(() => ({ ok: false }))
         ]);
 
-        // Minimum wait time for realism and to ensure VMs actually go down/up (15s minimum)
-        const waitPromise = new Promise(resolve => setTimeout(resolve, 15000));
-
-        const [[r1, r2]] = await Promise.all([rebootPromises, waitPromise]);
-
-        clearInterval(rebootInterval);
-
         if (window.gradingAborted) {
             document.removeEventListener('keydown', handleGradingEsc);
             modal.classList.add('hidden');
@@ -767,9 +753,9 @@ async function submitExam() {
             <span class="task-name">${i + 1}. ${t.description}</span>
         </div>
     `).join('');
-    statusEl.textContent = `Grading ${window.selectedTasks.length} tasks in parallel...`;
+    statusEl.textContent = `Grading ${window.selectedTasks.length} tasks...`;
 
-    // Grade all tasks in parallel with real-time UI updates
+    // Grade all tasks with real-time UI updates as results stream back
     const results = [];
     let totalScore = 0;
     let totalPoints = 0;
@@ -783,60 +769,74 @@ async function submitExam() {
         taskEl.querySelector('.icon').textContent = '◐';
     });
 
-    // Create all grading promises
-    const gradingPromises = window.selectedTasks.map(async (task, i) => {
+    const tasksById = new Map(window.selectedTasks.map(t => [t.id, t]));
+    const pending = new Set(tasksById.keys());
+
+    const recordTaskResult = (task, result, failed = false) => {
         const taskEl = taskList.querySelector(`[data-task-id="${task.id}"]`);
+        const passed = result.passed || false;
+        const points = result.points || 0;
+        const maxPoints = result.max_points || 0;
+
+        totalScore += points;
+        totalPoints += maxPoints;
+
+        // Update task status in modal immediately
+        taskEl.className = `grading-task-item ${passed ? 'passed' : 'failed'}`;
+        taskEl.querySelector('.icon').textContent = failed ? '!' : (passed ? '✓' : '✗');
+
+        // Track result
+        if (!failed) window.taskResults.set(task.id, { passed, points, maxPoints, graded: true });
+        results.push({
+            task: task.id,
+            check: task.description,
+            category: task.category,
+            passed,
+            points: maxPoints
+        });
 
-        try {
-            const res = await fetch(`/api/grade-task/${task.id}`, { method: 'POST' });
-            const result = await res.json();
-
-            const passed = result.passed || false;
-            const points = result.points || 0;
-            const maxPoints = result.max_points || 0;
-
-            // Update totals atomically
-            totalScore += points;
-            totalPoints += maxPoints;
-
-            // Update task status in modal immediately
-            taskEl.className = `grading-task-item ${passed ? 'passed' : 'failed'}`;
-            taskEl.querySelector('.icon').textContent = passed ? '✓' : '✗';
-
-            // Track result
-            window.taskResults.set(task.id, { passed, points, maxPoints, graded: true });
-            results.push({
-                task: task.id,
-                check: task.description,
-                category: task.category,
-                passed,
-                points: maxPoints
-            });
+        // Update progress bar as each task completes
+        pending.delete(task.id);
+        completedCount++;
+        const pct = (completedCount / window.selectedTasks.length) * 100;
+        progressFill.style.width = pct + '%';
+        statusEl.textContent = `Graded ${completedCount} of ${window.selectedTasks.length} tasks...`;
+    };
 
-            return { success: true, passed, points, maxPoints };
-
-        } catch (e) {
-            taskEl.className = 'grading-task-item failed';
-            taskEl.querySelector('.icon').textContent = '!';
-            results.push({
-                task: task.id,
-                check: task.description,
-                category: task.category,
-                passed: false,
-                points: 0
+    // Grade as a server-side job and poll it; ESC cancels the job
+    try {
+        const res = await fetch('/api/jobs', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ tasks: window.selectedTasks.map(t => t.id) })
+        });
+        if (!res.ok) throw new Error(`Grading request failed (${res.status})`);
+        const { job_id: jobId } = await res.json();
+        window.gradingJobId = jobId;
+        if (window.gradingAborted) abortGrading();
+
+        let since = 0;
+        while (true) {
+            const jobRes = await fetch(`/api/jobs/${jobId}?since=${since}`);
+            if (!jobRes.ok) throw new Error(`Grading job lookup failed (${jobRes.status})`);
+            const job = await jobRes.json();
+            since = job.next;
+
+            job.tasks.forEach(record => {
+                if (record.error === 'Grading cancelled' || !pending.has(record.task_id)) return;
+                recordTaskResult(tasksById.get(record.task_id), record, Boolean(record.error));
             });
-            return { success: false };
-        } finally {
-            // Update progress bar as each task completes
-            completedCount++;
-            const pct = (completedCount / window.selectedTasks.length) * 100;
-            progressFill.style.width = pct + '%';
-            statusEl.textContent = `Graded ${completedCount} of ${window.selectedTasks.length} tasks...`;
+            if (job.status === 'completed' || job.status === 'cancelled') break;
+            await new Promise(r => setTimeout(r, 500));
         }
-    });
+    } catch (e) {
+        console.error('Grading job failed:', e);
+    } finally {
+        window.gradingJobId = null;
+    }
 
-    // Wait for all grading to complete
-    await Promise.all(gradingPromises);
+    // Anything the stream did not report counts as failed
+    pending.forEach(taskId => recordTaskResult(tasksById.get(taskId), { passed: false }, true));
 
     // Remove ESC key listener
     document.removeEventListener('keydown', handleGradingEsc);
@@ -299,6 +299,50 @@ function updateVmInfoModal() {
 // Reboot Modal Functions
 let pendingReboot = null;
 
+// Progress and label for each state a reboot goes through (see /api/reboot-vm)
+const REBOOT_PROGRESS = {
+    queued: [5, 'Sending signal...'],
+    sent: [15, 'System shutting down...'],
+    down: [35, 'System restarting...'],
+    booting: [60, 'Booting...'],
+    'sshd-up': [85, 'Waiting for SSH...'],
+    ready: [100, 'Online']
+};
+
+// Reboot a node and follow its state events; resolves to { node, ok, message }
+async function rebootAndWait(node, onState) {
+    const res = await fetch('/api/reboot-vm', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ node })
+    });
+    const data = await res.json();
+    if (!res.ok) return { node, ok: false, message: data.error || 'Reboot failed' };
+    if (onState) onState(data.state);
+
+    return new Promise(resolve => {
+        const events = new EventSource(data.events_url);
+        events.addEventListener('state', e => {
+            const event = JSON.parse(e.data);
+            if (onState) onState(event.state);
+            if (event.state === 'ready' || event.state === 'failed') {
+                events.close();
+                resolve({ node, ok: event.state === 'ready', message: event.message });
+            }
+        });
+        events.onerror = async () => {
+            // Stream dropped: settle from the stored state instead of reconnecting forever
+            events.close();
+            try {
+                const state = await (await fetch(data.url)).json();
+                resolve({ node, ok: state.ok, message: state.error || (state.ok ? null : 'Lost track of reboot') });
+            } catch (err) {
+                resolve({ node, ok: false, message: 'Network error' });
+            }
+        };
+    });
+}
+
 function showRebootModal() {
     document.getElementById('reboot-modal').classList.remove('hidden');
     // Reset states
@@ -383,37 +427,17 @@ async function rebootNode(target) {
         document.getElementById('status-both').textContent = 'Waiting for systems to come back online...';
     }
 
-    // Progress Animation Loop
-    const progressIntervals = {};
-    nodes.forEach(node => {
-        let p = 0;
-        const progressEl = document.getElementById(`progress-${node}`);
-        const statusEl = document.getElementById(`status-${node}`);
-
-        progressIntervals[node] = setInterval(() => {
-            p += 1;
-            if (p > 95) p = 95; // Hold at 95% until done
-            progressEl.style.width = p + '%';
-
-            // Cycle messages
-            if (p < 20) statusEl.textContent = 'Sending signal...';
-            else if (p < 50) statusEl.textContent = 'System restarting...';
-            else if (p < 80) statusEl.textContent = 'Waiting for SSH...';
-            else statusEl.textContent = 'Finalizing...';
-        }, 600); // ~60 seconds to reach 95%
-    });
-
     try {
-        // Execute reboots in parallel
+        // Execute reboots in parallel, showing each node's actual progress
         const promises = nodes.map(async (node) => {
+            const progressEl = document.getElementById(`progress-${node}`);
+            const statusEl = document.getElementById(`status-${node}`);
             try {
-                const res = await fetch('/api/reboot-vm', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ node })
+                return await rebootAndWait(node, state => {
+                    const [percent, label] = REBOOT_PROGRESS[state] || [95, 'Finalizing...'];
+                    progressEl.style.width = percent + '%';
+                    statusEl.textContent = label;
                 });
-                const data = await res.json();
-                return { node, ok: data.ok, message: data.message };
             } catch (e) {
                 return { node, ok: false, message: 'Network error' };
             }
@@ -423,8 +447,6 @@ async function rebootNode(target) {
 
         // Update UI with results
         results.forEach(result => {
-            clearInterval(progressIntervals[result.node]);
-
             const card = document.getElementById(`card-${result.node}`);
             const status = document.getElementById(`status-${result.node}`);
             const progress = document.getElementById(`progress-${result.node}`);
@@ -470,7 +492,6 @@ async function rebootNode(target) {
 
         // Cleanup on error
         nodes.forEach(node => {
-            clearInterval(progressIntervals[node]);
             const card = document.getElementById(`card-${node}`);
             const status = document.getElementById(`status-${node}`);
             card.className = 'reboot-target-card error';